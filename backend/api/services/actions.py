@@ -20,6 +20,7 @@ from api.models import ExportAudit, JobRun
 from api.services.clickhouse import execute_sql, ping as clickhouse_ping
 from api.services.errors import ServiceError
 from api.services.settings import env_int, env_str
+from api.services.sql_templates import render_raw_ttl_days
 from api.services.storage import (
     storage_access_key,
     storage_bucket,
@@ -293,6 +294,8 @@ def _refresh_mart(run: JobRun) -> str:
     if not sql_path.exists():
         raise ServiceError("MART_SQL_MISSING", f"File not found: {sql_path}", 500)
     sql = sql_path.read_text(encoding="utf-8")
+    # Quality snapshots cover the same window as the raw TTL rendered by probablyfresh.jobs.init_clickhouse.
+    sql = render_raw_ttl_days(sql, env_int("CLICKHOUSE_RAW_TTL_DAYS", 180))
 
     # Wait for ClickHouse readiness similar to existing shell workflow.
     for _ in range(10):
@@ -135,8 +135,15 @@ def _split_sql_statements(sql: str) -> list[str]:
     in_single_quote = False
     in_double_quote = False
     escape_next = False
+    in_line_comment = False
+
+    for index, ch in enumerate(sql):
+        if in_line_comment:
+            if ch == "\n":
+                in_line_comment = False
+                current.append(ch)
+            continue
 
-    for ch in sql:
         if escape_next:
             current.append(ch)
             escape_next = False
@@ -157,6 +164,10 @@ def _split_sql_statements(sql: str) -> list[str]:
             current.append(ch)
             continue
 
+        if ch == "-" and sql.startswith("--", index) and not in_single_quote and not in_double_quote:
+            in_line_comment = True
+            continue
+
         if ch == ";" and not in_single_quote and not in_double_quote:
             statement = "".join(current).strip()
             if statement:
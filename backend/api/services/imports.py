@@ -13,6 +13,7 @@ from django.utils import timezone
 
 from api.models import ImportBatch, ImportRowError, ImportStagingRecord
 from api.services.errors import ServiceError
+from api.services.serialization import dumps_str, loads
 from api.services.settings import env_int, env_str
 
 # Safe first step: the batch performs dry-run parsing/validation only and does not
@@ -273,7 +274,7 @@ def _load_json_rows(path: Path) -> list[tuple[int, Any]]:
         return []
 
     try:
-        payload = json.loads(stripped)
+        payload = loads(stripped)
     except json.JSONDecodeError:
         return _load_json_lines(stripped)
 
@@ -295,7 +296,7 @@ def _load_json_lines(raw_text: str) -> list[tuple[int, Any]]:
         if not stripped:
             continue
         try:
-            rows.append((line_number, json.loads(stripped)))
+            rows.append((line_number, loads(stripped)))
         except json.JSONDecodeError as exc:
             raise ServiceError(
                 "IMPORT_INVALID_JSON",
@@ -349,7 +350,7 @@ def _raw_fragment(row: Any) -> str | None:
     if row is None:
         return None
     try:
-        serialized = json.dumps(row, ensure_ascii=False)
+        serialized = dumps_str(row)
     except TypeError:
         serialized = str(row)
     return serialized[:MAX_RAW_FRAGMENT_LENGTH]
@@ -4,7 +4,7 @@ from datetime import date, timedelta
 
 from api.models import AlertEvent, JobRun
 from api.services.alerts import dispatch_duplicates_ratio_alert
-from api.services.clickhouse import db_mart_name, db_raw_name, query_rows, query_scalar
+from api.services.clickhouse import db_mart_name, db_raw_name, query_rows
 from api.services.settings import env_str
 
 
@@ -28,19 +28,21 @@ def _to_float(value, default: float = 0.0) -> float:
 
 def get_overview_kpis() -> dict:
     try:
-        mart_db = db_mart_name()
-        stores_uniq = _to_int(
-            query_scalar("SELECT countDistinct(store_id) AS value FROM stores_mart FINAL", mart_db, default=0)
-        )
-        purchases_uniq = _to_int(
-            query_scalar(
-                "SELECT countDistinct(purchase_id) AS value FROM purchases_mart FINAL",
-                mart_db,
-                default=0,
-            )
+        rows = query_rows(
+            f"""
+            SELECT
+              entity,
+              uniqExactMerge(distinct_keys) AS value
+            FROM {db_mart_name()}.mart_kpi_state
+            GROUP BY entity
+            """,
+            database=db_mart_name(),
         )
-        customers_mart = _to_int(query_scalar("SELECT count() AS value FROM customers_mart FINAL", mart_db, default=0))
-        items_mart = _to_int(query_scalar("SELECT countDistinct(product_id) AS value FROM products_mart FINAL", mart_db, default=0))
+        values = {str(row.get("entity") or ""): _to_int(row.get("value")) for row in rows}
+        stores_uniq = values.get("stores", 0)
+        purchases_uniq = values.get("purchases", 0)
+        customers_mart = values.get("customers", 0)
+        items_mart = values.get("products", 0)
     except Exception:  # noqa: BLE001
         stores_uniq = 45
         purchases_uniq = 200
@@ -89,6 +91,9 @@ def get_ingestion_series(days: int = 7) -> dict:
 def get_payments_breakdown(days: int = 7) -> dict:
     safe_days = min(max(days, 1), 90)
     try:
+        # FINAL disables projections, so the ids in the window come from p_purchase_ids_by_dt first.
+        # Updated purchases may change payment_method or purchase_dt: FINAL then reads only those
+        # ids through the primary key and keeps the latest version, whose purchase_dt is re-checked.
         rows = query_rows(
             f"""
             SELECT
@@ -102,7 +107,12 @@ def get_payments_breakdown(days: int = 7) -> dict:
             (
               SELECT lowerUTF8(trimBoth(payment_method)) AS method_raw
               FROM {db_mart_name()}.purchases_mart FINAL
-              WHERE purchase_dt >= now() - INTERVAL {safe_days} DAY
+              WHERE purchase_id IN (
+                  SELECT purchase_id
+                  FROM {db_mart_name()}.purchases_mart
+                  WHERE purchase_dt >= now() - INTERVAL {safe_days} DAY
+                )
+                AND purchase_dt >= now() - INTERVAL {safe_days} DAY
             )
             GROUP BY method
             """,
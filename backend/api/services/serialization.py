@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib is the fallback
+    orjson = None
+
+from api.services.settings import env_str
+
+# PROBABLYFRESH_JSON_BACKEND=json (shared with the core package) forces the stdlib over orjson.
+BACKEND = "orjson" if orjson is not None and env_str("PROBABLYFRESH_JSON_BACKEND").lower() != "json" else "json"
+
+
+def dumps(value: Any) -> bytes:
+    if BACKEND == "orjson":
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(value: Any) -> str:
+    return dumps(value).decode("utf-8")
+
+
+def loads(data: bytes | str) -> Any:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch one type either way.
+    if BACKEND == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (e.g. NaN literals); let the stdlib accept or report it.
+            pass
+    return json.loads(data)
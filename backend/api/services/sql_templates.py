@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+import re
+
+from api.services.errors import ServiceError
+
+# Twin of probablyfresh.core.sql_templates: `<n> /* RAW_TTL_DAYS */` marks the raw retention
+# intervals in the ClickHouse init SQL, and the backend renders them without importing src/.
+RAW_TTL_DAYS_MARKER = "/* RAW_TTL_DAYS */"
+_RAW_TTL_DAYS_RE = re.compile(r"\d+ /\* RAW_TTL_DAYS \*/")
+
+
+def render_raw_ttl_days(sql_text: str, ttl_days: int) -> str:
+    if ttl_days < 1:
+        raise ServiceError(
+            "INVALID_RAW_TTL_DAYS",
+            f"CLICKHOUSE_RAW_TTL_DAYS must be a positive integer, got {ttl_days}",
+            500,
+        )
+    return _RAW_TTL_DAYS_RE.sub(f"{ttl_days} {RAW_TTL_DAYS_MARKER}", sql_text)
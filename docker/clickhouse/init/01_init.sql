@@ -1,24 +1,43 @@
 CREATE DATABASE IF NOT EXISTS probablyfresh_raw;
 
+-- Raw tables are partitioned by month of ingestion. TTL deletes only whole expired parts
+-- (ttl_only_drop_parts), and expired months can be dropped with DROP PARTITION
+-- (python -m probablyfresh.jobs.drop_raw_partitions); neither rewrites data with a mutation.
+-- python -m probablyfresh.jobs.init_clickhouse renders the TTL and storage policy from CLICKHOUSE_RAW_*.
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.stores_raw
 (
     store_id String,
     store_network String,
     payload String,
+    store_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store_id'))),
+    store_network_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store_network'))),
+    store_name_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store_name'))),
+    city_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'location', 'city'))),
     ingested_at DateTime
 )
 ENGINE = MergeTree
-ORDER BY (store_id, ingested_at);
+PARTITION BY toYYYYMM(ingested_at)
+ORDER BY (store_id, ingested_at)
+TTL ingested_at + INTERVAL 180 /* RAW_TTL_DAYS */ DAY
+SETTINGS ttl_only_drop_parts = 1;
 
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.products_raw
 (
     product_id String,
     `group` String,
     payload String,
+    product_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'id'))),
+    group_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'group'))),
+    name_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'name'))),
+    price_value Float64 DEFAULT JSONExtractFloat(payload, 'price'),
+    unit_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'unit'))),
     ingested_at DateTime
 )
 ENGINE = MergeTree
-ORDER BY (product_id, ingested_at);
+PARTITION BY toYYYYMM(ingested_at)
+ORDER BY (product_id, ingested_at)
+TTL ingested_at + INTERVAL 180 /* RAW_TTL_DAYS */ DAY
+SETTINGS ttl_only_drop_parts = 1;
 
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.customers_raw
 (
@@ -27,10 +46,20 @@ CREATE TABLE IF NOT EXISTS probablyfresh_raw.customers_raw
     email_enc String,
     phone_enc String,
     payload String,
+    customer_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'customer_id'))),
+    store_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_location', 'store_id'))),
+    email_enc_norm String DEFAULT trimBoth(JSONExtractString(payload, 'email')),
+    phone_enc_norm String DEFAULT trimBoth(JSONExtractString(payload, 'phone')),
+    birth_date_parsed Nullable(Date) DEFAULT toDateOrNull(trimBoth(JSONExtractString(payload, 'birth_date'))),
+    registration_raw String DEFAULT trimBoth(JSONExtractString(payload, 'registration_date')),
+    registration_dt_parsed Nullable(DateTime) DEFAULT parseDateTimeBestEffortOrNull(trimBoth(JSONExtractString(payload, 'registration_date'))),
     ingested_at DateTime
 )
 ENGINE = MergeTree
-ORDER BY (customer_id, ingested_at);
+PARTITION BY toYYYYMM(ingested_at)
+ORDER BY (customer_id, ingested_at)
+TTL ingested_at + INTERVAL 180 /* RAW_TTL_DAYS */ DAY
+SETTINGS ttl_only_drop_parts = 1;
 
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.purchases_raw
 (
@@ -40,10 +69,20 @@ CREATE TABLE IF NOT EXISTS probablyfresh_raw.purchases_raw
     total_amount Nullable(Float64),
     purchase_datetime Nullable(DateTime),
     payload String,
+    purchase_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_id'))),
+    customer_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'customer', 'customer_id'))),
+    store_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store', 'store_id'))),
+    total_amount_value Float64 DEFAULT JSONExtractFloat(payload, 'total_amount'),
+    payment_method_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'payment_method'))),
+    is_delivery_value UInt8 DEFAULT toUInt8(JSONExtractBool(payload, 'is_delivery')),
+    purchase_dt_parsed Nullable(DateTime) DEFAULT parseDateTimeBestEffortOrNull(trimBoth(JSONExtractString(payload, 'purchase_datetime'))),
     ingested_at DateTime
 )
 ENGINE = MergeTree
-ORDER BY (purchase_id, ingested_at);
+PARTITION BY toYYYYMM(ingested_at)
+ORDER BY (purchase_id, ingested_at)
+TTL ingested_at + INTERVAL 180 /* RAW_TTL_DAYS */ DAY
+SETTINGS ttl_only_drop_parts = 1;
 
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.purchase_items_raw
 (
@@ -60,8 +99,48 @@ CREATE TABLE IF NOT EXISTS probablyfresh_raw.purchase_items_raw
     ingested_at DateTime
 )
 ENGINE = ReplacingMergeTree(ingested_at)
-ORDER BY (purchase_id, product_id, ingested_at);
+PARTITION BY toYYYYMM(ingested_at)
+ORDER BY (purchase_id, product_id, ingested_at)
+TTL ingested_at + INTERVAL 180 /* RAW_TTL_DAYS */ DAY
+SETTINGS ttl_only_drop_parts = 1;
 
+-- Typed, normalized columns are computed from payload once, when a row is inserted.
+-- The marts and mart_quality_stats read them instead of parsing JSON again.
+-- The ALTERs upgrade raw tables created before these columns existed;
+-- for old parts the values are computed on read until the column is materialized.
+ALTER TABLE probablyfresh_raw.stores_raw
+    ADD COLUMN IF NOT EXISTS store_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store_id'))) AFTER payload,
+    ADD COLUMN IF NOT EXISTS store_network_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store_network'))) AFTER store_id_norm,
+    ADD COLUMN IF NOT EXISTS store_name_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store_name'))) AFTER store_network_norm,
+    ADD COLUMN IF NOT EXISTS city_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'location', 'city'))) AFTER store_name_norm;
+
+ALTER TABLE probablyfresh_raw.products_raw
+    ADD COLUMN IF NOT EXISTS product_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'id'))) AFTER payload,
+    ADD COLUMN IF NOT EXISTS group_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'group'))) AFTER product_id_norm,
+    ADD COLUMN IF NOT EXISTS name_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'name'))) AFTER group_norm,
+    ADD COLUMN IF NOT EXISTS price_value Float64 DEFAULT JSONExtractFloat(payload, 'price') AFTER name_norm,
+    ADD COLUMN IF NOT EXISTS unit_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'unit'))) AFTER price_value;
+
+ALTER TABLE probablyfresh_raw.customers_raw
+    ADD COLUMN IF NOT EXISTS customer_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'customer_id'))) AFTER payload,
+    ADD COLUMN IF NOT EXISTS store_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_location', 'store_id'))) AFTER customer_id_norm,
+    ADD COLUMN IF NOT EXISTS email_enc_norm String DEFAULT trimBoth(JSONExtractString(payload, 'email')) AFTER store_id_norm,
+    ADD COLUMN IF NOT EXISTS phone_enc_norm String DEFAULT trimBoth(JSONExtractString(payload, 'phone')) AFTER email_enc_norm,
+    ADD COLUMN IF NOT EXISTS birth_date_parsed Nullable(Date) DEFAULT toDateOrNull(trimBoth(JSONExtractString(payload, 'birth_date'))) AFTER phone_enc_norm,
+    ADD COLUMN IF NOT EXISTS registration_raw String DEFAULT trimBoth(JSONExtractString(payload, 'registration_date')) AFTER birth_date_parsed,
+    ADD COLUMN IF NOT EXISTS registration_dt_parsed Nullable(DateTime) DEFAULT parseDateTimeBestEffortOrNull(trimBoth(JSONExtractString(payload, 'registration_date'))) AFTER registration_raw;
+
+ALTER TABLE probablyfresh_raw.purchases_raw
+    ADD COLUMN IF NOT EXISTS purchase_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_id'))) AFTER payload,
+    ADD COLUMN IF NOT EXISTS customer_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'customer', 'customer_id'))) AFTER purchase_id_norm,
+    ADD COLUMN IF NOT EXISTS store_id_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'store', 'store_id'))) AFTER customer_id_norm,
+    ADD COLUMN IF NOT EXISTS total_amount_value Float64 DEFAULT JSONExtractFloat(payload, 'total_amount') AFTER store_id_norm,
+    ADD COLUMN IF NOT EXISTS payment_method_norm String DEFAULT lowerUTF8(trimBoth(JSONExtractString(payload, 'payment_method'))) AFTER total_amount_value,
+    ADD COLUMN IF NOT EXISTS is_delivery_value UInt8 DEFAULT toUInt8(JSONExtractBool(payload, 'is_delivery')) AFTER payment_method_norm,
+    ADD COLUMN IF NOT EXISTS purchase_dt_parsed Nullable(DateTime) DEFAULT parseDateTimeBestEffortOrNull(trimBoth(JSONExtractString(payload, 'purchase_datetime'))) AFTER is_delivery_value;
+
+-- kafka_* consumer settings below are the defaults for a manual clickhouse-client run;
+-- python -m probablyfresh.jobs.init_clickhouse replaces them from CLICKHOUSE_KAFKA_* variables.
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.stores_kafka
 (
     payload String
@@ -72,7 +151,10 @@ SETTINGS
     kafka_topic_list = 'probablyfresh.stores',
     kafka_group_name = 'probablyfresh_stores_consumer',
     kafka_format = 'RawBLOB',
-    kafka_num_consumers = 1;
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
 
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.products_kafka
 (
@@ -84,7 +166,10 @@ SETTINGS
     kafka_topic_list = 'probablyfresh.products',
     kafka_group_name = 'probablyfresh_products_consumer',
     kafka_format = 'RawBLOB',
-    kafka_num_consumers = 1;
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
 
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.customers_kafka
 (
@@ -96,7 +181,10 @@ SETTINGS
     kafka_topic_list = 'probablyfresh.customers',
     kafka_group_name = 'probablyfresh_customers_consumer',
     kafka_format = 'RawBLOB',
-    kafka_num_consumers = 1;
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
 
 CREATE TABLE IF NOT EXISTS probablyfresh_raw.purchases_kafka
 (
@@ -108,7 +196,10 @@ SETTINGS
     kafka_topic_list = 'probablyfresh.purchases',
     kafka_group_name = 'probablyfresh_purchases_consumer',
     kafka_format = 'RawBLOB',
-    kafka_num_consumers = 1;
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
 
 CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_raw.mv_stores_raw
 TO probablyfresh_raw.stores_raw
@@ -173,9 +264,9 @@ SELECT
 FROM
 (
     SELECT
-        lowerUTF8(trimBoth(purchase_id)) AS purchase_id,
-        lowerUTF8(trimBoth(customer_id)) AS customer_id,
-        lowerUTF8(trimBoth(store_id)) AS store_id,
+        purchase_id_norm AS purchase_id,
+        customer_id_norm AS customer_id,
+        store_id_norm AS store_id,
         lowerUTF8(trimBoth(JSONExtractString(item_payload, 'product_id'))) AS product_id,
         lowerUTF8(trimBoth(JSONExtractString(item_payload, 'category'))) AS category,
         JSONExtractFloat(item_payload, 'quantity') AS quantity,
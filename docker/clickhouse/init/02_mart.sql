@@ -49,10 +49,31 @@ CREATE TABLE IF NOT EXISTS probablyfresh_mart.purchases_mart
     is_delivery UInt8,
     purchase_dt Nullable(DateTime),
     payload String,
-    ingested_at DateTime
+    ingested_at DateTime,
+    PROJECTION p_purchase_ids_by_dt
+    (
+        SELECT purchase_id, purchase_dt
+        ORDER BY purchase_dt
+    )
 )
 ENGINE = ReplacingMergeTree(ingested_at)
-ORDER BY purchase_id;
+ORDER BY purchase_id
+SETTINGS deduplicate_merge_projection_mode = 'rebuild', allow_nullable_key = 1;
+
+-- purchase_id carries no time order, so purchase_dt windows (backend dashboards) cannot be
+-- pruned by the primary key or a minmax index. p_purchase_ids_by_dt keeps only (purchase_id,
+-- purchase_dt) sorted by purchase_dt, not a second copy of payload. Projections are not used
+-- under FINAL, so window queries find ids through it and read FINAL rows by the primary key.
+-- The ALTERs upgrade tables created before the projection, old parts need MATERIALIZE PROJECTION.
+ALTER TABLE probablyfresh_mart.purchases_mart
+    MODIFY SETTING deduplicate_merge_projection_mode = 'rebuild', allow_nullable_key = 1;
+
+ALTER TABLE probablyfresh_mart.purchases_mart
+    ADD PROJECTION IF NOT EXISTS p_purchase_ids_by_dt
+    (
+        SELECT purchase_id, purchase_dt
+        ORDER BY purchase_dt
+    );
 
 CREATE TABLE IF NOT EXISTS probablyfresh_mart.purchase_items_mart
 (
@@ -84,14 +105,37 @@ CREATE TABLE IF NOT EXISTS probablyfresh_mart.mart_quality_stats
 ENGINE = MergeTree
 ORDER BY (entity, event_time);
 
+-- Per-day quality counters maintained by MVs on raw inserts. A mart_quality_stats snapshot
+-- merges at most (entities x retention days) rows instead of rescanning raw history.
+-- Existing raw data is loaded once with docker/clickhouse/optional/04_quality_state_backfill.sql.
+CREATE TABLE IF NOT EXISTS probablyfresh_mart.raw_quality_state
+(
+    entity LowCardinality(String),
+    ingest_date Date,
+    total_rows SimpleAggregateFunction(sum, UInt64),
+    valid_rows SimpleAggregateFunction(sum, UInt64),
+    distinct_keys AggregateFunction(uniqExact, String)
+)
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(ingest_date)
+ORDER BY (entity, ingest_date)
+TTL ingest_date + INTERVAL 180 /* RAW_TTL_DAYS */ DAY;
+
+-- Distinct business keys per mart, maintained by MVs on mart inserts. The overview KPIs merge
+-- four uniqExact states instead of running countDistinct over each mart with FINAL.
+-- Marts never delete keys, so the merged counts equal the FINAL counts. States are set unions:
+-- re-inserting the same keys (replays, docker/clickhouse/optional/05_kpi_state_backfill.sql) is harmless.
+CREATE TABLE IF NOT EXISTS probablyfresh_mart.mart_kpi_state
+(
+    entity LowCardinality(String),
+    distinct_keys AggregateFunction(uniqExact, String)
+)
+ENGINE = AggregatingMergeTree
+ORDER BY entity;
+
 CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_stores_to_mart
 TO probablyfresh_mart.stores_mart
 AS
-WITH
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'store_id'))) AS store_id_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'store_network'))) AS store_network_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'store_name'))) AS store_name_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'location', 'city'))) AS city_norm
 SELECT
     store_id_norm AS store_id,
     store_network_norm AS store_network,
@@ -109,12 +153,6 @@ WHERE
 CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_products_to_mart
 TO probablyfresh_mart.products_mart
 AS
-WITH
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'id'))) AS product_id_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'group'))) AS group_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'name'))) AS name_norm,
-    JSONExtractFloat(payload, 'price') AS price_value,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'unit'))) AS unit_norm
 SELECT
     product_id_norm AS product_id,
     group_norm AS `group`,
@@ -133,14 +171,6 @@ WHERE
 CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_customers_to_mart
 TO probablyfresh_mart.customers_mart
 AS
-WITH
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'customer_id'))) AS customer_id_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_location', 'store_id'))) AS store_id_norm,
-    trimBoth(JSONExtractString(payload, 'email')) AS email_enc_norm,
-    trimBoth(JSONExtractString(payload, 'phone')) AS phone_enc_norm,
-    toDateOrNull(trimBoth(JSONExtractString(payload, 'birth_date'))) AS birth_date_parsed,
-    trimBoth(JSONExtractString(payload, 'registration_date')) AS registration_raw,
-    parseDateTimeBestEffortOrNull(registration_raw) AS registration_dt_parsed
 SELECT
     customer_id_norm AS customer_id,
     store_id_norm AS store_id,
@@ -165,14 +195,6 @@ WHERE
 CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_purchases_to_mart
 TO probablyfresh_mart.purchases_mart
 AS
-WITH
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_id'))) AS purchase_id_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'customer', 'customer_id'))) AS customer_id_norm,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'store', 'store_id'))) AS store_id_norm,
-    JSONExtractFloat(payload, 'total_amount') AS total_amount_value,
-    lowerUTF8(trimBoth(JSONExtractString(payload, 'payment_method'))) AS payment_method_norm,
-    toUInt8(JSONExtractBool(payload, 'is_delivery')) AS is_delivery_value,
-    parseDateTimeBestEffortOrNull(trimBoth(JSONExtractString(payload, 'purchase_datetime'))) AS purchase_dt_parsed
 SELECT
     purchase_id_norm AS purchase_id,
     customer_id_norm AS customer_id,
@@ -186,7 +208,7 @@ SELECT
 FROM probablyfresh_raw.purchases_raw
 WHERE
     purchase_id_norm != ''
-    AND match(purchase_id_norm, '^ord-[0-9]{6}$')
+    AND match(purchase_id_norm, '^ord-[0-9]{6,}$')
     AND customer_id_norm != ''
     AND match(customer_id_norm, '^cus-[0-9]{6}$')
     AND store_id_norm != ''
@@ -200,11 +222,11 @@ CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_purchase_items_to_m
 TO probablyfresh_mart.purchase_items_mart
 AS
 SELECT
-    lowerUTF8(trimBoth(purchase_id)) AS purchase_id,
-    lowerUTF8(trimBoth(customer_id)) AS customer_id,
-    lowerUTF8(trimBoth(store_id)) AS store_id,
-    lowerUTF8(trimBoth(product_id)) AS product_id,
-    lowerUTF8(trimBoth(category)) AS category,
+    purchase_id,
+    customer_id,
+    store_id,
+    product_id,
+    category,
     quantity,
     price_per_unit,
     total_price,
@@ -213,21 +235,170 @@ SELECT
     ingested_at
 FROM probablyfresh_raw.purchase_items_raw
 WHERE
-    lowerUTF8(trimBoth(purchase_id)) != ''
-    AND match(lowerUTF8(trimBoth(purchase_id)), '^ord-[0-9]{6}$')
-    AND lowerUTF8(trimBoth(customer_id)) != ''
-    AND match(lowerUTF8(trimBoth(customer_id)), '^cus-[0-9]{6}$')
-    AND lowerUTF8(trimBoth(store_id)) != ''
-    AND match(lowerUTF8(trimBoth(store_id)), '^store-[0-9]{3}$')
-    AND lowerUTF8(trimBoth(product_id)) != ''
-    AND match(lowerUTF8(trimBoth(product_id)), '^prd-[0-9]{4}$')
-    AND lowerUTF8(trimBoth(category)) != ''
+    purchase_id != ''
+    AND match(purchase_id, '^ord-[0-9]{6,}$')
+    AND customer_id != ''
+    AND match(customer_id, '^cus-[0-9]{6}$')
+    AND store_id != ''
+    AND match(store_id, '^store-[0-9]{3}$')
+    AND product_id != ''
+    AND match(product_id, '^prd-[0-9]{4}$')
+    AND category != ''
     AND purchase_dt IS NOT NULL
     AND purchase_dt <= now()
     AND quantity > 0
     AND price_per_unit >= 0
     AND total_price >= 0;
 
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_stores_quality_state
+TO probablyfresh_mart.raw_quality_state
+AS
+SELECT
+    'stores' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        store_id_norm != ''
+        AND match(store_id_norm, '^store-[0-9]{3}$')
+        AND store_network_norm != ''
+        AND city_norm != ''
+    ) AS valid_rows,
+    uniqExactState(store_id_norm) AS distinct_keys
+FROM probablyfresh_raw.stores_raw
+GROUP BY ingest_date;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_products_quality_state
+TO probablyfresh_mart.raw_quality_state
+AS
+SELECT
+    'products' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        product_id_norm != ''
+        AND match(product_id_norm, '^prd-[0-9]{4}$')
+        AND price_value >= 0
+        AND unit_norm != ''
+    ) AS valid_rows,
+    uniqExactState(product_id_norm) AS distinct_keys
+FROM probablyfresh_raw.products_raw
+GROUP BY ingest_date;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_customers_quality_state
+TO probablyfresh_mart.raw_quality_state
+AS
+SELECT
+    'customers' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        customer_id_norm != ''
+        AND match(customer_id_norm, '^cus-[0-9]{6}$')
+        AND store_id_norm != ''
+        AND match(store_id_norm, '^store-[0-9]{3}$')
+        AND (email_enc_norm = '' OR match(email_enc_norm, '^[0-9a-f]{64}$'))
+        AND (phone_enc_norm = '' OR match(phone_enc_norm, '^[0-9a-f]{64}$'))
+        AND birth_date_parsed IS NOT NULL
+        AND birth_date_parsed <= today()
+        AND (registration_raw = '' OR registration_dt_parsed IS NOT NULL)
+    ) AS valid_rows,
+    uniqExactState(customer_id_norm) AS distinct_keys
+FROM probablyfresh_raw.customers_raw
+GROUP BY ingest_date;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_purchases_quality_state
+TO probablyfresh_mart.raw_quality_state
+AS
+SELECT
+    'purchases' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        purchase_id_norm != ''
+        AND match(purchase_id_norm, '^ord-[0-9]{6,}$')
+        AND customer_id_norm != ''
+        AND match(customer_id_norm, '^cus-[0-9]{6}$')
+        AND store_id_norm != ''
+        AND match(store_id_norm, '^store-[0-9]{3}$')
+        AND total_amount_value >= 0
+        AND payment_method_norm IN ('card', 'cash', 'online_wallet', 'sbp', 'other')
+        AND purchase_dt_parsed IS NOT NULL
+        AND purchase_dt_parsed <= now()
+    ) AS valid_rows,
+    uniqExactState(purchase_id_norm) AS distinct_keys
+FROM probablyfresh_raw.purchases_raw
+GROUP BY ingest_date;
+
+-- Marts filled before mart_kpi_state existed are loaded into it here, once per entity: the
+-- state of an entity is empty only until its MV below exists. Keys inserted between this load
+-- and the MV creation are picked up by re-running optional/05_kpi_state_backfill.sql.
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'stores' AS entity,
+    uniqExactState(store_id) AS distinct_keys
+FROM probablyfresh_mart.stores_mart
+WHERE (SELECT count() FROM probablyfresh_mart.mart_kpi_state WHERE entity = 'stores') = 0
+GROUP BY entity;
+
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'products' AS entity,
+    uniqExactState(product_id) AS distinct_keys
+FROM probablyfresh_mart.products_mart
+WHERE (SELECT count() FROM probablyfresh_mart.mart_kpi_state WHERE entity = 'products') = 0
+GROUP BY entity;
+
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'customers' AS entity,
+    uniqExactState(customer_id) AS distinct_keys
+FROM probablyfresh_mart.customers_mart
+WHERE (SELECT count() FROM probablyfresh_mart.mart_kpi_state WHERE entity = 'customers') = 0
+GROUP BY entity;
+
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'purchases' AS entity,
+    uniqExactState(purchase_id) AS distinct_keys
+FROM probablyfresh_mart.purchases_mart
+WHERE (SELECT count() FROM probablyfresh_mart.mart_kpi_state WHERE entity = 'purchases') = 0
+GROUP BY entity;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_stores_kpi_state
+TO probablyfresh_mart.mart_kpi_state
+AS
+SELECT
+    'stores' AS entity,
+    uniqExactState(store_id) AS distinct_keys
+FROM probablyfresh_mart.stores_mart;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_products_kpi_state
+TO probablyfresh_mart.mart_kpi_state
+AS
+SELECT
+    'products' AS entity,
+    uniqExactState(product_id) AS distinct_keys
+FROM probablyfresh_mart.products_mart;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_customers_kpi_state
+TO probablyfresh_mart.mart_kpi_state
+AS
+SELECT
+    'customers' AS entity,
+    uniqExactState(customer_id) AS distinct_keys
+FROM probablyfresh_mart.customers_mart;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS probablyfresh_mart.mv_purchases_kpi_state
+TO probablyfresh_mart.mart_kpi_state
+AS
+SELECT
+    'purchases' AS entity,
+    uniqExactState(purchase_id) AS distinct_keys
+FROM probablyfresh_mart.purchases_mart;
+
+-- Quality snapshots cover the raw retention window (CLICKHOUSE_RAW_TTL_DAYS, 180 by default)
+-- at day granularity and read only raw_quality_state, never the raw tables. Every
+-- `<n> /* RAW_TTL_DAYS */` is rendered by probablyfresh.core.sql_templates.render_raw_ttl_days.
 INSERT INTO probablyfresh_mart.mart_quality_stats
 SELECT
     now() AS event_time,
@@ -240,22 +411,11 @@ SELECT
 FROM
 (
     SELECT
-        count() AS total_rows_raw,
-        countIf(
-            store_id_norm != ''
-            AND match(store_id_norm, '^store-[0-9]{3}$')
-            AND store_network_norm != ''
-            AND city_norm != ''
-        ) AS inserted_rows_mart,
-        count() - countDistinct(store_id_norm) AS duplicates_rows
-    FROM
-    (
-        SELECT
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'store_id'))) AS store_id_norm,
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'store_network'))) AS store_network_norm,
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'location', 'city'))) AS city_norm
-        FROM probablyfresh_raw.stores_raw
-    )
+        sum(total_rows) AS total_rows_raw,
+        sum(valid_rows) AS inserted_rows_mart,
+        total_rows_raw - uniqExactMerge(distinct_keys) AS duplicates_rows
+    FROM probablyfresh_mart.raw_quality_state
+    WHERE entity = 'stores' AND ingest_date >= toDate(now() - INTERVAL 180 /* RAW_TTL_DAYS */ DAY)
 );
 
 INSERT INTO probablyfresh_mart.mart_quality_stats
@@ -270,22 +430,11 @@ SELECT
 FROM
 (
     SELECT
-        count() AS total_rows_raw,
-        countIf(
-            product_id_norm != ''
-            AND match(product_id_norm, '^prd-[0-9]{4}$')
-            AND price_value >= 0
-            AND unit_norm != ''
-        ) AS inserted_rows_mart,
-        count() - countDistinct(product_id_norm) AS duplicates_rows
-    FROM
-    (
-        SELECT
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'id'))) AS product_id_norm,
-            JSONExtractFloat(payload, 'price') AS price_value,
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'unit'))) AS unit_norm
-        FROM probablyfresh_raw.products_raw
-    )
+        sum(total_rows) AS total_rows_raw,
+        sum(valid_rows) AS inserted_rows_mart,
+        total_rows_raw - uniqExactMerge(distinct_keys) AS duplicates_rows
+    FROM probablyfresh_mart.raw_quality_state
+    WHERE entity = 'products' AND ingest_date >= toDate(now() - INTERVAL 180 /* RAW_TTL_DAYS */ DAY)
 );
 
 INSERT INTO probablyfresh_mart.mart_quality_stats
@@ -300,31 +449,11 @@ SELECT
 FROM
 (
     SELECT
-        count() AS total_rows_raw,
-        countIf(
-            customer_id_norm != ''
-            AND match(customer_id_norm, '^cus-[0-9]{6}$')
-            AND store_id_norm != ''
-            AND match(store_id_norm, '^store-[0-9]{3}$')
-            AND (email_enc_norm = '' OR match(email_enc_norm, '^[0-9a-f]{64}$'))
-            AND (phone_enc_norm = '' OR match(phone_enc_norm, '^[0-9a-f]{64}$'))
-            AND birth_date_parsed IS NOT NULL
-            AND birth_date_parsed <= today()
-            AND (registration_raw = '' OR registration_dt_parsed IS NOT NULL)
-        ) AS inserted_rows_mart,
-        count() - countDistinct(customer_id_norm) AS duplicates_rows
-    FROM
-    (
-        SELECT
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'customer_id'))) AS customer_id_norm,
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_location', 'store_id'))) AS store_id_norm,
-            trimBoth(JSONExtractString(payload, 'email')) AS email_enc_norm,
-            trimBoth(JSONExtractString(payload, 'phone')) AS phone_enc_norm,
-            toDateOrNull(trimBoth(JSONExtractString(payload, 'birth_date'))) AS birth_date_parsed,
-            trimBoth(JSONExtractString(payload, 'registration_date')) AS registration_raw,
-            parseDateTimeBestEffortOrNull(registration_raw) AS registration_dt_parsed
-        FROM probablyfresh_raw.customers_raw
-    )
+        sum(total_rows) AS total_rows_raw,
+        sum(valid_rows) AS inserted_rows_mart,
+        total_rows_raw - uniqExactMerge(distinct_keys) AS duplicates_rows
+    FROM probablyfresh_mart.raw_quality_state
+    WHERE entity = 'customers' AND ingest_date >= toDate(now() - INTERVAL 180 /* RAW_TTL_DAYS */ DAY)
 );
 
 INSERT INTO probablyfresh_mart.mart_quality_stats
@@ -339,29 +468,9 @@ SELECT
 FROM
 (
     SELECT
-        count() AS total_rows_raw,
-        countIf(
-            purchase_id_norm != ''
-            AND match(purchase_id_norm, '^ord-[0-9]{6}$')
-            AND customer_id_norm != ''
-            AND match(customer_id_norm, '^cus-[0-9]{6}$')
-            AND store_id_norm != ''
-            AND match(store_id_norm, '^store-[0-9]{3}$')
-            AND total_amount_value >= 0
-            AND payment_method_norm IN ('card', 'cash', 'online_wallet', 'sbp', 'other')
-            AND purchase_dt_parsed IS NOT NULL
-            AND purchase_dt_parsed <= now()
-        ) AS inserted_rows_mart,
-        count() - countDistinct(purchase_id_norm) AS duplicates_rows
-    FROM
-    (
-        SELECT
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'purchase_id'))) AS purchase_id_norm,
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'customer', 'customer_id'))) AS customer_id_norm,
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'store', 'store_id'))) AS store_id_norm,
-            JSONExtractFloat(payload, 'total_amount') AS total_amount_value,
-            lowerUTF8(trimBoth(JSONExtractString(payload, 'payment_method'))) AS payment_method_norm,
-            parseDateTimeBestEffortOrNull(trimBoth(JSONExtractString(payload, 'purchase_datetime'))) AS purchase_dt_parsed
-        FROM probablyfresh_raw.purchases_raw
-    )
+        sum(total_rows) AS total_rows_raw,
+        sum(valid_rows) AS inserted_rows_mart,
+        total_rows_raw - uniqExactMerge(distinct_keys) AS duplicates_rows
+    FROM probablyfresh_mart.raw_quality_state
+    WHERE entity = 'purchases' AND ingest_date >= toDate(now() - INTERVAL 180 /* RAW_TTL_DAYS */ DAY)
 );
@@ -0,0 +1,300 @@
+-- Switches RAW ingestion from JSON (RawBLOB) to Protobuf messages (KAFKA_PAYLOAD_FORMAT=protobuf).
+-- Apply after 01_init.sql, once producers publish with the same format. The schema is
+-- docker/clickhouse/format_schemas/probablyfresh.proto, mounted into /etc/clickhouse-server/format_schemas
+-- (format_schema_path is set in config.d/format_schemas.xml).
+-- The *_raw tables are unchanged: the views rebuild `payload` as JSON from the decoded columns,
+-- so 02_mart.sql and mv_purchase_items_from_purchases_raw keep working as before.
+-- New consumer groups are used on purpose: JSON messages already in a topic cannot be decoded.
+
+DROP VIEW IF EXISTS probablyfresh_raw.mv_stores_raw;
+DROP VIEW IF EXISTS probablyfresh_raw.mv_products_raw;
+DROP VIEW IF EXISTS probablyfresh_raw.mv_customers_raw;
+DROP VIEW IF EXISTS probablyfresh_raw.mv_purchases_raw;
+
+DROP TABLE IF EXISTS probablyfresh_raw.stores_kafka;
+DROP TABLE IF EXISTS probablyfresh_raw.products_kafka;
+DROP TABLE IF EXISTS probablyfresh_raw.customers_kafka;
+DROP TABLE IF EXISTS probablyfresh_raw.purchases_kafka;
+
+CREATE TABLE probablyfresh_raw.stores_kafka
+(
+    store_id String,
+    store_name String,
+    store_network String,
+    store_type_description String,
+    `type` String,
+    categories Array(String),
+    manager Tuple(name String, phone String, email String),
+    location Tuple(
+        country String,
+        city String,
+        street String,
+        house String,
+        postal_code String,
+        coordinates Tuple(latitude Float64, longitude Float64)
+    ),
+    opening_hours Tuple(mon_fri String, sat String, sun String),
+    accepts_online_orders Bool,
+    delivery_available Bool,
+    warehouse_connected Bool,
+    last_inventory_date String
+)
+ENGINE = Kafka
+SETTINGS
+    kafka_broker_list = 'kafka:9092',
+    kafka_topic_list = 'probablyfresh.stores',
+    kafka_group_name = 'probablyfresh_stores_pb_consumer',
+    kafka_format = 'ProtobufSingle',
+    kafka_schema = 'probablyfresh.proto:Store',
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
+
+CREATE TABLE probablyfresh_raw.products_kafka
+(
+    id String,
+    name String,
+    `group` String,
+    description String,
+    kbju Tuple(calories Float64, protein Float64, fat Float64, carbohydrates Float64),
+    price Float64,
+    unit String,
+    origin_country String,
+    expiry_days Int32,
+    is_organic Bool,
+    barcode String,
+    manufacturer Tuple(name String, country String, website String, inn String)
+)
+ENGINE = Kafka
+SETTINGS
+    kafka_broker_list = 'kafka:9092',
+    kafka_topic_list = 'probablyfresh.products',
+    kafka_group_name = 'probablyfresh_products_pb_consumer',
+    kafka_format = 'ProtobufSingle',
+    kafka_schema = 'probablyfresh.proto:Product',
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
+
+CREATE TABLE probablyfresh_raw.customers_kafka
+(
+    customer_id String,
+    first_name String,
+    last_name String,
+    email String,
+    phone String,
+    birth_date String,
+    gender String,
+    registration_date String,
+    is_loyalty_member Bool,
+    loyalty_card_number String,
+    purchase_location Tuple(
+        store_id String,
+        store_name String,
+        store_network String,
+        store_type_description String,
+        country String,
+        city String,
+        street String,
+        house String,
+        postal_code String
+    ),
+    delivery_address Tuple(
+        country String,
+        city String,
+        street String,
+        house String,
+        apartment String,
+        postal_code String
+    ),
+    preferences Tuple(preferred_language String, preferred_payment_method String, receive_promotions Bool)
+)
+ENGINE = Kafka
+SETTINGS
+    kafka_broker_list = 'kafka:9092',
+    kafka_topic_list = 'probablyfresh.customers',
+    kafka_group_name = 'probablyfresh_customers_pb_consumer',
+    kafka_format = 'ProtobufSingle',
+    kafka_schema = 'probablyfresh.proto:Customer',
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
+
+CREATE TABLE probablyfresh_raw.purchases_kafka
+(
+    purchase_id String,
+    customer Tuple(
+        customer_id String,
+        first_name String,
+        last_name String,
+        email String,
+        phone String,
+        is_loyalty_member Bool,
+        loyalty_card_number String
+    ),
+    store Tuple(
+        store_id String,
+        store_name String,
+        store_network String,
+        store_type_description String,
+        location Tuple(
+            country String,
+            city String,
+            street String,
+            house String,
+            postal_code String,
+            coordinates Tuple(latitude Float64, longitude Float64)
+        )
+    ),
+    items Array(Tuple(
+        product_id String,
+        name String,
+        category String,
+        quantity Float64,
+        unit String,
+        price_per_unit Float64,
+        total_price Float64,
+        kbju Tuple(calories Float64, protein Float64, fat Float64, carbohydrates Float64),
+        manufacturer Tuple(name String, country String, website String, inn String)
+    )),
+    total_amount Float64,
+    payment_method String,
+    is_delivery Bool,
+    purchase_datetime String,
+    delivery_address Tuple(
+        country String,
+        city String,
+        street String,
+        house String,
+        apartment String,
+        postal_code String
+    )
+)
+ENGINE = Kafka
+SETTINGS
+    kafka_broker_list = 'kafka:9092',
+    kafka_topic_list = 'probablyfresh.purchases',
+    kafka_group_name = 'probablyfresh_purchases_pb_consumer',
+    kafka_format = 'ProtobufSingle',
+    kafka_schema = 'probablyfresh.proto:Purchase',
+    kafka_num_consumers = 1,
+    kafka_max_block_size = 1048576,
+    kafka_flush_interval_ms = 7500,
+    kafka_thread_per_consumer = 0;
+
+-- formatRowNoNewline('JSONEachRow', ...) names keys after the columns and renders named tuples
+-- as objects, which reproduces the producer's JSON document shape.
+CREATE MATERIALIZED VIEW probablyfresh_raw.mv_stores_raw
+TO probablyfresh_raw.stores_raw
+AS
+SELECT
+    store_id,
+    store_network,
+    formatRowNoNewline(
+        'JSONEachRow',
+        store_id,
+        store_name,
+        store_network,
+        store_type_description,
+        `type`,
+        categories,
+        manager,
+        location,
+        opening_hours,
+        accepts_online_orders,
+        delivery_available,
+        warehouse_connected,
+        last_inventory_date
+    ) AS payload,
+    now() AS ingested_at
+FROM probablyfresh_raw.stores_kafka;
+
+CREATE MATERIALIZED VIEW probablyfresh_raw.mv_products_raw
+TO probablyfresh_raw.products_raw
+AS
+SELECT
+    id AS product_id,
+    `group`,
+    formatRowNoNewline(
+        'JSONEachRow',
+        id,
+        name,
+        `group`,
+        description,
+        kbju,
+        price,
+        unit,
+        origin_country,
+        expiry_days,
+        is_organic,
+        barcode,
+        manufacturer
+    ) AS payload,
+    now() AS ingested_at
+FROM probablyfresh_raw.products_kafka;
+
+CREATE MATERIALIZED VIEW probablyfresh_raw.mv_customers_raw
+TO probablyfresh_raw.customers_raw
+AS
+SELECT
+    customer_id,
+    tupleElement(purchase_location, 'store_id') AS store_id,
+    email AS email_enc,
+    phone AS phone_enc,
+    formatRowNoNewline(
+        'JSONEachRow',
+        customer_id,
+        first_name,
+        last_name,
+        email,
+        phone,
+        birth_date,
+        gender,
+        registration_date,
+        is_loyalty_member,
+        loyalty_card_number,
+        purchase_location,
+        delivery_address,
+        preferences
+    ) AS payload,
+    now() AS ingested_at
+FROM probablyfresh_raw.customers_kafka;
+
+CREATE MATERIALIZED VIEW probablyfresh_raw.mv_purchases_raw
+TO probablyfresh_raw.purchases_raw
+AS
+SELECT
+    purchase_id,
+    customer_id,
+    store_id,
+    total_amount,
+    parseDateTimeBestEffortOrNull(purchase_datetime_text) AS purchase_datetime,
+    payload,
+    now() AS ingested_at
+FROM
+(
+    -- The inner query keeps purchase_datetime a String inside formatRowNoNewline;
+    -- an outer alias with the same name would otherwise replace it.
+    SELECT
+        purchase_id,
+        tupleElement(customer, 'customer_id') AS customer_id,
+        tupleElement(store, 'store_id') AS store_id,
+        total_amount,
+        purchase_datetime AS purchase_datetime_text,
+        formatRowNoNewline(
+            'JSONEachRow',
+            purchase_id,
+            customer,
+            store,
+            items,
+            total_amount,
+            payment_method,
+            is_delivery,
+            purchase_datetime,
+            delivery_address
+        ) AS payload
+    FROM probablyfresh_raw.purchases_kafka
+);
@@ -0,0 +1,78 @@
+-- One-off load of raw_quality_state from raw data that arrived before its MVs existed
+-- (deployments created before 02_mart.sql declared them). Run with ingestion paused:
+-- stop the producer and wait until Kafka consumer lag is zero, otherwise rows inserted
+-- while this script runs are counted twice.
+-- Apply 01_init.sql and 02_mart.sql first; fresh installs do not need this file.
+
+TRUNCATE TABLE IF EXISTS probablyfresh_mart.raw_quality_state;
+
+INSERT INTO probablyfresh_mart.raw_quality_state
+SELECT
+    'stores' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        store_id_norm != ''
+        AND match(store_id_norm, '^store-[0-9]{3}$')
+        AND store_network_norm != ''
+        AND city_norm != ''
+    ) AS valid_rows,
+    uniqExactState(store_id_norm) AS distinct_keys
+FROM probablyfresh_raw.stores_raw
+GROUP BY ingest_date;
+
+INSERT INTO probablyfresh_mart.raw_quality_state
+SELECT
+    'products' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        product_id_norm != ''
+        AND match(product_id_norm, '^prd-[0-9]{4}$')
+        AND price_value >= 0
+        AND unit_norm != ''
+    ) AS valid_rows,
+    uniqExactState(product_id_norm) AS distinct_keys
+FROM probablyfresh_raw.products_raw
+GROUP BY ingest_date;
+
+INSERT INTO probablyfresh_mart.raw_quality_state
+SELECT
+    'customers' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        customer_id_norm != ''
+        AND match(customer_id_norm, '^cus-[0-9]{6}$')
+        AND store_id_norm != ''
+        AND match(store_id_norm, '^store-[0-9]{3}$')
+        AND (email_enc_norm = '' OR match(email_enc_norm, '^[0-9a-f]{64}$'))
+        AND (phone_enc_norm = '' OR match(phone_enc_norm, '^[0-9a-f]{64}$'))
+        AND birth_date_parsed IS NOT NULL
+        AND birth_date_parsed <= today()
+        AND (registration_raw = '' OR registration_dt_parsed IS NOT NULL)
+    ) AS valid_rows,
+    uniqExactState(customer_id_norm) AS distinct_keys
+FROM probablyfresh_raw.customers_raw
+GROUP BY ingest_date;
+
+INSERT INTO probablyfresh_mart.raw_quality_state
+SELECT
+    'purchases' AS entity,
+    toDate(ingested_at) AS ingest_date,
+    count() AS total_rows,
+    countIf(
+        purchase_id_norm != ''
+        AND match(purchase_id_norm, '^ord-[0-9]{6,}$')
+        AND customer_id_norm != ''
+        AND match(customer_id_norm, '^cus-[0-9]{6}$')
+        AND store_id_norm != ''
+        AND match(store_id_norm, '^store-[0-9]{3}$')
+        AND total_amount_value >= 0
+        AND payment_method_norm IN ('card', 'cash', 'online_wallet', 'sbp', 'other')
+        AND purchase_dt_parsed IS NOT NULL
+        AND purchase_dt_parsed <= now()
+    ) AS valid_rows,
+    uniqExactState(purchase_id_norm) AS distinct_keys
+FROM probablyfresh_raw.purchases_raw
+GROUP BY ingest_date;
@@ -0,0 +1,28 @@
+-- Full reload of mart_kpi_state from the marts. 02_mart.sql already loads marts filled before
+-- the KPI MVs existed; this file also picks up keys inserted between that load and the MV
+-- creation. uniqExact states merge as set unions, so the script may run while ingestion is
+-- active and may be re-run safely. Apply 02_mart.sql first; fresh installs do not need this file.
+
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'stores' AS entity,
+    uniqExactState(store_id) AS distinct_keys
+FROM probablyfresh_mart.stores_mart;
+
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'products' AS entity,
+    uniqExactState(product_id) AS distinct_keys
+FROM probablyfresh_mart.products_mart;
+
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'customers' AS entity,
+    uniqExactState(customer_id) AS distinct_keys
+FROM probablyfresh_mart.customers_mart;
+
+INSERT INTO probablyfresh_mart.mart_kpi_state
+SELECT
+    'purchases' AS entity,
+    uniqExactState(purchase_id) AS distinct_keys
+FROM probablyfresh_mart.purchases_mart;
@@ -9,14 +9,18 @@ ETL витрины признаков клиентов для ProbablyFresh.
 - точка входа скрипта — функция main().
 """
 
+import json
 import logging
 import os
 import shutil
 import tempfile
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from functools import partial, reduce
 from pathlib import Path
 
 import boto3
+import requests
 from dotenv import load_dotenv
 from pyspark import StorageLevel
 from pyspark.sql import Column, DataFrame, SparkSession
@@ -41,6 +45,92 @@ MORNING_SHOPPER_END_HOUR = 10
 # Reused rolling windows in days.
 PURCHASE_ACTIVITY_WINDOWS = (7, 14, 30, 90)
 ITEM_ACTIVITY_WINDOWS = (7, 30, 90)
+MICROS_PER_DAY = 86_400_000_000
+
+# Item features as (output column, row flag, window in days). Each feature owns one
+# bit of a per-row mask, so a single bit_or per customer replaces one max() per feature.
+ITEM_WINDOW_FEATURES = (
+    ("bought_milk_last_7d", "is_milk_item", 7),
+    ("bought_milk_last_30d", "is_milk_item", 30),
+    ("bought_meat_last_7d", "is_meat_item", 7),
+    ("bought_meat_last_30d", "is_meat_item", 30),
+    ("bought_fruits_last_30d", "is_fruits_item", 30),
+    ("bought_vegetables_last_30d", "is_vegetables_item", 30),
+    ("bought_bakery_last_30d", "is_bakery_item", 30),
+    ("bought_organic_last_90d", "is_organic_int", 90),
+    ("high_quantity_buyer_last_30d", "is_high_quantity_item", 30),
+    ("has_meat_last_90d", "is_meat_item", 90),
+    ("has_plant_last_90d", "is_plant_item", 90),
+)
+
+MART_TABLES = ("purchases_mart", "customers_mart", "products_mart", "purchase_items_mart")
+
+# FEATURES_SOURCE: "jdbc" reads marts through clickhouse-jdbc; "parquet" exports the
+# same slices over ClickHouse HTTP (FORMAT Parquet) into a staging directory that
+# Spark (or Polars/DuckDB) reads as plain files, without the JDBC jar.
+FEATURES_SOURCES = ("jdbc", "parquet")
+
+# FEATURES_MODE: "full" recomputes every aggregate from the marts; "incremental"
+# keeps per-customer day buckets as Parquet in FEATURES_STATE_DIR and re-reads only
+# the (customer, day) buckets touched by mart rows ingested since the watermark.
+# The watermark trails the run start so rows still being inserted are not skipped.
+# purchase_index in the state maps every purchase_id to the (customer, day) bucket it
+# was counted in; an update that moves a purchase also re-reads its old bucket. The old
+# buckets are inlined into the SQL (about 40 bytes each), so INCREMENTAL_MAX_STALE_BUCKETS
+# keeps every source query far below ClickHouse's default max_query_size of 256 KiB.
+# Past it the state is rebuilt from scratch.
+FEATURES_MODES = ("full", "incremental")
+INCREMENTAL_WATERMARK_LAG_SECONDS = 300
+INCREMENTAL_MAX_STALE_BUCKETS = 2_000
+INCREMENTAL_STATE_ENTRIES = ("purchases_daily", "items_daily", "purchase_index", "watermark.json")
+
+# Parallel JDBC reads: every table is split into buckets of cityHash64(key), one
+# Spark partition (and one ClickHouse connection) per bucket. Bucket count and
+# fetch size come from CH_JDBC_NUM_PARTITIONS[_<TABLE>] / CH_JDBC_FETCHSIZE[_<TABLE>].
+# Keys are sorting-key columns: all versions of a row share the bucket, so the
+# filter goes into PREWHERE of the FINAL query and each bucket merges only its rows.
+JDBC_PARTITION_KEYS = {
+    "purchases_mart": "purchase_id",
+    "customers_mart": "customer_id",
+    "products_mart": "product_id",
+    "purchase_items_mart": "purchase_id, product_id",
+    "touched_purchases": "purchase_id",
+}
+JDBC_BUCKET_FILTER = "{bucket_filter}"
+DEFAULT_JDBC_FETCHSIZE = 50000
+
+# Only the columns _build_features uses cross the wire: no payload strings, one
+# version per key (FINAL). Purchases stay all-time (shares, averages and
+# no_purchases need full history); item features look back at most
+# max(ITEM_ACTIVITY_WINDOWS) days, plus one day so the window computed later by
+# Spark never starts before the ClickHouse cut-off. JDBC_BUCKET_FILTER marks
+# where the per-bucket PREWHERE goes (right after FINAL).
+JDBC_SOURCE_QUERIES = {
+    "purchases_mart": (
+        "SELECT customer_id, store_id, total_amount, payment_method, is_delivery, purchase_dt "
+        f"FROM purchases_mart FINAL{JDBC_BUCKET_FILTER}"
+    ),
+    "customers_mart": f"SELECT customer_id FROM customers_mart FINAL{JDBC_BUCKET_FILTER}",
+    "products_mart": (
+        "SELECT product_id, `group`, "
+        "toUInt8(JSONExtractBool(payload, 'is_organic') "
+        "OR lowerUTF8(JSONExtractString(payload, 'is_organic')) = 'true') AS is_organic "
+        f"FROM products_mart FINAL{JDBC_BUCKET_FILTER}"
+    ),
+    "purchase_items_mart": (
+        "SELECT customer_id, product_id, category, quantity, total_price, purchase_dt "
+        f"FROM purchase_items_mart FINAL{JDBC_BUCKET_FILTER} "
+        f"WHERE purchase_dt >= now() - INTERVAL {max(ITEM_ACTIVITY_WINDOWS) + 1} DAY"
+    ),
+}
+
+# ClickHouse 24.8 writes DateTime to Parquet as UInt32 seconds; DateTime64(3) is
+# written as a Parquet timestamp that Spark, Polars and DuckDB read natively.
+PARQUET_DATETIME_COLUMNS = {
+    "purchases_mart": ("purchase_dt",),
+    "purchase_items_mart": ("purchase_dt",),
+    "touched_purchases": ("purchase_dt",),
+}
 
 # Category matching rules are intentionally broad because source categories are
 # heterogeneous and can arrive in both Russian and English.
@@ -154,6 +244,45 @@ def _optional_any_env(default: str, *names: str) -> str:
     return default
 
 
+def _optional_int_env(default: int, *names: str) -> int:
+    """Возвращает первое непустое значение из списка переменных как положительное целое.
+
+    Args:
+        default: значение по умолчанию.
+        *names: имена переменных в порядке приоритета.
+    Returns:
+        Найденное значение или default.
+    """
+    for name in names:
+        value = os.getenv(name)
+        if value is None or not value.strip():
+            continue
+        try:
+            parsed = int(value.strip())
+        except ValueError as exc:
+            raise RuntimeError(f"Environment variable {name} must be an integer, got {value!r}") from exc
+        if parsed < 1:
+            raise RuntimeError(f"Environment variable {name} must be a positive integer, got {parsed}")
+        return parsed
+    return default
+
+
+def _features_source() -> str:
+    """Возвращает источник данных ETL из FEATURES_SOURCE (jdbc по умолчанию)."""
+    value = _optional_env("FEATURES_SOURCE", "jdbc").lower()
+    if value not in FEATURES_SOURCES:
+        raise RuntimeError(f"FEATURES_SOURCE must be one of {', '.join(FEATURES_SOURCES)}, got {value!r}")
+    return value
+
+
+def _features_mode() -> str:
+    """Возвращает режим расчёта из FEATURES_MODE (full по умолчанию)."""
+    value = _optional_env("FEATURES_MODE", "full").lower()
+    if value not in FEATURES_MODES:
+        raise RuntimeError(f"FEATURES_MODE must be one of {', '.join(FEATURES_MODES)}, got {value!r}")
+    return value
+
+
 def _parquet_export_enabled() -> bool:
     """Возвращает True только при явном включении parquet-экспорта."""
     value = _optional_env("FEATURES_EXPORT_PARQUET", "0").lower()
@@ -165,28 +294,31 @@ def _parquet_export_warning_message() -> str:
     return "WARNING: Parquet export is enabled. This may significantly slow down ETL execution."
 
 
-def _build_spark_session() -> SparkSession:
+def _build_spark_session(source: str = "jdbc") -> SparkSession:
     """Создаёт и конфигурирует SparkSession для ETL.
 
+    Args:
+        source: источник данных; JDBC-драйвер подключается только для "jdbc".
     Returns:
-        Готовый SparkSession с UTC timezone и JDBC-драйвером ClickHouse.
+        Готовый SparkSession с UTC timezone (и JDBC-драйвером ClickHouse для source="jdbc").
     """
     master = _optional_env("SPARK_MASTER", "local[*]")
-    jdbc_jar = _optional_env("CLICKHOUSE_JDBC_JAR", "/opt/jars/clickhouse-jdbc-0.9.6-all-dependencies.jar")
-    logging.info("Starting SparkSession with master=%s", master)
+    logging.info("Starting SparkSession with master=%s, source=%s", master, source)
 
     builder = SparkSession.builder.appName("probablyfresh-features-etl").master(master)
 
-    # Prefer local JDBC jar baked into the Docker image to avoid network downloads on each run.
-    if Path(jdbc_jar).exists():
-        logging.info("Using local ClickHouse JDBC jar: %s", jdbc_jar)
-        builder = builder.config("spark.jars", jdbc_jar)
-    else:
-        logging.warning(
-            "Local ClickHouse JDBC jar was not found at %s, falling back to Maven package resolution",
-            jdbc_jar,
-        )
-        builder = builder.config("spark.jars.packages", "com.clickhouse:clickhouse-jdbc:0.9.6")
+    if source == "jdbc":
+        jdbc_jar = _optional_env("CLICKHOUSE_JDBC_JAR", "/opt/jars/clickhouse-jdbc-0.9.6-all-dependencies.jar")
+        # Prefer local JDBC jar baked into the Docker image to avoid network downloads on each run.
+        if Path(jdbc_jar).exists():
+            logging.info("Using local ClickHouse JDBC jar: %s", jdbc_jar)
+            builder = builder.config("spark.jars", jdbc_jar)
+        else:
+            logging.warning(
+                "Local ClickHouse JDBC jar was not found at %s, falling back to Maven package resolution",
+                jdbc_jar,
+            )
+            builder = builder.config("spark.jars.packages", "com.clickhouse:clickhouse-jdbc:0.9.6")
 
     spark = builder.config("spark.sql.session.timeZone", "UTC").getOrCreate()
     return spark
@@ -218,17 +350,231 @@ def _jdbc_reader(spark: SparkSession):
     )
 
 
-def _load_table(jdbc_reader, table: str) -> DataFrame:
-    """Читает одну таблицу из ClickHouse через JDBC.
+def _jdbc_read_options(spark: SparkSession, table: str) -> tuple[int, int]:
+    """Определяет число JDBC-партиций и fetchsize для таблицы.
+
+    Per-table переменные (`CH_JDBC_NUM_PARTITIONS_PURCHASES_MART` и т.п.)
+    важнее общих; по умолчанию партиций столько же, сколько ядер у executor-ов.
+
+    Args:
+        spark: активная SparkSession.
+        table: имя таблицы в выбранной БД.
+    Returns:
+        Пара (num_partitions, fetchsize).
+    """
+    suffix = table.upper()
+    num_partitions = _optional_int_env(
+        spark.sparkContext.defaultParallelism,
+        f"CH_JDBC_NUM_PARTITIONS_{suffix}",
+        "CH_JDBC_NUM_PARTITIONS",
+    )
+    fetchsize = _optional_int_env(DEFAULT_JDBC_FETCHSIZE, f"CH_JDBC_FETCHSIZE_{suffix}", "CH_JDBC_FETCHSIZE")
+    return num_partitions, fetchsize
+
+
+def _bucket_query(table: str, source_query: str, bucket_index: int, buckets: int) -> str:
+    """Подставляет в подзапрос фильтр одного бакета ключа сортировки.
+
+    Фильтр идёт в PREWHERE сразу после FINAL: ключ сортировки одинаков у всех версий
+    строки, поэтому ClickHouse отбрасывает чужие строки до слияния, и каждый бакет
+    сливает только свою часть таблицы.
+
+    Args:
+        table: имя таблицы в выбранной БД.
+        source_query: подзапрос с маркером JDBC_BUCKET_FILTER.
+        bucket_index: номер бакета 0..buckets-1.
+        buckets: число бакетов; при 1 фильтр не добавляется.
+    Returns:
+        SQL-текст подзапроса одного бакета.
+    """
+    partition_key = JDBC_PARTITION_KEYS.get(table)
+    bucket_filter = ""
+    if partition_key is not None and buckets > 1:
+        bucket_filter = f" PREWHERE cityHash64({partition_key}) % {buckets} = {bucket_index}"
+    return source_query.replace(JDBC_BUCKET_FILTER, bucket_filter)
+
+
+def _load_table(
+    spark: SparkSession,
+    jdbc_reader,
+    table: str,
+    source_queries: dict[str, str] | None = None,
+) -> DataFrame:
+    """Читает одну таблицу из ClickHouse через JDBC, параллельно по бакетам ключа.
+
+    Источник — подзапрос из JDBC_SOURCE_QUERIES (только нужные колонки и окно).
+    Каждый бакет читается отдельным JDBC-запросом с фильтром внутри FINAL
+    (см. _bucket_query) и даёт одну Spark-партицию; бакеты объединяются union.
 
     Args:
+        spark: активная SparkSession.
         jdbc_reader: reader из _jdbc_reader().
         table: имя таблицы в выбранной БД.
+        source_queries: подзапросы по таблицам вместо JDBC_SOURCE_QUERIES.
     Returns:
         DataFrame с данными таблицы.
     """
-    logging.info("Reading table via JDBC: %s", table)
-    return jdbc_reader.option("dbtable", table).load()
+    num_partitions, fetchsize = _jdbc_read_options(spark, table)
+    partition_key = JDBC_PARTITION_KEYS.get(table)
+    logging.info(
+        "Reading table via JDBC: %s (partitions=%s, key=%s, fetchsize=%s)",
+        table,
+        num_partitions,
+        partition_key,
+        fetchsize,
+    )
+    source_query = (source_queries or JDBC_SOURCE_QUERIES).get(table, f"SELECT * FROM {table}")
+    reader = jdbc_reader.option("fetchsize", fetchsize)
+    if partition_key is None:
+        num_partitions = 1
+
+    buckets = []
+    for bucket_index in range(num_partitions):
+        bucket_query = _bucket_query(table, source_query, bucket_index, num_partitions)
+        buckets.append(reader.option("dbtable", f"({bucket_query}) AS {table}_b{bucket_index}").load())
+    return reduce(DataFrame.union, buckets)
+
+
+def _parquet_slice_query(table: str, source_query: str, slice_index: int, slices: int) -> str:
+    """Строит запрос выгрузки одного среза таблицы в FORMAT Parquet.
+
+    Args:
+        table: имя таблицы в выбранной БД.
+        source_query: подзапрос с нужными колонками и фильтрами.
+        slice_index: номер среза 0..slices-1.
+        slices: число срезов (бакетов ключа сортировки, см. _bucket_query).
+    Returns:
+        SQL-текст для HTTP-интерфейса ClickHouse.
+    """
+    replacements = ", ".join(
+        f"toDateTime64({column}, 3, 'UTC') AS {column}" for column in PARQUET_DATETIME_COLUMNS.get(table, ())
+    )
+    select = f"SELECT * REPLACE ({replacements})" if replacements else "SELECT *"
+    return f"{select} FROM ({_bucket_query(table, source_query, slice_index, slices)}) FORMAT Parquet"
+
+
+def _export_parquet_slice(query: str, target: Path, timeout: int) -> int:
+    """Выгружает результат запроса из ClickHouse по HTTP в локальный Parquet-файл.
+
+    `wait_end_of_query=1` заставляет ClickHouse вернуть ошибку HTTP-статусом,
+    а не оборвать уже начатый поток, поэтому битый файл не остаётся незамеченным.
+
+    Args:
+        query: запрос с FORMAT Parquet.
+        target: путь к создаваемому файлу.
+        timeout: таймаут HTTP-запроса в секундах.
+    Returns:
+        Размер записанного файла в байтах.
+    """
+    ch_host = _required_env("CH_HOST")
+    ch_port = _required_env("CH_PORT")
+    ch_user = _required_env("CH_USER")
+    ch_password = os.getenv("CH_PASSWORD", "")
+    ch_db = _optional_env("CH_DATABASE", "probablyfresh_mart")
+
+    with requests.post(
+        f"http://{ch_host}:{ch_port}/",
+        params={
+            "database": ch_db,
+            "wait_end_of_query": 1,
+            "output_format_parquet_string_as_string": 1,
+        },
+        data=query.encode("utf-8"),
+        auth=(ch_user, ch_password),
+        stream=True,
+        timeout=timeout,
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"ClickHouse Parquet export failed with HTTP {response.status_code}: {response.text[:500]}"
+            )
+        with target.open("wb") as file_obj:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                file_obj.write(chunk)
+    return target.stat().st_size
+
+
+def _export_marts_to_parquet(
+    spark: SparkSession,
+    staging_dir: Path,
+    source_queries: dict[str, str] | None = None,
+) -> None:
+    """Параллельно выгружает все MART-срезы в staging_dir/<table>/part-XXXXX.parquet.
+
+    Число срезов на таблицу совпадает с числом JDBC-партиций (CH_JDBC_NUM_PARTITIONS*),
+    число одновременных HTTP-запросов задаёт FEATURES_EXTRACT_WORKERS.
+
+    Args:
+        spark: активная SparkSession.
+        staging_dir: корневая папка для Parquet-файлов.
+        source_queries: подзапросы по таблицам вместо JDBC_SOURCE_QUERIES.
+    """
+    source_queries = source_queries or JDBC_SOURCE_QUERIES
+    workers = _optional_int_env(4, "FEATURES_EXTRACT_WORKERS")
+    timeout = _optional_int_env(600, "FEATURES_EXTRACT_TIMEOUT_SECONDS")
+    tasks: list[tuple[str, Path]] = []
+    for table in MART_TABLES:
+        slices, _ = _jdbc_read_options(spark, table)
+        if JDBC_PARTITION_KEYS.get(table) is None:
+            slices = 1
+        table_dir = staging_dir / table
+        shutil.rmtree(table_dir, ignore_errors=True)
+        table_dir.mkdir(parents=True)
+        for slice_index in range(slices):
+            tasks.append(
+                (
+                    _parquet_slice_query(table, source_queries[table], slice_index, slices),
+                    table_dir / f"part-{slice_index:05d}.parquet",
+                )
+            )
+
+    logging.info("Exporting %s Parquet slices to %s with %s workers", len(tasks), staging_dir, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(executor.map(lambda task: _export_parquet_slice(task[0], task[1], timeout), tasks))
+    logging.info("Parquet export completed: %s files, %s bytes", len(sizes), sum(sizes))
+
+
+def _load_parquet_table(spark: SparkSession, staging_dir: Path, table: str) -> DataFrame:
+    """Читает выгруженные Parquet-срезы одной таблицы.
+
+    Args:
+        spark: активная SparkSession.
+        staging_dir: корневая папка с Parquet-файлами.
+        table: имя таблицы в выбранной БД.
+    Returns:
+        DataFrame с данными таблицы.
+    """
+    logging.info("Reading table from Parquet staging: %s", table)
+    return spark.read.parquet(str(staging_dir / table))
+
+
+def _load_query(
+    spark: SparkSession,
+    source: str,
+    staging_dir: Path | None,
+    name: str,
+    query: str,
+) -> DataFrame:
+    """Читает вспомогательный подзапрос тем же источником, что и MART-таблицы.
+
+    Args:
+        spark: активная SparkSession.
+        source: "jdbc" или "parquet".
+        staging_dir: папка выгрузки для source="parquet".
+        name: имя результата (ключ JDBC_PARTITION_KEYS и папка в staging_dir).
+        query: подзапрос с маркером JDBC_BUCKET_FILTER или без него.
+    Returns:
+        DataFrame с результатом подзапроса.
+    """
+    if source != "parquet":
+        return _load_table(spark, _jdbc_reader(spark), name, {name: query})
+
+    target_dir = staging_dir / name
+    shutil.rmtree(target_dir, ignore_errors=True)
+    target_dir.mkdir(parents=True)
+    timeout = _optional_int_env(600, "FEATURES_EXTRACT_TIMEOUT_SECONDS")
+    _export_parquet_slice(_parquet_slice_query(name, query, 0, 1), target_dir / "part-00000.parquet", timeout)
+    return _load_parquet_table(spark, staging_dir, name)
 
 
 def _int_flag(condition: Column) -> Column:
@@ -256,43 +602,29 @@ def _binary_metric(column_name: str) -> Column:
     return _coalesced_int(column_name).cast("int").alias(column_name)
 
 
-def _recent_flag(timestamp_col: str, days: int) -> Column:
-    """Строит бинарный флаг попадания timestamp в окно последних N дней."""
-    return _int_flag(F.col(timestamp_col) >= F.expr(f"current_timestamp() - INTERVAL {days} DAYS"))
+def _days_ago(timestamp_col: str) -> Column:
+    """Считает целое число дней от timestamp до current_timestamp() с округлением вверх.
 
+    `days_ago <= N` выполняется ровно тогда, когда timestamp >= current_timestamp() - N дней,
+    поэтому одна колонка заменяет отдельный флаг на каждое окно.
+    """
+    elapsed_micros = F.unix_micros(F.current_timestamp()) - F.unix_micros(F.col(timestamp_col))
+    return F.ceil(elapsed_micros / F.lit(MICROS_PER_DAY)).cast("int")
 
-def _add_recent_flags(df: DataFrame, timestamp_col: str, windows: tuple[int, ...]) -> DataFrame:
-    """Добавляет набор колонок вида is_last_{N}d для указанного timestamp."""
-    result = df
-    for days in windows:
-        result = result.withColumn(f"is_last_{days}d", _recent_flag(timestamp_col, days))
-    return result
 
+def _within_days(days: int) -> Column:
+    """Условие попадания строки с колонкой days_ago в окно последних N дней."""
+    return F.col("days_ago") <= days
 
-def _build_features(
-    customers_df: DataFrame,
-    purchases_df: DataFrame,
-    products_df: DataFrame,
-    purchase_items_df: DataFrame,
-) -> DataFrame:
-    """Строит feature-матрицу клиентов (customer_id + 30 бинарных признаков).
+
+def _purchase_rows(purchases_df: DataFrame) -> DataFrame:
+    """Нормализует покупки и добавляет построчные бинарные флаги (без временных окон).
 
     Args:
-        customers_df: таблица клиентов MART.
         purchases_df: таблица покупок MART.
-        products_df: таблица продуктов MART.
-        purchase_items_df: таблица позиций чеков MART.
     Returns:
-        DataFrame вида (customer_id, feature_1..feature_30), где все фичи 0/1.
+        DataFrame покупок с cash/card/weekend/weekday/night/morning флагами.
     """
-    # customers_base задает якорный набор клиентов. Благодаря этому в итоговую
-    # витрину попадут и клиенты без покупок, которым затем проставятся нули.
-    customers_base = (
-        customers_df.select(F.lower(F.trim(F.col("customer_id"))).alias("customer_id"))
-        .filter(F.col("customer_id").isNotNull() & (F.col("customer_id") != ""))
-        .dropDuplicates(["customer_id"])
-    )
-
     # Нормализуем ключевые поля покупок и приводим типы к тем, с которыми далее
     # безопасно считать окна, доли оплат и денежные агрегаты.
     purchases_clean = (
@@ -307,11 +639,10 @@ def _build_features(
         .filter(F.col("customer_id").isNotNull() & (F.col("customer_id") != ""))
     )
 
-    # На уровне отдельных покупок добавляем временные окна и бинарные флаги,
-    # из которых затем считаются customer-level shares и поведенческие признаки.
-    purchases_metrics = (
-        _add_recent_flags(purchases_clean, "purchase_dt", PURCHASE_ACTIVITY_WINDOWS)
-        .withColumn("cash_flag", _int_flag(F.col("payment_method") == "cash"))
+    # На уровне отдельных покупок добавляем бинарные флаги, из которых затем
+    # считаются customer-level shares и поведенческие признаки.
+    return (
+        purchases_clean.withColumn("cash_flag", _int_flag(F.col("payment_method") == "cash"))
         .withColumn("card_flag", _int_flag(F.col("payment_method") == "card"))
         .withColumn(
             "weekend_flag",
@@ -325,29 +656,16 @@ def _build_features(
         .withColumn("morning_flag", _int_flag(F.hour(F.col("purchase_dt")) < MORNING_SHOPPER_END_HOUR))
     )
 
-    # shares вроде cash_share/card_share показывают долю покупок с данным
-    # свойством. Именно они потом сравниваются с бизнес-порогами 0.7/0.6/0.5.
-    purchases_agg = purchases_metrics.groupBy("customer_id").agg(
-        F.count(F.lit(1)).alias("purchases_all_time"),
-        F.sum("is_last_7d").alias("purchases_last_7d"),
-        F.sum("is_last_14d").alias("purchases_last_14d"),
-        F.sum("is_last_30d").alias("purchases_last_30d"),
-        F.sum("is_last_90d").alias("purchases_last_90d"),
-        F.avg("total_amount").alias("avg_total_amount"),
-        F.avg("cash_flag").alias("cash_share"),
-        F.avg("card_flag").alias("card_share"),
-        F.avg("weekend_flag").alias("weekend_share"),
-        F.avg("weekday_flag").alias("weekday_share"),
-        F.avg("night_flag").alias("night_share"),
-        F.avg("morning_flag").alias("morning_share"),
-        F.max("is_delivery").alias("delivery_any"),
-        F.max(_int_flag((F.col("is_last_30d") == 1) & (F.col("is_delivery") == 1))).alias("delivery_any_30d"),
-        F.max(F.when(F.col("is_last_90d") == 1, F.col("total_amount"))).alias("max_total_amount_90d"),
-        F.countDistinct(F.when(F.col("is_last_90d") == 1, F.col("store_id"))).alias("distinct_stores_90d"),
-        F.max(_int_flag((F.col("is_last_90d") == 1) & (F.col("payment_method") == "cash"))).alias("used_cash_90d"),
-        F.max(_int_flag((F.col("is_last_90d") == 1) & (F.col("payment_method") == "card"))).alias("used_card_90d"),
-    )
 
+def _item_rows(products_df: DataFrame, purchase_items_df: DataFrame) -> DataFrame:
+    """Обогащает позиции чеков каталогом продуктов и категорийными флагами (без временных окон).
+
+    Args:
+        products_df: таблица продуктов MART.
+        purchase_items_df: таблица позиций чеков MART.
+    Returns:
+        DataFrame позиций с is_*_item флагами и is_organic_int.
+    """
     product_group_expr = F.col("`group`") if "group" in products_df.columns else F.lit(None).cast("string")
     if "is_organic" in products_df.columns:
         organic_expr = F.col("is_organic").cast("int")
@@ -403,12 +721,11 @@ def _build_features(
             ),
         )
     )
-    items_enriched = _add_recent_flags(items_enriched, "purchase_dt", ITEM_ACTIVITY_WINDOWS)
 
     # Regex-правила нарочно широкие: категории могут приходить в RU/EN и не быть
     # строго стандартизированными, поэтому здесь используются устойчивые маски.
     category_text = F.coalesce(F.col("category_norm"), F.lit(""))
-    items_flags = (
+    return (
         items_enriched.withColumn(
             "is_milk_item",
             _int_flag(category_text.rlike(MILK_CATEGORY_PATTERN)),
@@ -429,34 +746,27 @@ def _build_features(
             "is_bakery_item",
             _int_flag(category_text.rlike(BAKERY_CATEGORY_PATTERN)),
         )
+        .withColumn("is_high_quantity_item", _int_flag(F.col("quantity") > HIGH_QUANTITY_MIN_ITEMS_30D))
+        .withColumn("is_plant_item", F.greatest(F.col("is_fruits_item"), F.col("is_vegetables_item")))
     )
 
-    items_agg = items_flags.groupBy("customer_id").agg(
-        F.max(_int_flag((F.col("is_milk_item") == 1) & (F.col("is_last_7d") == 1))).alias(
-            "bought_milk_last_7d"
-        ),
-        F.max(_int_flag((F.col("is_milk_item") == 1) & (F.col("is_last_30d") == 1))).alias(
-            "bought_milk_last_30d"
-        ),
-        F.max(_int_flag((F.col("is_meat_item") == 1) & (F.col("is_last_7d") == 1))).alias(
-            "bought_meat_last_7d"
-        ),
-        F.max(_int_flag((F.col("is_meat_item") == 1) & (F.col("is_last_30d") == 1))).alias(
-            "bought_meat_last_30d"
-        ),
-        F.max(_int_flag((F.col("is_fruits_item") == 1) & (F.col("is_last_30d") == 1))).alias("bought_fruits_last_30d"),
-        F.max(_int_flag((F.col("is_vegetables_item") == 1) & (F.col("is_last_30d") == 1))).alias("bought_vegetables_last_30d"),
-        F.max(_int_flag((F.col("is_bakery_item") == 1) & (F.col("is_last_30d") == 1))).alias("bought_bakery_last_30d"),
-        F.max(_int_flag((F.col("is_organic_int") == 1) & (F.col("is_last_90d") == 1))).alias("bought_organic_last_90d"),
-        F.max(_int_flag((F.col("quantity") > HIGH_QUANTITY_MIN_ITEMS_30D) & (F.col("is_last_30d") == 1))).alias(
-            "high_quantity_buyer_last_30d"
-        ),
-        F.max(_int_flag((F.col("is_meat_item") == 1) & (F.col("is_last_90d") == 1))).alias(
-            "has_meat_last_90d"
-        ),
-        F.max(_int_flag(((F.col("is_fruits_item") == 1) | (F.col("is_vegetables_item") == 1)) & (F.col("is_last_90d") == 1))).alias(
-            "has_plant_last_90d"
-        ),
+
+def _assemble_features(customers_df: DataFrame, purchases_agg: DataFrame, items_agg: DataFrame) -> DataFrame:
+    """Джойнит customer-level агрегаты к базовому списку клиентов и считает признаки.
+
+    Args:
+        customers_df: таблица клиентов MART.
+        purchases_agg: агрегаты покупок по customer_id.
+        items_agg: категорийные агрегаты по customer_id.
+    Returns:
+        DataFrame вида (customer_id, feature_1..feature_30), где все фичи 0/1.
+    """
+    # customers_base задает якорный набор клиентов. Благодаря этому в итоговую
+    # витрину попадут и клиенты без покупок, которым затем проставятся нули.
+    customers_base = (
+        customers_df.select(F.lower(F.trim(F.col("customer_id"))).alias("customer_id"))
+        .filter(F.col("customer_id").isNotNull() & (F.col("customer_id") != ""))
+        .dropDuplicates(["customer_id"])
     )
 
     joined = customers_base.join(purchases_agg, on="customer_id", how="left").join(items_agg, on="customer_id", how="left")
@@ -561,6 +871,499 @@ def _build_features(
     return result.select("customer_id", *FEATURE_COLUMNS)
 
 
+def _purchases_agg(purchase_rows: DataFrame) -> DataFrame:
+    """Сворачивает покупки в customer-level агрегаты за один проход.
+
+    Окна 7/14/30/90 дней считаются условными агрегатами по одной колонке days_ago.
+
+    Args:
+        purchase_rows: результат _purchase_rows().
+    Returns:
+        DataFrame агрегатов покупок по customer_id.
+    """
+    purchases_metrics = purchase_rows.withColumn("days_ago", _days_ago("purchase_dt"))
+
+    # shares вроде cash_share/card_share показывают долю покупок с данным
+    # свойством. Именно они потом сравниваются с бизнес-порогами 0.7/0.6/0.5.
+    return purchases_metrics.groupBy("customer_id").agg(
+        F.count(F.lit(1)).alias("purchases_all_time"),
+        *[
+            F.count(F.when(_within_days(days), F.lit(1))).alias(f"purchases_last_{days}d")
+            for days in PURCHASE_ACTIVITY_WINDOWS
+        ],
+        F.avg("total_amount").alias("avg_total_amount"),
+        F.avg("cash_flag").alias("cash_share"),
+        F.avg("card_flag").alias("card_share"),
+        F.avg("weekend_flag").alias("weekend_share"),
+        F.avg("weekday_flag").alias("weekday_share"),
+        F.avg("night_flag").alias("night_share"),
+        F.avg("morning_flag").alias("morning_share"),
+        F.max("is_delivery").alias("delivery_any"),
+        F.max(_int_flag(_within_days(30) & (F.col("is_delivery") == 1))).alias("delivery_any_30d"),
+        F.max(F.when(_within_days(90), F.col("total_amount"))).alias("max_total_amount_90d"),
+        F.countDistinct(F.when(_within_days(90), F.col("store_id"))).alias("distinct_stores_90d"),
+        F.max(_int_flag(_within_days(90) & (F.col("payment_method") == "cash"))).alias("used_cash_90d"),
+        F.max(_int_flag(_within_days(90) & (F.col("payment_method") == "card"))).alias("used_card_90d"),
+    )
+
+
+def _items_agg(item_rows: DataFrame) -> DataFrame:
+    """Сворачивает позиции чеков в категорийные признаки за один проход.
+
+    Каждая строка получает битовую маску ITEM_WINDOW_FEATURES (флаг категории и
+    попадание days_ago в окно), маски клиента объединяются одним bit_or, затем
+    биты раскладываются обратно в 0/1 колонки.
+
+    Args:
+        item_rows: результат _item_rows().
+    Returns:
+        DataFrame категорийных агрегатов по customer_id.
+    """
+    row_mask = F.lit(0)
+    for bit, (_, flag_column, days) in enumerate(ITEM_WINDOW_FEATURES):
+        row_mask = row_mask.bitwiseOR(
+            F.when((F.col(flag_column) == 1) & _within_days(days), F.lit(1 << bit)).otherwise(F.lit(0))
+        )
+
+    # Узкая проекция: до агрегации доходят только customer_id и одна int-маска на строку.
+    flag_columns = list(dict.fromkeys(flag_column for _, flag_column, _ in ITEM_WINDOW_FEATURES))
+    customer_masks = (
+        item_rows.select("customer_id", _days_ago("purchase_dt").alias("days_ago"), *flag_columns)
+        .select("customer_id", row_mask.alias("item_mask"))
+        .groupBy("customer_id")
+        .agg(F.bit_or("item_mask").alias("item_mask"))
+    )
+    return customer_masks.select(
+        "customer_id",
+        *[
+            _int_flag(F.col("item_mask").bitwiseAND(F.lit(1 << bit)) != 0).alias(name)
+            for bit, (name, _, _) in enumerate(ITEM_WINDOW_FEATURES)
+        ],
+    )
+
+
+def _build_features(
+    customers_df: DataFrame,
+    purchases_df: DataFrame,
+    products_df: DataFrame,
+    purchase_items_df: DataFrame,
+) -> DataFrame:
+    """Строит feature-матрицу клиентов (customer_id + 30 бинарных признаков).
+
+    Args:
+        customers_df: таблица клиентов MART.
+        purchases_df: таблица покупок MART.
+        products_df: таблица продуктов MART.
+        purchase_items_df: таблица позиций чеков MART.
+    Returns:
+        DataFrame вида (customer_id, feature_1..feature_30), где все фичи 0/1.
+    """
+    return _assemble_features(
+        customers_df,
+        _purchases_agg(_purchase_rows(purchases_df)),
+        _items_agg(_item_rows(products_df, purchase_items_df)),
+    )
+
+
+def _read_watermark(state_dir: Path) -> str | None:
+    """Читает ingested_at, до которого MART уже учтён в состоянии (None — состояния ещё нет)."""
+    watermark_path = state_dir / "watermark.json"
+    if not watermark_path.exists():
+        return None
+    return json.loads(watermark_path.read_text(encoding="utf-8"))["ingested_at"]
+
+
+def _write_watermark(state_dir: Path, watermark: str) -> None:
+    """Сохраняет watermark после успешной выгрузки витрины."""
+    (state_dir / "watermark.json").write_text(json.dumps({"ingested_at": watermark}), encoding="utf-8")
+
+
+def _ingested_between(watermark: str, upper_bound: str) -> str:
+    """SQL-условие на ingested_at для интервала (watermark, upper_bound]."""
+    return (
+        f"ingested_at > toDateTime('{watermark}', 'UTC') "
+        f"AND ingested_at <= toDateTime('{upper_bound}', 'UTC')"
+    )
+
+
+def _sql_string(value: str) -> str:
+    """Экранирует строку как SQL-литерал ClickHouse."""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _touched_purchases_query(watermark: str | None, upper_bound: str) -> str:
+    """Строит запрос текущих (purchase_id, customer_id, purchase_dt) изменённых покупок.
+
+    Без watermark (первый запуск или пересборка) возвращаются все покупки.
+
+    Args:
+        watermark: ingested_at предыдущего запуска или None.
+        upper_bound: ingested_at, до которого учитываются строки в этом запуске.
+    Returns:
+        Подзапрос для _load_query с маркером JDBC_BUCKET_FILTER.
+    """
+    query = (
+        "SELECT purchase_id, customer_id, purchase_dt "
+        f"FROM purchases_mart FINAL{JDBC_BUCKET_FILTER}"
+    )
+    if watermark is None:
+        return query
+    ingested = _ingested_between(watermark, upper_bound)
+    return (
+        f"{query} WHERE purchase_id IN ("
+        f"SELECT purchase_id FROM purchases_mart WHERE {ingested} "
+        f"UNION DISTINCT SELECT purchase_id FROM purchase_items_mart WHERE {ingested})"
+    )
+
+
+def _incremental_source_queries(
+    watermark: str | None,
+    upper_bound: str,
+    stale_buckets: list[tuple[str, date]] | None = None,
+) -> dict[str, str]:
+    """Ограничивает покупки и позиции чеков бакетами, затронутыми новыми строками MART.
+
+    Бакет (customer_id, день покупки) перечитывается целиком и с FINAL, поэтому
+    повторы и опоздавшие покупки не удваивают счётчики. Если обновление перенесло
+    покупку к другому клиенту или на другой день, её прежний бакет (stale_buckets)
+    тоже перечитывается. Без watermark (первый запуск) читается вся история.
+
+    Args:
+        watermark: ingested_at предыдущего запуска или None.
+        upper_bound: ingested_at, до которого учитываются строки в этом запуске.
+        stale_buckets: прежние бакеты перенесённых покупок (_stale_buckets).
+    Returns:
+        Подзапросы по таблицам для _load_table/_export_marts_to_parquet.
+    """
+    queries = dict(JDBC_SOURCE_QUERIES)
+    if watermark is None:
+        return queries
+
+    bucket = "(customer_id, toDate(purchase_dt, 'UTC'))"
+    stale_list = ", ".join(
+        f"({_sql_string(customer_id)}, toDate('{day.isoformat()}'))" for customer_id, day in stale_buckets or ()
+    )
+    for table in ("purchases_mart", "purchase_items_mart"):
+        touched_buckets = (
+            f"SELECT DISTINCT customer_id, toDate(purchase_dt, 'UTC') FROM {table} "
+            f"WHERE {_ingested_between(watermark, upper_bound)}"
+        )
+        condition = f"{bucket} IN ({touched_buckets})"
+        if stale_list:
+            condition = f"({condition} OR {bucket} IN ({stale_list}))"
+        connector = "AND" if " WHERE " in queries[table] else "WHERE"
+        queries[table] = f"{queries[table]} {connector} {condition}"
+    return queries
+
+
+def _load_touched_purchases(
+    spark: SparkSession,
+    source: str,
+    staging_dir: Path | None,
+    watermark: str | None,
+    upper_bound: str,
+) -> DataFrame:
+    """Читает текущие бакеты изменённых покупок для purchase_index.
+
+    День считается в Spark тем же F.to_date, что и в дневных бакетах.
+
+    Args:
+        spark: активная SparkSession.
+        source: "jdbc" или "parquet".
+        staging_dir: папка выгрузки для source="parquet".
+        watermark: ingested_at предыдущего запуска или None.
+        upper_bound: ingested_at, до которого учитываются строки в этом запуске.
+    Returns:
+        DataFrame (purchase_id, customer_id, day).
+    """
+    touched = _load_query(
+        spark, source, staging_dir, "touched_purchases", _touched_purchases_query(watermark, upper_bound)
+    )
+    return touched.select("purchase_id", "customer_id", F.to_date(F.col("purchase_dt")).alias("day"))
+
+
+def _stale_buckets(spark: SparkSession, state_dir: Path, touched_purchases: DataFrame) -> list[tuple[str, date]]:
+    """Находит бакеты, из которых обновления MART увели покупки.
+
+    Args:
+        spark: активная SparkSession.
+        state_dir: папка с Parquet-состоянием.
+        touched_purchases: результат _load_touched_purchases().
+    Returns:
+        До INCREMENTAL_MAX_STALE_BUCKETS + 1 пар (customer_id, day) из purchase_index.
+    """
+    index_path = state_dir / "purchase_index"
+    if not any(index_path.glob("day=*")):
+        return []
+
+    previous = spark.read.parquet(str(index_path)).select(
+        "purchase_id",
+        F.col("customer_id").alias("old_customer_id"),
+        F.col("day").alias("old_day"),
+    )
+    moved = (
+        previous.join(touched_purchases, on="purchase_id")
+        .filter(F.col("old_day").isNotNull())
+        .filter(~(F.col("old_customer_id").eqNullSafe(F.col("customer_id")) & F.col("old_day").eqNullSafe(F.col("day"))))
+        .select("old_customer_id", "old_day")
+        .distinct()
+    )
+    return [(row.old_customer_id, row.old_day) for row in moved.limit(INCREMENTAL_MAX_STALE_BUCKETS + 1).collect()]
+
+
+def _reset_incremental_state(state_dir: Path) -> None:
+    """Удаляет состояние инкрементального режима; следующий расчёт читает всю историю."""
+    for name in INCREMENTAL_STATE_ENTRIES:
+        path = state_dir / name
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+
+
+def _in_last_days(days: int) -> Column:
+    """Бакет попадает в окно, если его день не раньше current_date() - N (окно с точностью до дня)."""
+    return F.col("day") >= F.date_sub(F.current_date(), days)
+
+
+def _purchase_day_buckets(purchase_rows: DataFrame) -> DataFrame:
+    """Сворачивает покупки в частичные агрегаты по (customer_id, день покупки).
+
+    Args:
+        purchase_rows: результат _purchase_rows().
+    Returns:
+        DataFrame дневных бакетов: счётчики, суммы, максимумы и набор магазинов.
+    """
+    return (
+        purchase_rows.filter(F.col("purchase_dt").isNotNull())
+        .withColumn("day", F.to_date(F.col("purchase_dt")))
+        .groupBy("customer_id", "day")
+        .agg(
+            F.count(F.lit(1)).alias("purchases"),
+            F.count("total_amount").alias("total_amount_count"),
+            F.sum("total_amount").alias("total_amount_sum"),
+            F.max("total_amount").alias("total_amount_max"),
+            F.sum("cash_flag").alias("cash_purchases"),
+            F.sum("card_flag").alias("card_purchases"),
+            F.sum("weekend_flag").alias("weekend_purchases"),
+            F.sum("weekday_flag").alias("weekday_purchases"),
+            F.sum("night_flag").alias("night_purchases"),
+            F.sum("morning_flag").alias("morning_purchases"),
+            F.max("is_delivery").alias("delivery_any"),
+            F.collect_set("store_id").alias("store_ids"),
+        )
+    )
+
+
+def _item_day_buckets(item_rows: DataFrame) -> DataFrame:
+    """Сворачивает позиции чеков в максимумы категорийных флагов по (customer_id, день покупки).
+
+    Args:
+        item_rows: результат _item_rows().
+    Returns:
+        DataFrame дневных бакетов с 0/1 флагами категорий.
+    """
+    return (
+        item_rows.filter(F.col("purchase_dt").isNotNull())
+        .withColumn("day", F.to_date(F.col("purchase_dt")))
+        .groupBy("customer_id", "day")
+        .agg(
+            F.max("is_milk_item").alias("milk"),
+            F.max("is_meat_item").alias("meat"),
+            F.max("is_fruits_item").alias("fruits"),
+            F.max("is_vegetables_item").alias("vegetables"),
+            F.max("is_bakery_item").alias("bakery"),
+            F.max(_int_flag(F.col("is_organic_int") == 1)).alias("organic"),
+            F.max("is_high_quantity_item").alias("high_quantity"),
+        )
+    )
+
+
+def _purchases_agg_from_buckets(buckets: DataFrame) -> DataFrame:
+    """Считает те же customer-level агрегаты покупок, что и _build_features, из дневных бакетов."""
+    return buckets.groupBy("customer_id").agg(
+        F.sum("purchases").alias("purchases_all_time"),
+        *[
+            F.sum(F.when(_in_last_days(days), F.col("purchases")).otherwise(F.lit(0))).alias(f"purchases_last_{days}d")
+            for days in PURCHASE_ACTIVITY_WINDOWS
+        ],
+        F.try_divide(F.sum("total_amount_sum"), F.sum("total_amount_count")).alias("avg_total_amount"),
+        (F.sum("cash_purchases") / F.sum("purchases")).alias("cash_share"),
+        (F.sum("card_purchases") / F.sum("purchases")).alias("card_share"),
+        (F.sum("weekend_purchases") / F.sum("purchases")).alias("weekend_share"),
+        (F.sum("weekday_purchases") / F.sum("purchases")).alias("weekday_share"),
+        (F.sum("night_purchases") / F.sum("purchases")).alias("night_share"),
+        (F.sum("morning_purchases") / F.sum("purchases")).alias("morning_share"),
+        F.max("delivery_any").alias("delivery_any"),
+        F.max(_int_flag(_in_last_days(30) & (F.col("delivery_any") == 1))).alias("delivery_any_30d"),
+        F.max(F.when(_in_last_days(90), F.col("total_amount_max"))).alias("max_total_amount_90d"),
+        F.size(F.array_distinct(F.flatten(F.collect_list(F.when(_in_last_days(90), F.col("store_ids")))))).alias(
+            "distinct_stores_90d"
+        ),
+        F.max(_int_flag(_in_last_days(90) & (F.col("cash_purchases") > 0))).alias("used_cash_90d"),
+        F.max(_int_flag(_in_last_days(90) & (F.col("card_purchases") > 0))).alias("used_card_90d"),
+    )
+
+
+def _items_agg_from_buckets(buckets: DataFrame) -> DataFrame:
+    """Считает те же категорийные агрегаты, что и _build_features, из дневных бакетов."""
+    return buckets.groupBy("customer_id").agg(
+        F.max(_int_flag(_in_last_days(7) & (F.col("milk") == 1))).alias("bought_milk_last_7d"),
+        F.max(_int_flag(_in_last_days(30) & (F.col("milk") == 1))).alias("bought_milk_last_30d"),
+        F.max(_int_flag(_in_last_days(7) & (F.col("meat") == 1))).alias("bought_meat_last_7d"),
+        F.max(_int_flag(_in_last_days(30) & (F.col("meat") == 1))).alias("bought_meat_last_30d"),
+        F.max(_int_flag(_in_last_days(30) & (F.col("fruits") == 1))).alias("bought_fruits_last_30d"),
+        F.max(_int_flag(_in_last_days(30) & (F.col("vegetables") == 1))).alias("bought_vegetables_last_30d"),
+        F.max(_int_flag(_in_last_days(30) & (F.col("bakery") == 1))).alias("bought_bakery_last_30d"),
+        F.max(_int_flag(_in_last_days(90) & (F.col("organic") == 1))).alias("bought_organic_last_90d"),
+        F.max(_int_flag(_in_last_days(30) & (F.col("high_quantity") == 1))).alias("high_quantity_buyer_last_30d"),
+        F.max(_int_flag(_in_last_days(90) & (F.col("meat") == 1))).alias("has_meat_last_90d"),
+        F.max(_int_flag(_in_last_days(90) & ((F.col("fruits") == 1) | (F.col("vegetables") == 1)))).alias(
+            "has_plant_last_90d"
+        ),
+    )
+
+
+def _state_day_dir(state_path: Path, day: date) -> Path:
+    """Папка дневной партиции Parquet-состояния (так её называет partitionBy("day"))."""
+    return state_path / f"day={day.isoformat()}"
+
+
+def _replace_buckets(
+    spark: SparkSession,
+    state_path: Path,
+    fresh_buckets: DataFrame,
+    keep_days: int | None = None,
+    keys: tuple[str, ...] = ("customer_id", "day"),
+    dropped_keys: DataFrame | None = None,
+    extra_days: list[date] | None = None,
+) -> DataFrame:
+    """Заменяет в Parquet-состоянии пересчитанные бакеты и возвращает новое состояние.
+
+    Состояние партиционировано по day. Читаются и перезаписываются только дни из
+    fresh_buckets и extra_days (dynamic partition overwrite), поэтому объём записи
+    пропорционален затронутым дням, а не всей истории. Партиции, в которых после
+    замены не осталось строк, удаляются. Упавший запуск не сдвигает watermark,
+    и следующий перезапишет те же дни целиком.
+
+    Args:
+        spark: активная SparkSession.
+        state_path: папка Parquet-состояния.
+        fresh_buckets: пересчитанные бакеты (customer_id, day, ...).
+        keep_days: если задано, бакеты старше N дней отбрасываются.
+        keys: колонки ключа бакета.
+        dropped_keys: ключи, которые удаляются, даже если в fresh_buckets их нет
+            (бакет опустел после переноса покупки).
+        extra_days: дни dropped_keys, которые тоже перезаписываются.
+    Returns:
+        DataFrame, прочитанный из обновлённого состояния.
+    """
+    oldest_day = None
+    if keep_days is not None:
+        oldest_day = datetime.now(timezone.utc).date() - timedelta(days=keep_days)
+        fresh_buckets = fresh_buckets.filter(_in_last_days(keep_days))
+
+    fresh_days = {row.day for row in fresh_buckets.select("day").distinct().collect()}
+    touched_days = sorted(fresh_days | set(extra_days or ()))
+    merged = fresh_buckets
+    if state_path.exists() and touched_days:
+        replaced_keys = fresh_buckets.select(*keys)
+        if dropped_keys is not None:
+            replaced_keys = replaced_keys.unionByName(dropped_keys.select(*keys))
+        previous = spark.read.parquet(str(state_path)).filter(F.col("day").isin(touched_days))
+        merged = previous.join(replaced_keys.distinct(), on=list(keys), how="left_anti").unionByName(fresh_buckets)
+
+    emptied_days = set(touched_days) - fresh_days
+    if emptied_days:
+        emptied_days -= {
+            row.day for row in merged.filter(F.col("day").isin(sorted(emptied_days))).select("day").distinct().collect()
+        }
+
+    if touched_days:
+        (
+            merged.write.mode("overwrite")
+            .option("partitionOverwriteMode", "dynamic")
+            .partitionBy("day")
+            .parquet(str(state_path))
+        )
+    day_dirs = []
+    for day_dir in state_path.glob("day=*"):
+        day = date.fromisoformat(day_dir.name.removeprefix("day="))
+        if day in emptied_days or (oldest_day is not None and day < oldest_day):
+            shutil.rmtree(day_dir)
+        else:
+            day_dirs.append(day_dir)
+    if not day_dirs:
+        # Пустое состояние: без партиций Spark не может вывести схему Parquet.
+        return fresh_buckets
+    return spark.read.parquet(str(state_path))
+
+
+def _build_features_incremental(
+    spark: SparkSession,
+    state_dir: Path,
+    customers_df: DataFrame,
+    purchases_df: DataFrame,
+    products_df: DataFrame,
+    purchase_items_df: DataFrame,
+    touched_purchases: DataFrame,
+    stale_buckets: list[tuple[str, date]],
+) -> DataFrame:
+    """Обновляет дневные бакеты в state_dir и строит feature-матрицу из них.
+
+    purchases_df/purchase_items_df содержат только затронутые бакеты
+    (_incremental_source_queries), customers_df/products_df читаются целиком.
+    Бакеты покупок хранятся за всю историю (all-time доли и средний чек),
+    бакеты позиций — только за самое длинное окно категорийных признаков.
+    purchase_index обновляется последним: если запуск упадёт раньше, следующий
+    снова найдёт те же перенесённые покупки.
+
+    Args:
+        spark: активная SparkSession.
+        state_dir: папка с Parquet-состоянием и watermark.
+        customers_df: таблица клиентов MART.
+        purchases_df: покупки затронутых бакетов.
+        products_df: таблица продуктов MART.
+        purchase_items_df: позиции чеков затронутых бакетов.
+        touched_purchases: текущие бакеты изменённых покупок (_load_touched_purchases).
+        stale_buckets: прежние бакеты перенесённых покупок (_stale_buckets).
+    Returns:
+        DataFrame вида (customer_id, feature_1..feature_30), где все фичи 0/1.
+    """
+    stale_df = spark.createDataFrame(stale_buckets, "customer_id string, day date")
+    stale_days = sorted({day for _, day in stale_buckets})
+    purchase_buckets = _replace_buckets(
+        spark,
+        state_dir / "purchases_daily",
+        _purchase_day_buckets(_purchase_rows(purchases_df)),
+        dropped_keys=stale_df,
+        extra_days=stale_days,
+    )
+    item_buckets = _replace_buckets(
+        spark,
+        state_dir / "items_daily",
+        _item_day_buckets(_item_rows(products_df, purchase_items_df)),
+        keep_days=max(ITEM_ACTIVITY_WINDOWS) + 1,
+        dropped_keys=stale_df,
+        extra_days=stale_days,
+    )
+    # purchase_index тоже партиционирован по дню покупки: прежняя запись перенесённой
+    # покупки лежит в одном из stale_days, остальные записи затронутых покупок — в днях
+    # их свежих строк, поэтому перезаписываются только эти дни.
+    _replace_buckets(
+        spark,
+        state_dir / "purchase_index",
+        touched_purchases.filter(F.col("day").isNotNull()),
+        keys=("purchase_id",),
+        extra_days=stale_days,
+    )
+    return _assemble_features(
+        customers_df,
+        _purchases_agg_from_buckets(purchase_buckets),
+        _items_agg_from_buckets(item_buckets),
+    )
+
+
 def _write_single_csv(features_df: DataFrame) -> Path:
     """Пишет витрину в один CSV-файл через coalesce(1).
 
@@ -722,20 +1525,78 @@ def main() -> None:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     _load_env()
 
-    spark = _build_spark_session()
+    source = _features_source()
+    mode = _features_mode()
+    spark = _build_spark_session(source)
     temp_csv_path: Path | None = None
     temp_parquet_dir: Path | None = None
+    temp_staging_dir: Path | None = None
     persisted_dfs: list[DataFrame] = []
 
     try:
-        jdbc_reader = _jdbc_reader(spark)
+        staging_dir: Path | None = None
+        if source == "parquet":
+            # FEATURES_STAGING_DIR сохраняет выгрузку для повторного чтения (Polars/DuckDB);
+            # без него используется временная папка, которая удаляется в конце.
+            staging_env = _optional_env("FEATURES_STAGING_DIR", "")
+            if staging_env:
+                staging_dir = Path(staging_env)
+            else:
+                staging_dir = temp_staging_dir = Path(tempfile.mkdtemp(prefix="probablyfresh_features_staging_"))
+
+        source_queries = dict(JDBC_SOURCE_QUERIES)
+        state_dir: Path | None = None
+        watermark_upper_bound: str | None = None
+        touched_purchases: DataFrame | None = None
+        stale_buckets: list[tuple[str, date]] = []
+        if mode == "incremental":
+            state_dir = Path(_optional_env("FEATURES_STATE_DIR", str(_repo_root() / "data" / "features_state")))
+            state_dir.mkdir(parents=True, exist_ok=True)
+            if (state_dir / "purchases_daily").exists() and not any((state_dir / "purchase_index").glob("day=*")):
+                logging.warning("Incremental state has no day-partitioned purchase_index, rebuilding it from scratch")
+                _reset_incremental_state(state_dir)
+            watermark = _read_watermark(state_dir)
+            watermark_upper_bound = (
+                datetime.now(timezone.utc) - timedelta(seconds=INCREMENTAL_WATERMARK_LAG_SECONDS)
+            ).strftime("%Y-%m-%d %H:%M:%S")
+            touched_purchases = _load_touched_purchases(
+                spark, source, staging_dir, watermark, watermark_upper_bound
+            ).persist(StorageLevel.MEMORY_AND_DISK)
+            persisted_dfs.append(touched_purchases)
+            stale_buckets = _stale_buckets(spark, state_dir, touched_purchases)
+            if len(stale_buckets) > INCREMENTAL_MAX_STALE_BUCKETS:
+                logging.warning(
+                    "More than %s buckets lost purchases to updates, rebuilding incremental state from scratch",
+                    INCREMENTAL_MAX_STALE_BUCKETS,
+                )
+                _reset_incremental_state(state_dir)
+                watermark = None
+                stale_buckets = []
+                touched_purchases = _load_touched_purchases(
+                    spark, source, staging_dir, None, watermark_upper_bound
+                ).persist(StorageLevel.MEMORY_AND_DISK)
+                persisted_dfs.append(touched_purchases)
+            source_queries = _incremental_source_queries(watermark, watermark_upper_bound, stale_buckets)
+            logging.info(
+                "Incremental mode: state=%s, ingested_at in (%s, %s], moved-out buckets=%s",
+                state_dir,
+                watermark or "-inf",
+                watermark_upper_bound,
+                len(stale_buckets),
+            )
+
+        if staging_dir is not None:
+            _export_marts_to_parquet(spark, staging_dir, source_queries)
+            load_table = partial(_load_parquet_table, spark, staging_dir)
+        else:
+            load_table = partial(_load_table, spark, _jdbc_reader(spark), source_queries=source_queries)
 
         # Кэшируем входные DataFrame (MEMORY_AND_DISK): ниже есть count(),
         # а затем эти же данные повторно используются в _build_features().
-        purchases_df = _load_table(jdbc_reader, "purchases_mart").persist(StorageLevel.MEMORY_AND_DISK)
-        customers_df = _load_table(jdbc_reader, "customers_mart").persist(StorageLevel.MEMORY_AND_DISK)
-        products_df = _load_table(jdbc_reader, "products_mart").persist(StorageLevel.MEMORY_AND_DISK)
-        purchase_items_df = _load_table(jdbc_reader, "purchase_items_mart").persist(StorageLevel.MEMORY_AND_DISK)
+        purchases_df = load_table("purchases_mart").persist(StorageLevel.MEMORY_AND_DISK)
+        customers_df = load_table("customers_mart").persist(StorageLevel.MEMORY_AND_DISK)
+        products_df = load_table("products_mart").persist(StorageLevel.MEMORY_AND_DISK)
+        purchase_items_df = load_table("purchase_items_mart").persist(StorageLevel.MEMORY_AND_DISK)
         persisted_dfs.extend([purchases_df, customers_df, products_df, purchase_items_df])
 
         logging.info(
@@ -748,9 +1609,20 @@ def main() -> None:
 
         # Кэшируем итоговую витрину: дальше выполняются count(), write(),
         # а в debug-режиме также show() и filter().count().
-        features_df = _build_features(customers_df, purchases_df, products_df, purchase_items_df).persist(
-            StorageLevel.MEMORY_AND_DISK
-        )
+        if state_dir is not None:
+            features_df = _build_features_incremental(
+                spark,
+                state_dir,
+                customers_df,
+                purchases_df,
+                products_df,
+                purchase_items_df,
+                touched_purchases,
+                stale_buckets,
+            )
+        else:
+            features_df = _build_features(customers_df, purchases_df, products_df, purchase_items_df)
+        features_df = features_df.persist(StorageLevel.MEMORY_AND_DISK)
         persisted_dfs.append(features_df)
         logging.info("Feature columns count (with customer_id): %s", len(features_df.columns))
         logging.info("Feature rows to export: %s", features_df.count())
@@ -785,6 +1657,12 @@ def main() -> None:
         else:
             logging.info("Upload completed successfully: csv=%s", csv_object_key)
             print(f"Uploaded features file: {csv_object_key}")
+
+        # Watermark сдвигается только после успешной выгрузки: упавший запуск
+        # повторит те же бакеты, а их замена в состоянии идемпотентна.
+        if state_dir is not None and watermark_upper_bound is not None:
+            _write_watermark(state_dir, watermark_upper_bound)
+            logging.info("Incremental watermark advanced to %s", watermark_upper_bound)
     finally:
         # Явно освобождаем кэш перед остановкой Spark.
         for df in reversed(persisted_dfs):
@@ -799,6 +1677,9 @@ def main() -> None:
         if temp_parquet_dir is not None:
             shutil.rmtree(temp_parquet_dir, ignore_errors=True)
             logging.info("Removed temporary directory: %s", temp_parquet_dir)
+        if temp_staging_dir is not None:
+            shutil.rmtree(temp_staging_dir, ignore_errors=True)
+            logging.info("Removed temporary directory: %s", temp_staging_dir)
 
 
 if __name__ == "__main__":
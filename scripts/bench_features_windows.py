@@ -0,0 +1,118 @@
+﻿from __future__ import annotations
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "jobs"))
+
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql import functions as F
+
+from features_etl import ITEM_ACTIVITY_WINDOWS, ITEM_WINDOW_FEATURES, _int_flag, _items_agg
+
+
+CATEGORY_FLAGS = ("is_milk_item", "is_meat_item", "is_fruits_item", "is_vegetables_item", "is_bakery_item")
+
+
+def legacy_items_agg(item_rows: DataFrame) -> DataFrame:
+    result = item_rows
+    for days in ITEM_ACTIVITY_WINDOWS:
+        result = result.withColumn(
+            f"is_last_{days}d",
+            _int_flag(F.col("purchase_dt") >= F.expr(f"current_timestamp() - INTERVAL {days} DAYS")),
+        )
+    return result.groupBy("customer_id").agg(
+        *[
+            F.max(_int_flag((F.col(flag_column) == 1) & (F.col(f"is_last_{days}d") == 1))).alias(name)
+            for name, flag_column, days in ITEM_WINDOW_FEATURES
+        ]
+    )
+
+
+def generate_item_rows(spark: SparkSession, rows: int, customers: int, days: int, seed: int) -> DataFrame:
+    # Синтетический purchase_items_mart сразу в виде результата _item_rows():
+    # джойн с каталогом продуктов одинаков для обеих реализаций и в замер не входит.
+    category = F.floor(F.rand(seed) * 8).cast("int")
+    items = (
+        spark.range(rows)
+        .withColumn("customer_id", F.concat(F.lit("c"), (F.col("id") % customers).cast("string")))
+        .withColumn(
+            "purchase_dt",
+            F.timestamp_seconds(F.unix_timestamp(F.current_timestamp()) - F.floor(F.rand(seed + 1) * days * 86_400)),
+        )
+        .withColumn("quantity", F.floor(F.rand(seed + 2) * 4).cast("double"))
+        .withColumn("is_organic_int", _int_flag(F.rand(seed + 3) < 0.1))
+    )
+    for index, flag_column in enumerate(CATEGORY_FLAGS):
+        items = items.withColumn(flag_column, _int_flag(category == index))
+    return (
+        items.withColumn("is_high_quantity_item", _int_flag(F.col("quantity") > 2.0))
+        .withColumn("is_plant_item", F.greatest(F.col("is_fruits_item"), F.col("is_vegetables_item")))
+        .drop("id")
+    )
+
+
+def measure(label: str, func: Callable[[], object], rows: int) -> float:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    per_row_ns = elapsed / rows * 1e9
+    print(f"{label:<40} total={elapsed:7.3f}s per_row={per_row_ns:8.1f}ns")
+    return elapsed
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark for windowed item aggregation in features_etl")
+    parser.add_argument("--rows", type=int, default=100_000_000, help="Synthetic purchase_items_mart rows")
+    parser.add_argument("--customers", type=int, default=1_000_000, help="Distinct customer_id values")
+    parser.add_argument("--days", type=int, default=120, help="Spread of purchase_dt into the past")
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    spark = (
+        SparkSession.builder.appName("bench-features-windows")
+        .master(args.master)
+        .config("spark.sql.session.timeZone", "UTC")
+        .getOrCreate()
+    )
+    data_dir = Path(tempfile.mkdtemp(prefix="bench_features_windows_"))
+    try:
+        items_path = data_dir / "purchase_items"
+        generate_item_rows(spark, args.rows, args.customers, args.days, args.seed).write.parquet(str(items_path))
+        item_rows = spark.read.parquet(str(items_path))
+
+        sample = item_rows.where(F.col("customer_id").endswith("7"))
+        legacy = legacy_items_agg(sample)
+        current = _items_agg(sample).select(legacy.columns)
+        if legacy.exceptAll(current).count() or current.exceptAll(legacy).count():
+            raise RuntimeError("_items_agg output differs from the legacy implementation")
+
+        print(f"rows={args.rows} customers={args.customers} days={args.days}")
+        before = measure(
+            "legacy is_last_Nd flags + max()",
+            lambda: legacy_items_agg(item_rows).write.format("noop").mode("overwrite").save(),
+            args.rows,
+        )
+        after = measure(
+            "days_ago + bit_or mask",
+            lambda: _items_agg(item_rows).write.format("noop").mode("overwrite").save(),
+            args.rows,
+        )
+        print(f"{'speedup':<40} {before / after:.2f}x")
+    finally:
+        spark.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
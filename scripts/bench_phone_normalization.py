@@ -0,0 +1,124 @@
+﻿from __future__ import annotations
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from probablyfresh.core.crypto_utils import PIIHasher
+from probablyfresh.core.normalization import hash_phones, normalize_phone_strict, normalize_phones
+
+
+BENCH_SALT = "bench-salt-0123456789"
+PHONE_FORMATS = (
+    "8 ({a}) {b}-{c}-{d}",
+    "+7 {a} {b} {c} {d}",
+    "+7({a}){b}-{c}-{d}",
+    "7{a}{b}{c}{d}",
+    "{a}{b}{c}{d}",
+    "8-{a}-{b}-{c}-{d}",
+    "{a}-{b}",
+)
+
+
+def legacy_normalize_phone(value: str) -> str:
+    digits = re.sub(r"\D", "", value)
+    if len(digits) == 10:
+        digits = "7" + digits
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    if digits and not digits.startswith("+"):
+        return "+" + digits
+    return digits
+
+
+def legacy_normalize_phone_strict(value: str) -> tuple[str, bool]:
+    original = value
+    cleaned = re.sub(r"[\s()\-]", "", value.strip())
+
+    if cleaned.startswith("+"):
+        return cleaned, True
+
+    if re.fullmatch(r"8\d{10}", cleaned):
+        return "+7" + cleaned[1:], True
+
+    if re.fullmatch(r"7\d{10}", cleaned):
+        return "+7" + cleaned[1:], True
+
+    return original, False
+
+
+def generate_phones(count: int, seed: int, distinct: int) -> list[str]:
+    rng = random.Random(seed)
+    pool = [
+        rng.choice(PHONE_FORMATS).format(
+            a=f"9{rng.randint(0, 99):02d}",
+            b=f"{rng.randint(0, 999):03d}",
+            c=f"{rng.randint(0, 99):02d}",
+            d=f"{rng.randint(0, 99):02d}",
+        )
+        for _ in range(distinct)
+    ]
+    return [pool[rng.randrange(distinct)] for _ in range(count)]
+
+
+def measure(label: str, func: Callable[[], object], count: int) -> float:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    per_call_ns = elapsed / count * 1e9
+    print(f"{label:<40} total={elapsed:7.3f}s per_call={per_call_ns:8.1f}ns")
+    return per_call_ns
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro-benchmark for phone normalization and hashing")
+    parser.add_argument("--count", type=int, default=1_000_000, help="Phones per measurement")
+    parser.add_argument("--distinct", type=int, default=50_000, help="Distinct phone values in the sample")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    phones = generate_phones(args.count, args.seed, args.distinct)
+
+    sample = phones[:10_000]
+    if [legacy_normalize_phone(value) for value in sample] != normalize_phones(sample):
+        raise RuntimeError("normalize_phone output differs from the legacy implementation")
+    if [legacy_normalize_phone_strict(value) for value in sample] != [normalize_phone_strict(v) for v in sample]:
+        raise RuntimeError("normalize_phone_strict output differs from the legacy implementation")
+
+    print(f"phones={args.count} distinct={args.distinct}")
+    before = measure(
+        "legacy normalize_phone (re.sub)", lambda: [legacy_normalize_phone(v) for v in phones], args.count
+    )
+    after = measure("normalize_phone (bytes.translate)", lambda: normalize_phones(phones), args.count)
+    print(f"{'speedup':<40} {before / after:.2f}x")
+
+    before = measure(
+        "legacy strict (re.sub + fullmatch)", lambda: [legacy_normalize_phone_strict(v) for v in phones], args.count
+    )
+    after = measure(
+        "normalize_phone_strict (bytes.translate)", lambda: [normalize_phone_strict(v) for v in phones], args.count
+    )
+    print(f"{'speedup':<40} {before / after:.2f}x")
+
+    uncached = PIIHasher(BENCH_SALT, cache_size=0)
+    before = measure(
+        "legacy normalize + uncached hash",
+        lambda: [uncached.hash_value(legacy_normalize_phone(v)) for v in phones],
+        args.count,
+    )
+    after = measure("hash_phones batch", lambda: hash_phones(phones, PIIHasher(BENCH_SALT)), args.count)
+    print(f"{'speedup':<40} {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,31 @@
 from __future__ import annotations
 
 import argparse
-import json
 import os
 import random
+import sys
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any
 
 from faker import Faker
 
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from probablyfresh.core.datasets import (
+    COMPRESSION_SUFFIXES,
+    DEFAULT_CHUNK_ROWS,
+    OUTPUT_FORMATS,
+    DatasetWriter,
+    clear_dataset_files,
+    write_json_document,
+    write_manifest,
+)
+
 
 CATEGORIES = [
     "🥖 Зерновые и хлебобулочные изделия",
@@ -20,6 +35,8 @@ CATEGORIES = [
     "🥦 Овощи и зелень",
 ]
 
+DEFAULT_SHARD_SIZE = 100_000
+
 ALMOST_DESC = "Large format store, probably 200+ m². Part of a 30-store network."
 MAYBE_DESC = "Neighborhood store, probably under 100 m². Part of a 15-store network."
 UNITS = ["упаковка", "шт", "кг", "л", "булка"]
@@ -385,13 +402,65 @@ PRODUCT_ORIGIN_COUNTRIES_BY_NAME = {
 }
 
 
-def parse_seed() -> int:
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Generate ProbablyFresh demo JSON dataset.")
     parser.add_argument("--seed", type=int, default=None, help="Random seed (overrides SEED env var).")
+    parser.add_argument(
+        "--purchases",
+        type=int,
+        default=None,
+        help="Target purchase count. Enables sharded generation across a process pool.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for sharded purchase generation.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help="Purchases per deterministic seed shard.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="json",
+        help="json writes one file per document, ndjson writes chunk files plus manifest.json.",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=sorted(COMPRESSION_SUFFIXES),
+        default="none",
+        help="Compression of NDJSON chunks.",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=DEFAULT_CHUNK_ROWS,
+        help="Documents per NDJSON chunk.",
+    )
     args = parser.parse_args()
 
-    if args.seed is not None:
-        return args.seed
+    if args.purchases is not None and args.purchases < 1:
+        parser.error("--purchases must be a positive integer")
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if args.shard_size < 1:
+        parser.error("--shard-size must be a positive integer")
+    if args.chunk_rows < 1:
+        parser.error("--chunk-rows must be a positive integer")
+    if args.format == "json" and args.compression != "none":
+        parser.error("--compression requires --format ndjson")
+
+    args.seed = resolve_seed(args.seed)
+    return args
+
+
+def resolve_seed(cli_seed: int | None) -> int:
+    if cli_seed is not None:
+        return cli_seed
 
     raw_seed = os.getenv("SEED", "42").strip()
     try:
@@ -410,12 +479,33 @@ def iso_z(value: datetime) -> str:
 
 def clean_json_files(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
-    for file_path in path.glob("*.json"):
-        file_path.unlink()
+    clear_dataset_files(path)
 
 
 def write_json(path: Path, payload: dict[str, Any]) -> None:
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    write_json_document(path, payload)
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    format: str = "json"
+    compression: str = "none"
+    chunk_rows: int = DEFAULT_CHUNK_ROWS
+
+
+def open_writer(directory: Path, output: OutputOptions, prefix: str = "part") -> DatasetWriter:
+    return DatasetWriter(
+        directory,
+        output_format=output.format,
+        compression=output.compression,
+        chunk_rows=output.chunk_rows,
+        prefix=prefix,
+    )
+
+
+def finalize_entity(directory: Path, entity: str, output: OutputOptions, chunks: list[dict[str, Any]]) -> None:
+    if output.format == "ndjson":
+        write_manifest(directory, entity, output.compression, output.chunk_rows, chunks)
 
 
 def random_phone() -> str:
@@ -493,7 +583,7 @@ def product_origin_countries(name: str, category: str) -> list[str]:
     return ["Россия", "Беларусь", "Казахстан", "Армения"]
 
 
-def generate_stores(fake: Faker, stores_dir: Path, base_date: datetime) -> list[dict[str, Any]]:
+def generate_stores(fake: Faker, writer: DatasetWriter, base_date: datetime) -> list[dict[str, Any]]:
     stores: list[dict[str, Any]] = []
     specs = [
         ("ProbablyFresh Almost", 30, ALMOST_DESC),
@@ -539,12 +629,12 @@ def generate_stores(fake: Faker, stores_dir: Path, base_date: datetime) -> list[
                 "last_inventory_date": (base_date - timedelta(days=random.randint(1, 60))).date().isoformat(),
             }
             stores.append(store)
-            write_json(stores_dir / f"{store_id}.json", store)
+            writer.write(store_id, store)
 
     return stores
 
 
-def generate_products(fake: Faker, products_dir: Path) -> list[dict[str, Any]]:
+def generate_products(fake: Faker, writer: DatasetWriter) -> list[dict[str, Any]]:
     products: list[dict[str, Any]] = []
     product_index = 1
 
@@ -579,14 +669,14 @@ def generate_products(fake: Faker, products_dir: Path) -> list[dict[str, Any]]:
                 },
             }
             products.append(product)
-            write_json(products_dir / f"{product_id}.json", product)
+            writer.write(product_id, product)
             product_index += 1
 
     return products
 
 
 def generate_customers(
-    fake: Faker, customers_dir: Path, stores: list[dict[str, Any]], base_date: datetime
+    fake: Faker, writer: DatasetWriter, stores: list[dict[str, Any]], base_date: datetime
 ) -> list[dict[str, Any]]:
     customers: list[dict[str, Any]] = []
 
@@ -632,13 +722,84 @@ def generate_customers(
                 },
             }
             customers.append(customer)
-            write_json(customers_dir / f"{customer_id}.json", customer)
+            writer.write(customer_id, customer)
 
     return customers
 
 
+def build_purchase(
+    index: int,
+    rng: random.Random,
+    stores: list[dict[str, Any]],
+    products: list[dict[str, Any]],
+    customers: list[dict[str, Any]],
+    base_date: datetime,
+) -> dict[str, Any]:
+    customer = customers[(index - 1) % len(customers)]
+    store = rng.choice(stores)
+    line_count = rng.randint(1, 3)
+    chosen_products = rng.sample(products, line_count)
+
+    items: list[dict[str, Any]] = []
+    total_amount = 0.0
+    for product in chosen_products:
+        quantity = rng.randint(1, 5)
+        total_price = round(product["price"] * quantity, 2)
+        total_amount += total_price
+        items.append(
+            {
+                "product_id": product["id"],
+                "name": product["name"],
+                "category": product["group"],
+                "quantity": quantity,
+                "unit": product["unit"],
+                "price_per_unit": product["price"],
+                "total_price": total_price,
+                "kbju": product["kbju"],
+                "manufacturer": product["manufacturer"],
+            }
+        )
+
+    purchase_dt = base_date - timedelta(days=rng.randint(0, 120), minutes=rng.randint(0, 1439))
+    is_delivery = rng.choice([True, False])
+    purchase = {
+        "purchase_id": f"ord-{index:06d}",
+        "customer": {
+            "customer_id": customer["customer_id"],
+            "first_name": customer["first_name"],
+            "last_name": customer["last_name"],
+            "email": customer["email"],
+            "phone": customer["phone"],
+            "is_loyalty_member": customer["is_loyalty_member"],
+            "loyalty_card_number": customer["loyalty_card_number"],
+        },
+        "store": {
+            "store_id": store["store_id"],
+            "store_name": store["store_name"],
+            "store_network": store["store_network"],
+            "store_type_description": store["store_type_description"],
+            "location": {
+                "city": store["location"]["city"],
+                "street": store["location"]["street"],
+                "house": store["location"]["house"],
+                "postal_code": store["location"]["postal_code"],
+            },
+        },
+        "items": items,
+        "total_amount": round(total_amount, 2),
+        "payment_method": rng.choice(["card", "cash", "sbp"]),
+        "is_delivery": is_delivery,
+        "purchase_datetime": iso_z(purchase_dt),
+    }
+
+    if is_delivery:
+        purchase["delivery_address"] = customer["delivery_address"]
+
+    return purchase
+
+
 def generate_purchases(
-    purchases_dir: Path,
+    writer: DatasetWriter,
     stores: list[dict[str, Any]],
     products: list[dict[str, Any]],
     customers: list[dict[str, Any]],
@@ -648,73 +809,111 @@ def generate_purchases(
 
     target_count = 200
     for index in range(1, target_count + 1):
-        customer = customers[(index - 1) % len(customers)]
-        store = random.choice(stores)
-        line_count = random.randint(1, 3)
-        chosen_products = random.sample(products, line_count)
-
-        items: list[dict[str, Any]] = []
-        total_amount = 0.0
-        for product in chosen_products:
-            quantity = random.randint(1, 5)
-            total_price = round(product["price"] * quantity, 2)
-            total_amount += total_price
-            items.append(
-                {
-                    "product_id": product["id"],
-                    "name": product["name"],
-                    "category": product["group"],
-                    "quantity": quantity,
-                    "unit": product["unit"],
-                    "price_per_unit": product["price"],
-                    "total_price": total_price,
-                    "kbju": product["kbju"],
-                    "manufacturer": product["manufacturer"],
-                }
-            )
+        # The module-level RNG keeps the default dataset identical to earlier releases.
+        purchase = build_purchase(index, random, stores, products, customers, base_date)
+        purchases.append(purchase)
+        writer.write(f"ord-{index:06d}", purchase)
 
-        purchase_dt = base_date - timedelta(days=random.randint(0, 120), minutes=random.randint(0, 1439))
-        is_delivery = random.choice([True, False])
-        purchase = {
-            "purchase_id": f"ord-{index:06d}",
-            "customer": {
-                "customer_id": customer["customer_id"],
-                "first_name": customer["first_name"],
-                "last_name": customer["last_name"],
-                "email": customer["email"],
-                "phone": customer["phone"],
-                "is_loyalty_member": customer["is_loyalty_member"],
-                "loyalty_card_number": customer["loyalty_card_number"],
-            },
-            "store": {
-                "store_id": store["store_id"],
-                "store_name": store["store_name"],
-                "store_network": store["store_network"],
-                "store_type_description": store["store_type_description"],
-                "location": {
-                    "city": store["location"]["city"],
-                    "street": store["location"]["street"],
-                    "house": store["location"]["house"],
-                    "postal_code": store["location"]["postal_code"],
-                },
-            },
-            "items": items,
-            "total_amount": round(total_amount, 2),
-            "payment_method": random.choice(["card", "cash", "sbp"]),
-            "is_delivery": is_delivery,
-            "purchase_datetime": iso_z(purchase_dt),
-        }
+    return purchases
 
-        if is_delivery:
-            purchase["delivery_address"] = customer["delivery_address"]
 
-        purchases.append(purchase)
-        write_json(purchases_dir / f"ord-{index:06d}.json", purchase)
+# Reference data shared with pool workers once via the initializer instead of per task.
+_SHARD_CONTEXT: dict[str, Any] = {}
 
-    return purchases
+
+def shard_seed(seed: int, shard_index: int) -> str:
+    # str seeds are hashed with SHA-512 by random.Random, so they do not depend on PYTHONHASHSEED.
+    return f"{seed}:purchases:{shard_index}"
+
+
+def plan_purchase_shards(target_count: int, shard_size: int) -> list[tuple[int, int, int]]:
+    shards: list[tuple[int, int, int]] = []
+    for shard_index, start in enumerate(range(1, target_count + 1, shard_size)):
+        shards.append((shard_index, start, min(shard_size, target_count - start + 1)))
+    return shards
 
 
-def self_check(stores: list[dict[str, Any]], products: list[dict[str, Any]], customers: list[dict[str, Any]], purchases: list[dict[str, Any]]) -> None:
+def _init_purchase_worker(
+    purchases_dir: Path,
+    output: OutputOptions,
+    stores: list[dict[str, Any]],
+    products: list[dict[str, Any]],
+    customers: list[dict[str, Any]],
+    base_date: datetime,
+    seed: int,
+) -> None:
+    _SHARD_CONTEXT.update(
+        purchases_dir=purchases_dir,
+        output=output,
+        stores=stores,
+        products=products,
+        customers=customers,
+        base_date=base_date,
+        seed=seed,
+    )
+
+
+def generate_purchase_shard(shard_index: int, start: int, count: int) -> tuple[int, list[dict[str, Any]]]:
+    context = _SHARD_CONTEXT
+    rng = random.Random(shard_seed(context["seed"], shard_index))
+    writer = open_writer(context["purchases_dir"], context["output"], prefix=f"part-{shard_index:05d}")
+
+    for index in range(start, start + count):
+        purchase = build_purchase(
+            index,
+            rng,
+            context["stores"],
+            context["products"],
+            context["customers"],
+            context["base_date"],
+        )
+        writer.write(f"ord-{index:06d}", purchase)
+
+    return count, writer.close()
+
+
+def generate_purchases_sharded(
+    purchases_dir: Path,
+    output: OutputOptions,
+    stores: list[dict[str, Any]],
+    products: list[dict[str, Any]],
+    customers: list[dict[str, Any]],
+    base_date: datetime,
+    seed: int,
+    target_count: int,
+    workers: int,
+    shard_size: int,
+) -> tuple[int, list[dict[str, Any]]]:
+    # Shard boundaries and seeds depend only on seed/target/shard size, never on the
+    # worker count, so the output is byte-identical for any --workers value.
+    shards = plan_purchase_shards(target_count, shard_size)
+    initargs = (purchases_dir, output, stores, products, customers, base_date, seed)
+
+    if workers == 1 or len(shards) == 1:
+        _init_purchase_worker(*initargs)
+        results = [generate_purchase_shard(*shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(shards)),
+            initializer=_init_purchase_worker,
+            initargs=initargs,
+        ) as executor:
+            indexes, starts, counts = zip(*shards)
+            results = list(executor.map(generate_purchase_shard, indexes, starts, counts))
+
+    # executor.map keeps shard order, so the chunk list is stable across worker counts.
+    total = sum(count for count, _ in results)
+    chunks = [chunk for _, shard_chunks in results for chunk in shard_chunks]
+    return total, chunks
+
+
+def self_check(
+    stores: list[dict[str, Any]],
+    products: list[dict[str, Any]],
+    customers: list[dict[str, Any]],
+    purchases_count: int,
+    min_purchases: int = 200,
+) -> None:
     if len(stores) != 45:
         raise RuntimeError(f"Self-check failed: stores must be 45, got {len(stores)}")
 
@@ -731,12 +930,13 @@ def self_check(stores: list[dict[str, Any]], products: list[dict[str, Any]], cus
     if len(customers) < 45:
         raise RuntimeError(f"Self-check failed: customers must be >= 45, got {len(customers)}")
 
-    if len(purchases) < 200:
-        raise RuntimeError(f"Self-check failed: purchases must be >= 200, got {len(purchases)}")
+    if purchases_count < min_purchases:
+        raise RuntimeError(f"Self-check failed: purchases must be >= {min_purchases}, got {purchases_count}")
 
 
 def main() -> None:
-    seed = parse_seed()
+    args = parse_args()
+    seed = args.seed
     random.seed(seed)
 
     fake = Faker("ru_RU")
@@ -753,16 +953,46 @@ def main() -> None:
     for folder in (stores_dir, products_dir, customers_dir, purchases_dir):
         clean_json_files(folder)
 
+    output = OutputOptions(format=args.format, compression=args.compression, chunk_rows=args.chunk_rows)
     base_date = datetime(2025, 7, 10, 12, 0, 0, tzinfo=timezone.utc)
-    stores = generate_stores(fake, stores_dir, base_date)
-    products = generate_products(fake, products_dir)
-    customers = generate_customers(fake, customers_dir, stores, base_date)
-    purchases = generate_purchases(purchases_dir, stores, products, customers, base_date)
 
-    self_check(stores, products, customers, purchases)
+    writer = open_writer(stores_dir, output)
+    stores = generate_stores(fake, writer, base_date)
+    finalize_entity(stores_dir, "stores", output, writer.close())
+
+    writer = open_writer(products_dir, output)
+    products = generate_products(fake, writer)
+    finalize_entity(products_dir, "products", output, writer.close())
+
+    writer = open_writer(customers_dir, output)
+    customers = generate_customers(fake, writer, stores, base_date)
+    finalize_entity(customers_dir, "customers", output, writer.close())
+
+    if args.purchases is None:
+        writer = open_writer(purchases_dir, output)
+        purchases_count = len(generate_purchases(writer, stores, products, customers, base_date))
+        purchase_chunks = writer.close()
+    else:
+        purchases_count, purchase_chunks = generate_purchases_sharded(
+            purchases_dir,
+            output,
+            stores,
+            products,
+            customers,
+            base_date,
+            seed=seed,
+            target_count=args.purchases,
+            workers=args.workers,
+            shard_size=args.shard_size,
+        )
+    finalize_entity(purchases_dir, "purchases", output, purchase_chunks)
+
+    # --purchases sets an exact volume, so the self-check threshold follows it.
+    min_purchases = 200 if args.purchases is None else args.purchases
+    self_check(stores, products, customers, purchases_count, min_purchases)
     print(
         f"Generated: stores={len(stores)}, products={len(products)}, "
-        f"customers={len(customers)}, purchases={len(purchases)}, seed={seed}"
+        f"customers={len(customers)}, purchases={purchases_count}, seed={seed}"
     )
 
 
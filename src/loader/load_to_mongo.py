@@ -1,11 +1,24 @@
 from __future__ import annotations
 
-import json
+import argparse
 import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator
 
 from pymongo import MongoClient, UpdateOne
+from pymongo.errors import AutoReconnect, ConnectionFailure
+from pymongo.results import BulkWriteResult
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from probablyfresh.core.datasets import DEFAULT_BATCH_SIZE, iter_batches, iter_documents
+from probablyfresh.core.load_manifest import IncrementalStats, LoadManifest, manifest_path
+from probablyfresh.integrations.mongo_indexes import ensure_unique_indexes
 
 
 ENTITY_MAP = {
@@ -15,38 +28,170 @@ ENTITY_MAP = {
     "purchases": {"collection": "purchases", "key": "purchase_id"},
 }
 
+# NotPrimaryError, NetworkTimeout and ServerSelectionTimeoutError derive from AutoReconnect.
+TRANSIENT_ERRORS = (AutoReconnect, ConnectionFailure)
+RETRY_BACKOFF_SECONDS = 0.5
+MAX_RETRY_BACKOFF_SECONDS = 8.0
 
-def _repo_root() -> Path:
-    return Path(__file__).resolve().parents[2]
-
-
-def _read_json_files(directory: Path) -> list[dict[str, Any]]:
-    docs: list[dict[str, Any]] = []
-    for file_path in sorted(directory.glob("*.json")):
-        docs.append(json.loads(file_path.read_text(encoding="utf-8")))
-    return docs
-
-
-def _upsert_documents(
-    collection, docs: list[dict[str, Any]], key_field: str
-) -> tuple[int, int, int]:
-    if not docs:
-        return 0, 0, 0
 
+def _repo_root() -> Path:
+    return REPO_ROOT
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Upsert generated JSON data into MongoDB")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("MONGO_BATCH_SIZE", str(DEFAULT_BATCH_SIZE))),
+        help="Number of upserts sent per bulk_write call",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("MONGO_WRITE_WORKERS", "1")),
+        help="Concurrent bulk_write batches per collection (1 = sequential)",
+    )
+    parser.add_argument(
+        "--parallel-entities",
+        action="store_true",
+        help="Load stores/products/customers/purchases concurrently",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=int(os.getenv("MONGO_WRITE_RETRIES", "3")),
+        help="Retries per batch on transient MongoDB errors",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only upsert files/documents changed since the previous incremental load (data/.load_manifest)",
+    )
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be a positive integer")
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if args.max_retries < 0:
+        parser.error("--max-retries must be >= 0")
+    return args
+
+
+def _read_json_files(directory: Path) -> Iterator[dict[str, Any]]:
+    return iter_documents(directory)
+
+
+def _build_upserts(docs: list[dict[str, Any]], key_field: str) -> list[UpdateOne]:
     operations: list[UpdateOne] = []
     for doc in docs:
         if key_field not in doc:
             raise RuntimeError(f"Missing key field {key_field!r} in document: {doc}")
         operations.append(UpdateOne({key_field: doc[key_field]}, {"$set": doc}, upsert=True))
+    return operations
+
+
+def _bulk_write_with_retry(collection, operations: list[UpdateOne], max_retries: int) -> BulkWriteResult:
+    # Upserts keyed by business id are idempotent, so a failed batch can be replayed as a whole.
+    attempt = 0
+    while True:
+        try:
+            return collection.bulk_write(operations, ordered=False)
+        except TRANSIENT_ERRORS as exc:
+            attempt += 1
+            if attempt > max_retries:
+                raise RuntimeError(
+                    f"bulk_write into {collection.name!r} failed after {max_retries} retries: {exc}"
+                ) from exc
+            delay = min(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), MAX_RETRY_BACKOFF_SECONDS)
+            print(f"[{collection.name}] transient error, retry {attempt}/{max_retries} in {delay:.1f}s: {exc}")
+            time.sleep(delay)
+
+
+def _write_batch(
+    collection, batch: list[dict[str, Any]], key_field: str, max_retries: int
+) -> tuple[int, int, int]:
+    result = _bulk_write_with_retry(collection, _build_upserts(batch, key_field), max_retries)
+    return int(result.upserted_count), int(result.modified_count), len(batch)
+
 
-    result = collection.bulk_write(operations, ordered=False)
-    inserted = int(result.upserted_count)
-    updated = int(result.modified_count)
-    processed = len(docs)
-    return inserted, updated, processed
+def _upsert_documents(
+    collection,
+    docs: Iterable[dict[str, Any]],
+    key_field: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 1,
+    max_retries: int = 3,
+) -> tuple[int, int, int]:
+    totals = [0, 0, 0]
+
+    def collect(counts: tuple[int, int, int]) -> None:
+        for index, value in enumerate(counts):
+            totals[index] += value
+
+    if workers == 1:
+        for batch in iter_batches(docs, batch_size):
+            collect(_write_batch(collection, batch, key_field, max_retries))
+        return totals[0], totals[1], totals[2]
+
+    # Keep at most 2 batches per worker in flight so memory stays bounded by batch_size * workers.
+    max_in_flight = workers * 2
+    pending: deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"mongo-{collection.name}") as pool:
+        for batch in iter_batches(docs, batch_size):
+            if len(pending) >= max_in_flight:
+                collect(pending.popleft().result())
+            pending.append(pool.submit(_write_batch, collection, batch, key_field, max_retries))
+        while pending:
+            collect(pending.popleft().result())
+
+    return totals[0], totals[1], totals[2]
+
+
+def _load_entity(db, entity: str, data_root: Path, args: argparse.Namespace) -> str:
+    cfg = ENTITY_MAP[entity]
+    collection_name = cfg["collection"]
+    directory = data_root / entity
+
+    if not directory.exists():
+        raise RuntimeError(f"Directory does not exist: {directory}")
+
+    started = time.perf_counter()
+    manifest: LoadManifest | None = None
+    stats = IncrementalStats()
+    if args.incremental:
+        manifest = LoadManifest.load(manifest_path(data_root, entity), db[collection_name])
+        docs = manifest.iter_changed_documents(directory, cfg["key"], stats)
+    else:
+        docs = _read_json_files(directory)
+
+    inserted, updated, processed = _upsert_documents(
+        db[collection_name],
+        docs,
+        cfg["key"],
+        batch_size=args.batch_size,
+        workers=args.workers,
+        max_retries=args.max_retries,
+    )
+    # The manifest is only persisted once every changed document has been written.
+    if manifest is not None:
+        manifest.save()
+    elapsed = time.perf_counter() - started
+
+    line = (
+        f"[{collection_name}] processed={processed} inserted={inserted} updated={updated} "
+        f"seconds={elapsed:.2f}"
+    )
+    if manifest is not None:
+        line += (
+            f" files={stats.files_total} files_skipped={stats.files_skipped}"
+            f" unchanged={stats.documents_unchanged}"
+        )
+    return line
 
 
 def main() -> None:
+    args = parse_args()
     mongo_uri = os.getenv("MONGO_URI", "").strip()
     mongo_db = os.getenv("MONGO_DB", "").strip()
 
@@ -57,22 +202,20 @@ def main() -> None:
 
     data_root = _repo_root() / "data"
 
+    entity_workers = len(ENTITY_MAP) if args.parallel_entities else 1
+
     with MongoClient(mongo_uri) as client:
         db = client[mongo_db]
 
-        for entity, cfg in ENTITY_MAP.items():
-            collection_name = cfg["collection"]
-            key_field = cfg["key"]
-            directory = data_root / entity
-
-            if not directory.exists():
-                raise RuntimeError(f"Directory does not exist: {directory}")
+        index_seconds = ensure_unique_indexes(
+            db, {cfg["collection"]: cfg["key"] for cfg in ENTITY_MAP.values()}
+        )
+        print(f"[indexes] unique business-key indexes ready seconds={index_seconds:.2f}")
 
-            docs = _read_json_files(directory)
-            inserted, updated, processed = _upsert_documents(db[collection_name], docs, key_field)
-            print(
-                f"[{collection_name}] processed={processed} inserted={inserted} updated={updated}"
-            )
+        with ThreadPoolExecutor(max_workers=entity_workers) as pool:
+            futures = [pool.submit(_load_entity, db, entity, data_root, args) for entity in ENTITY_MAP]
+            for future in futures:
+                print(future.result())
 
 
 if __name__ == "__main__":
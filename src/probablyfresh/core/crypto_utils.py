@@ -1,5 +1,6 @@
 ﻿from __future__ import annotations
 
+from functools import lru_cache
 from hashlib import sha256
 
 from cryptography.fernet import Fernet
@@ -18,12 +19,24 @@ class Encryptor:
         return self._fernet.encrypt(value.encode("utf-8")).decode("utf-8")
 
 
+# The same customer email/phone repeats in every purchase, so a modest cache covers most lookups.
+DEFAULT_HASH_CACHE_SIZE = 65_536
+
+
 class PIIHasher:
-    def __init__(self, salt: str) -> None:
+    def __init__(self, salt: str, cache_size: int = DEFAULT_HASH_CACHE_SIZE) -> None:
         normalized_salt = (salt or "").strip()
         if len(normalized_salt) < 16:
             raise ValueError("PII_HASH_SALT must be at least 16 characters long")
         self._salt = normalized_salt
+        # sha256(f"{salt}:{value}") == prefix state + value bytes; copying the state skips re-digesting the salt.
+        self._prefix = sha256(f"{normalized_salt}:".encode("utf-8"))
+        self._cached_digest = lru_cache(maxsize=cache_size)(self._digest)
+
+    def _digest(self, normalized: str) -> str:
+        digest = self._prefix.copy()
+        digest.update(normalized.encode("utf-8"))
+        return digest.hexdigest()
 
     def hash_value(self, value: str | None) -> str:
         if value is None:
@@ -31,8 +44,11 @@ class PIIHasher:
         normalized = value.strip()
         if not normalized:
             return ""
-        raw = f"{self._salt}:{normalized}".encode("utf-8")
-        return sha256(raw).hexdigest()
+        return self._cached_digest(normalized)
+
+    def cache_info(self):
+        """Returns functools' CacheInfo(hits, misses, maxsize, currsize) for the digest cache."""
+        return self._cached_digest.cache_info()
 
 
 def generate_key() -> str:
@@ -1,6 +1,5 @@
 ﻿from __future__ import annotations
 
-import json
 import random
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
@@ -11,6 +10,7 @@ from uuid import uuid4
 from faker import Faker
 
 from probablyfresh.config import Settings
+from probablyfresh.core.datasets import DatasetWriter, clear_dataset_files, write_manifest
 
 
 CATEGORIES = [
@@ -37,13 +37,24 @@ def _ensure_dir(path: Path) -> None:
 
 
 def _clear_json_files(path: Path) -> None:
-    for file_path in path.glob("*.json"):
-        file_path.unlink()
+    clear_dataset_files(path)
 
 
 
-def _write_json(path: Path, payload: dict[str, Any]) -> None:
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+def _open_writer(settings: Settings, path: Path) -> DatasetWriter:
+    return DatasetWriter(
+        path,
+        output_format=settings.data_output_format,
+        compression=settings.data_compression,
+        chunk_rows=settings.data_chunk_rows,
+    )
+
+
+
+def _close_writer(settings: Settings, path: Path, writer: DatasetWriter) -> None:
+    chunks = writer.close()
+    if settings.data_output_format == "ndjson":
+        write_manifest(path, path.name, settings.data_compression, settings.data_chunk_rows, chunks)
 
 
 
@@ -60,6 +71,11 @@ def generate_data(settings: Settings) -> GenerationResult:
         _ensure_dir(directory)
         _clear_json_files(directory)
 
+    stores_writer = _open_writer(settings, stores_dir)
+    products_writer = _open_writer(settings, products_dir)
+    customers_writer = _open_writer(settings, customers_dir)
+    purchases_writer = _open_writer(settings, purchases_dir)
+
     stores: list[dict[str, Any]] = []
     store_specs = [
         ("ProbablyFresh Almost", settings.stores_almost_count, "Large format store in a network of 30 locations."),
@@ -105,7 +121,7 @@ def generate_data(settings: Settings) -> GenerationResult:
                 "last_inventory_date": datetime.now(tz=timezone.utc).date().isoformat(),
             }
             stores.append(payload)
-            _write_json(stores_dir / f"{store_id}.json", payload)
+            stores_writer.write(store_id, payload)
 
     products: list[dict[str, Any]] = []
     product_index = 1
@@ -137,7 +153,7 @@ def generate_data(settings: Settings) -> GenerationResult:
                 },
             }
             products.append(payload)
-            _write_json(products_dir / f"{product_id}.json", payload)
+            products_writer.write(product_id, payload)
             product_index += 1
 
     customers: list[dict[str, Any]] = []
@@ -182,7 +198,7 @@ def generate_data(settings: Settings) -> GenerationResult:
                 },
             }
             customers.append(payload)
-            _write_json(customers_dir / f"{customer_id}.json", payload)
+            customers_writer.write(customer_id, payload)
             customer_index += 1
 
     purchases_created = 0
@@ -250,9 +266,17 @@ def generate_data(settings: Settings) -> GenerationResult:
             "purchase_datetime": purchase_datetime,
         }
 
-        _write_json(purchases_dir / f"{purchase_id}.json", payload)
+        purchases_writer.write(purchase_id, payload)
         purchases_created += 1
 
+    for directory, writer in (
+        (stores_dir, stores_writer),
+        (products_dir, products_writer),
+        (customers_dir, customers_writer),
+        (purchases_dir, purchases_writer),
+    ):
+        _close_writer(settings, directory, writer)
+
     return GenerationResult(
         stores=len(stores),
         products=len(products),
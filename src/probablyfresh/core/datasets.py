@@ -0,0 +1,222 @@
+﻿from __future__ import annotations
+
+import gzip
+import io
+import json
+from itertools import islice
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from probablyfresh.core.serialization import dumps, loads
+
+try:
+    import zstandard
+except ImportError:  # zstd output is optional
+    zstandard = None
+
+
+MANIFEST_NAME = "manifest.json"
+OUTPUT_FORMATS = ("json", "ndjson")
+COMPRESSION_SUFFIXES = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+DEFAULT_CHUNK_ROWS = 100_000
+DEFAULT_BATCH_SIZE = 1_000
+
+
+
+def _require_compression(compression: str) -> None:
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unsupported compression {compression!r}, expected one of {sorted(COMPRESSION_SUFFIXES)}")
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError("zstd compression requires the 'zstandard' package: pip install zstandard")
+
+
+
+def chunk_file_name(prefix: str, index: int, compression: str) -> str:
+    return f"{prefix}-{index:05d}.ndjson{COMPRESSION_SUFFIXES[compression]}"
+
+
+
+def encode_ndjson(documents: list[dict[str, Any]]) -> bytes:
+    return b"\n".join(dumps(document) for document in documents) + b"\n"
+
+
+
+def compress_bytes(data: bytes, compression: str) -> bytes:
+    _require_compression(compression)
+    if compression == "gzip":
+        # mtime=0 keeps chunks byte-identical between runs with the same seed.
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+
+def _open_chunk(path: Path) -> io.BufferedIOBase:
+    if path.name.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, "rb")
+    if path.name.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        _require_compression("zstd")
+        stream = zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+        return io.BufferedReader(stream)
+    return path.open("rb")
+
+
+
+def write_json_document(path: Path, payload: dict[str, Any]) -> None:
+    path.write_bytes(dumps(payload, indent=True))
+
+
+
+class ChunkWriter:
+    """Buffers documents and writes them as fixed-size NDJSON chunk files."""
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str = "part",
+        compression: str = "none",
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    ) -> None:
+        _require_compression(compression)
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be a positive integer")
+        self._directory = directory
+        self._prefix = prefix
+        self._compression = compression
+        self._chunk_rows = chunk_rows
+        self._buffer: list[dict[str, Any]] = []
+        self._chunks: list[dict[str, Any]] = []
+
+    def write(self, document: dict[str, Any]) -> None:
+        self._buffer.append(document)
+        if len(self._buffer) >= self._chunk_rows:
+            self._flush()
+
+    def close(self) -> list[dict[str, Any]]:
+        if self._buffer:
+            self._flush()
+        return self._chunks
+
+    def _flush(self) -> None:
+        file_name = chunk_file_name(self._prefix, len(self._chunks), self._compression)
+        data = compress_bytes(encode_ndjson(self._buffer), self._compression)
+        (self._directory / file_name).write_bytes(data)
+        self._chunks.append({"file": file_name, "rows": len(self._buffer), "bytes": len(data)})
+        self._buffer = []
+
+
+
+class DatasetWriter:
+    """Writes entity documents either as one JSON file per document or as NDJSON chunks."""
+
+    def __init__(
+        self,
+        directory: Path,
+        output_format: str = "json",
+        compression: str = "none",
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        prefix: str = "part",
+    ) -> None:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format {output_format!r}, expected one of {OUTPUT_FORMATS}")
+        self._directory = directory
+        self._chunks = (
+            ChunkWriter(directory, prefix=prefix, compression=compression, chunk_rows=chunk_rows)
+            if output_format == "ndjson"
+            else None
+        )
+
+    def write(self, name: str, payload: dict[str, Any]) -> None:
+        if self._chunks is None:
+            write_json_document(self._directory / f"{name}.json", payload)
+        else:
+            self._chunks.write(payload)
+
+    def close(self) -> list[dict[str, Any]]:
+        return self._chunks.close() if self._chunks is not None else []
+
+
+
+def write_manifest(
+    directory: Path,
+    entity: str,
+    compression: str,
+    chunk_rows: int,
+    chunks: list[dict[str, Any]],
+) -> Path:
+    manifest = {
+        "entity": entity,
+        "format": "ndjson",
+        "compression": compression,
+        "chunk_rows": chunk_rows,
+        "rows": sum(int(chunk["rows"]) for chunk in chunks),
+        "chunks": chunks,
+    }
+    path = directory / MANIFEST_NAME
+    path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+
+def read_manifest(directory: Path) -> dict[str, Any] | None:
+    path = directory / MANIFEST_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+
+def clear_dataset_files(directory: Path) -> None:
+    for pattern in ("*.json", "*.ndjson", "*.ndjson.gz", "*.ndjson.zst"):
+        for file_path in directory.glob(pattern):
+            file_path.unlink()
+
+
+
+def iter_chunk_documents(path: Path) -> Iterator[dict[str, Any]]:
+    with _open_chunk(path) as handle:
+        for line in handle:
+            if line.strip():
+                yield loads(line)
+
+
+
+def list_source_files(directory: Path) -> list[Path]:
+    """Returns the files holding entity documents: manifest chunks if present, else per-document JSON files."""
+    manifest = read_manifest(directory)
+    if manifest is not None:
+        return [directory / chunk["file"] for chunk in manifest.get("chunks", [])]
+    return sorted(directory.glob("*.json"))
+
+
+
+def iter_file_documents(path: Path) -> Iterator[dict[str, Any]]:
+    if path.suffix == ".json":
+        yield loads(path.read_bytes())
+        return
+    yield from iter_chunk_documents(path)
+
+
+
+def iter_documents(directory: Path) -> Iterator[dict[str, Any]]:
+    """Yields entity documents from either NDJSON chunks (manifest) or per-document JSON files."""
+    for file_path in list_source_files(directory):
+        yield from iter_file_documents(file_path)
+
+
+
+def iter_batches(documents: Iterable[dict[str, Any]], batch_size: int) -> Iterator[list[dict[str, Any]]]:
+    """Groups a document stream into lists of at most batch_size items without materializing it."""
+    if batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+    iterator = iter(documents)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
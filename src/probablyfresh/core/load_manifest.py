@@ -0,0 +1,163 @@
+﻿from __future__ import annotations
+
+import hashlib
+import json
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+from probablyfresh.core.datasets import iter_file_documents, list_source_files
+
+
+LOAD_MANIFEST_DIR = ".load_manifest"
+LOAD_MANIFEST_VERSION = 2
+# Marker documents ({_id: collection name, load_id}) tying a manifest to the live target.
+LOAD_MARKER_COLLECTION = "_load_manifest"
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for block in iter(lambda: handle.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+
+def document_hash(document: dict[str, Any]) -> str:
+    canonical = json.dumps(document, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+
+
+def manifest_path(data_root: Path, entity: str) -> Path:
+    return data_root / LOAD_MANIFEST_DIR / f"{entity}.json"
+
+
+
+@dataclass
+class IncrementalStats:
+    files_total: int = 0
+    files_skipped: int = 0
+    documents_unchanged: int = 0
+    documents_changed: int = 0
+
+
+
+class LoadManifest:
+    """Remembers which dataset files and documents were already loaded into a given database.
+
+    Each source file is tracked by size, mtime_ns and sha256, together with a
+    business key -> document hash map, so unchanged files are skipped without
+    being read and changed files only yield their new or modified documents.
+
+    The manifest lives in data/ while Mongo keeps its own volume, so it is only
+    trusted when the target collection still holds the marker written by save()
+    and at least as many documents as the manifest tracks. Otherwise (after
+    `docker compose down -v` or a dropped database) every document is reloaded.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        collection,
+        files: dict[str, dict[str, Any]] | None = None,
+        load_id: str | None = None,
+    ) -> None:
+        self.path = path
+        self.collection = collection
+        self.database = collection.database.name
+        self.files: dict[str, dict[str, Any]] = files or {}
+        self.load_id = load_id
+
+    @classmethod
+    def load(cls, path: Path, collection) -> "LoadManifest":
+        if not path.exists():
+            return cls(path, collection)
+        raw = json.loads(path.read_text(encoding="utf-8"))
+        # A manifest written for another database or format says nothing about this target.
+        if raw.get("version") != LOAD_MANIFEST_VERSION or raw.get("database") != collection.database.name:
+            return cls(path, collection)
+
+        marker = collection.database[LOAD_MARKER_COLLECTION].find_one({"_id": collection.name})
+        if marker is None or marker.get("load_id") != raw.get("load_id"):
+            return cls(path, collection)
+
+        files = raw.get("files", {})
+        tracked_keys = sum(len(entry["keys"]) for entry in files.values())
+        if collection.estimated_document_count() < tracked_keys:
+            return cls(path, collection)
+        return cls(path, collection, files, raw["load_id"])
+
+    def save(self) -> None:
+        if self.load_id is None:
+            self.load_id = uuid.uuid4().hex
+            # The marker goes first: a crash before the file write leaves a mismatch, i.e. a full reload.
+            self.collection.database[LOAD_MARKER_COLLECTION].replace_one(
+                {"_id": self.collection.name},
+                {"_id": self.collection.name, "load_id": self.load_id},
+                upsert=True,
+            )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "version": LOAD_MANIFEST_VERSION,
+            "database": self.database,
+            "load_id": self.load_id,
+            "files": self.files,
+        }
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        tmp_path.replace(self.path)
+
+    def iter_changed_documents(
+        self, directory: Path, key_field: str, stats: IncrementalStats
+    ) -> Iterator[dict[str, Any]]:
+        """Yields new or modified documents and updates the in-memory manifest; call save() after they are written."""
+        seen: set[str] = set()
+
+        for file_path in list_source_files(directory):
+            name = file_path.name
+            seen.add(name)
+            stats.files_total += 1
+
+            stat = file_path.stat()
+            entry = self.files.get(name)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                stats.files_skipped += 1
+                stats.documents_unchanged += len(entry["keys"])
+                continue
+
+            sha256 = file_sha256(file_path)
+            if entry and entry["sha256"] == sha256:
+                entry["mtime_ns"] = stat.st_mtime_ns
+                stats.files_skipped += 1
+                stats.documents_unchanged += len(entry["keys"])
+                continue
+
+            previous_keys: dict[str, str] = entry["keys"] if entry else {}
+            keys: dict[str, str] = {}
+            for document in iter_file_documents(file_path):
+                if key_field not in document:
+                    raise RuntimeError(f"Missing key field {key_field!r} in {file_path}: {document}")
+                key = str(document[key_field])
+                doc_hash = document_hash(document)
+                keys[key] = doc_hash
+                if previous_keys.get(key) == doc_hash:
+                    stats.documents_unchanged += 1
+                    continue
+                stats.documents_changed += 1
+                yield document
+
+            self.files[name] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": sha256,
+                "keys": keys,
+            }
+
+        for name in list(self.files):
+            if name not in seen:
+                del self.files[name]
@@ -1,6 +1,21 @@
 ﻿from __future__ import annotations
 
 import re
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from probablyfresh.core.crypto_utils import PIIHasher
+
+
+_NON_DIGITS_RE = re.compile(r"\D")
+_PHONE_SEPARATORS_RE = re.compile(r"[\s()\-]")
+_RU_MOBILE_RE = re.compile(r"[78]\d{10}")
+
+# ASCII fast paths: bytes.translate deletes exactly the characters the regexes above
+# would remove. The byte sets are derived from the patterns, so both paths agree;
+# non-ASCII input (Unicode digits/spaces) still goes through the regexes.
+_ASCII_NON_DIGITS = bytes(code for code in range(128) if _NON_DIGITS_RE.match(chr(code)))
+_ASCII_PHONE_SEPARATORS = bytes(code for code in range(128) if _PHONE_SEPARATORS_RE.match(chr(code)))
 
 
 def normalize_email(value: str) -> str:
@@ -9,7 +24,11 @@ def normalize_email(value: str) -> str:
 
 
 def normalize_phone(value: str) -> str:
-    digits = re.sub(r"\D", "", value)
+    """Lenient normalization: keeps digits only, maps 10-digit and 8XXXXXXXXXX numbers to +7."""
+    if value.isascii():
+        digits = value.encode("ascii").translate(None, _ASCII_NON_DIGITS).decode("ascii")
+    else:
+        digits = _NON_DIGITS_RE.sub("", value)
     if len(digits) == 10:
         digits = "7" + digits
     if len(digits) == 11 and digits.startswith("8"):
@@ -17,3 +36,46 @@ def normalize_phone(value: str) -> str:
     if digits and not digits.startswith("+"):
         return "+" + digits
     return digits
+
+
+
+def normalize_phone_strict(value: str) -> tuple[str, bool]:
+    """Strict normalization used by the Mongo -> Kafka producer.
+
+    Strips spaces, brackets and dashes; numbers already in +E.164 form are kept,
+    7/8-prefixed 11-digit numbers become +7XXXXXXXXXX. Anything else is returned
+    unchanged with ok=False so the caller can report it.
+    """
+    if value.isascii():
+        cleaned = value.encode("ascii").translate(None, _ASCII_PHONE_SEPARATORS).decode("ascii")
+        if cleaned.startswith("+"):
+            return cleaned, True
+        if len(cleaned) == 11 and cleaned[0] in "78" and cleaned.isdigit():
+            return "+7" + cleaned[1:], True
+        return value, False
+
+    cleaned = _PHONE_SEPARATORS_RE.sub("", value.strip())
+    if cleaned.startswith("+"):
+        return cleaned, True
+    if _RU_MOBILE_RE.fullmatch(cleaned):
+        return "+7" + cleaned[1:], True
+    return value, False
+
+
+
+def normalize_phones(values: Iterable[str]) -> list[str]:
+    return [normalize_phone(value) for value in values]
+
+
+
+def hash_phones(values: Iterable[str], hasher: PIIHasher) -> list[str]:
+    """Normalizes and hashes a batch of phones, computing each distinct value only once."""
+    hashed: dict[str, str] = {}
+    output: list[str] = []
+    for value in values:
+        digest = hashed.get(value)
+        if digest is None:
+            digest = hasher.hash_value(normalize_phone(value))
+            hashed[value] = digest
+        output.append(digest)
+    return output
@@ -0,0 +1,104 @@
+﻿from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+PII_KEYS = ("email", "phone")
+
+
+
+@dataclass(frozen=True)
+class PIIPlan:
+    """Where PII lives in one entity's documents.
+
+    top_level_keys is the full set of keys the plan was written for, and each
+    parent is a path to a dict holding email/phone together with that dict's
+    expected keys. Nested containers not listed here (items, location, ...)
+    are known to be PII-free.
+    """
+
+    top_level_keys: frozenset[str]
+    parents: tuple[tuple[tuple[str, ...], frozenset[str]], ...] = ()
+
+
+
+_STORE_KEYS = frozenset(
+    {
+        "store_id", "store_name", "store_network", "store_type_description", "type", "categories",
+        "manager", "location", "opening_hours", "accepts_online_orders", "delivery_available",
+        "warehouse_connected", "last_inventory_date",
+    }
+)
+_CUSTOMER_KEYS = frozenset(
+    {
+        "customer_id", "first_name", "last_name", "email", "phone", "birth_date", "gender",
+        "registration_date", "is_loyalty_member", "loyalty_card_number", "purchase_location",
+        "delivery_address", "preferences",
+    }
+)
+_PURCHASE_KEYS = frozenset(
+    {
+        "purchase_id", "customer", "store", "items", "total_amount", "payment_method", "is_delivery",
+        "purchase_datetime", "delivery_address",
+    }
+)
+_PURCHASE_CUSTOMER_KEYS = frozenset(
+    {
+        "customer_id", "first_name", "last_name", "email", "phone", "is_loyalty_member",
+        "loyalty_card_number",
+    }
+)
+_PRODUCT_KEYS = frozenset(
+    {
+        "id", "name", "group", "description", "kbju", "price", "unit", "origin_country", "expiry_days",
+        "is_organic", "barcode", "manufacturer",
+    }
+)
+
+ENTITY_PII_PLANS = {
+    "stores": PIIPlan(_STORE_KEYS, ((("manager",), frozenset({"name", "phone", "email"})),)),
+    "customers": PIIPlan(_CUSTOMER_KEYS, (((), _CUSTOMER_KEYS),)),
+    "purchases": PIIPlan(_PURCHASE_KEYS, ((("customer",), _PURCHASE_CUSTOMER_KEYS),)),
+    "products": PIIPlan(_PRODUCT_KEYS),
+}
+
+
+
+def apply_pii_plan(
+    document: dict[str, Any],
+    plan: PIIPlan,
+    transform: Callable[[str, str], str],
+) -> dict[str, Any] | None:
+    """Replaces email/phone at the planned paths via transform(key, value).
+
+    Only the dicts on those paths are copied; the rest of the document is shared
+    with the input. Returns None when the document has keys the plan does not
+    know about, so the caller can fall back to a full recursive walk.
+    """
+    if not plan.top_level_keys.issuperset(document):
+        return None
+    if not plan.parents:
+        return document
+
+    result = dict(document)
+    for path, expected_keys in plan.parents:
+        parent = result
+        for key in path:
+            child = parent.get(key)
+            if child is None:
+                break
+            if not isinstance(child, dict):
+                return None
+            child = dict(child)
+            parent[key] = child
+            parent = child
+        else:
+            if not expected_keys.issuperset(parent):
+                return None
+            for key in PII_KEYS:
+                value = parent.get(key)
+                if isinstance(value, str):
+                    parent[key] = transform(key, value)
+
+    return result
@@ -0,0 +1,141 @@
+﻿from __future__ import annotations
+
+import re
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+
+PROTO_PATH = Path(__file__).resolve().parents[3] / "docker" / "clickhouse" / "format_schemas" / "probablyfresh.proto"
+ENTITY_MESSAGES = {
+    "stores": "Store",
+    "products": "Product",
+    "customers": "Customer",
+    "purchases": "Purchase",
+}
+PAYLOAD_FORMATS = ("json", "protobuf")
+
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH_DELIMITED = 2
+_SCALAR_WIRE_TYPES = {
+    "string": _WIRE_LENGTH_DELIMITED,
+    "double": _WIRE_FIXED64,
+    "bool": _WIRE_VARINT,
+    "int32": _WIRE_VARINT,
+    "int64": _WIRE_VARINT,
+}
+_DOUBLE = struct.Struct("<d")
+
+_COMMENT_RE = re.compile(r"//[^\n]*")
+_MESSAGE_RE = re.compile(r"message\s+(\w+)\s*\{([^{}]*)\}")
+_FIELD_RE = re.compile(r"(repeated\s+)?(\w+)\s+(\w+)\s*=\s*(\d+)\s*;")
+
+
+
+@dataclass(frozen=True)
+class ProtoField:
+    name: str
+    type_name: str
+    number: int
+    repeated: bool
+    tag: bytes
+
+
+
+def _varint(value: int) -> bytes:
+    if value < 0:
+        # int32/int64 negatives are encoded as 10-byte two's complement varints.
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+
+def parse_proto(text: str) -> dict[str, tuple[ProtoField, ...]]:
+    """Parses the flat proto3 subset used by probablyfresh.proto (no nested message declarations)."""
+    messages: dict[str, tuple[ProtoField, ...]] = {}
+    for message_name, body in _MESSAGE_RE.findall(_COMMENT_RE.sub("", text)):
+        fields = []
+        for repeated, type_name, field_name, number in _FIELD_RE.findall(body):
+            wire_type = _SCALAR_WIRE_TYPES.get(type_name, _WIRE_LENGTH_DELIMITED)
+            fields.append(
+                ProtoField(
+                    name=field_name,
+                    type_name=type_name,
+                    number=int(number),
+                    repeated=bool(repeated),
+                    tag=_varint((int(number) << 3) | wire_type),
+                )
+            )
+        messages[message_name] = tuple(sorted(fields, key=lambda field: field.number))
+
+    for fields in messages.values():
+        for field in fields:
+            if field.type_name not in _SCALAR_WIRE_TYPES and field.type_name not in messages:
+                raise ValueError(f"Unknown protobuf type {field.type_name!r} for field {field.name!r}")
+    return messages
+
+
+
+@lru_cache(maxsize=None)
+def load_schema(path: Path = PROTO_PATH) -> dict[str, tuple[ProtoField, ...]]:
+    return parse_proto(path.read_text(encoding="utf-8"))
+
+
+
+def _encode_value(field: ProtoField, value: Any, schema: dict[str, tuple[ProtoField, ...]]) -> bytes:
+    type_name = field.type_name
+    if type_name == "string":
+        data = str(value).encode("utf-8")
+        return field.tag + _varint(len(data)) + data
+    if type_name == "double":
+        return field.tag + _DOUBLE.pack(float(value))
+    if type_name == "bool":
+        return field.tag + (b"\x01" if value else b"\x00")
+    if type_name in ("int32", "int64"):
+        return field.tag + _varint(int(value))
+    if not isinstance(value, dict):
+        raise ValueError(f"Field {field.name!r} expects a {type_name} object, got {type(value).__name__}")
+    data = encode_message(schema, type_name, value)
+    return field.tag + _varint(len(data)) + data
+
+
+
+def encode_message(schema: dict[str, tuple[ProtoField, ...]], message_name: str, document: dict[str, Any]) -> bytes:
+    """Encodes a document as a protobuf message; keys missing from the schema are dropped.
+
+    Scalar fields equal to their proto3 default ('' / 0 / false) are omitted, as
+    a protobuf library would do; the decoder restores the same defaults.
+    """
+    parts: list[bytes] = []
+    for field in schema[message_name]:
+        value = document.get(field.name)
+        if value is None:
+            continue
+        if field.repeated:
+            for item in value:
+                parts.append(_encode_value(field, item, schema))
+            continue
+        if field.type_name in _SCALAR_WIRE_TYPES and not value:
+            continue
+        parts.append(_encode_value(field, value, schema))
+    return b"".join(parts)
+
+
+
+def encode_entity(entity_name: str, document: dict[str, Any]) -> bytes:
+    return encode_message(load_schema(), ENTITY_MESSAGES[entity_name], document)
+
+
+
+def validate_payload_format(value: str) -> str:
+    if value not in PAYLOAD_FORMATS:
+        raise ValueError(f"Unsupported Kafka payload format {value!r}, expected one of {PAYLOAD_FORMATS}")
+    return value
@@ -0,0 +1,41 @@
+﻿from __future__ import annotations
+
+import json
+import os
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib is the fallback
+    orjson = None
+
+
+# PROBABLYFRESH_JSON_BACKEND=json forces the stdlib even when orjson is installed.
+_FORCE_STDLIB = os.getenv("PROBABLYFRESH_JSON_BACKEND", "").strip().lower() == "json"
+BACKEND = "orjson" if orjson is not None and not _FORCE_STDLIB else "json"
+
+
+
+def dumps(value: Any, indent: bool = False) -> bytes:
+    """Serializes to UTF-8 JSON bytes (non-ASCII kept as-is, compact unless indent=True)."""
+    if BACKEND == "orjson":
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 if indent else None)
+    if indent:
+        return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+
+def dumps_str(value: Any) -> str:
+    return dumps(value).decode("utf-8")
+
+
+
+def loads(data: bytes | str) -> Any:
+    if BACKEND == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (e.g. NaN literals); let the stdlib accept or report it.
+            pass
+    return json.loads(data)
@@ -0,0 +1,17 @@
+﻿from __future__ import annotations
+
+import re
+
+
+# `<n> /* RAW_TTL_DAYS */` in the ClickHouse init SQL: the literal keeps the files runnable
+# by hand, the marker limits rendering to intervals that really follow the raw retention.
+RAW_TTL_DAYS_MARKER = "/* RAW_TTL_DAYS */"
+_RAW_TTL_DAYS_RE = re.compile(r"\d+ /\* RAW_TTL_DAYS \*/")
+
+
+
+def render_raw_ttl_days(sql_text: str, ttl_days: int) -> str:
+    """Substitutes the raw retention in days into every RAW_TTL_DAYS marker of the SQL."""
+    if ttl_days < 1:
+        raise ValueError(f"CLICKHOUSE_RAW_TTL_DAYS must be a positive integer, got {ttl_days}")
+    return _RAW_TTL_DAYS_RE.sub(f"{ttl_days} {RAW_TTL_DAYS_MARKER}", sql_text)
@@ -1,10 +1,27 @@
 ﻿from __future__ import annotations
 
+import re
+from dataclasses import dataclass
 from pathlib import Path
 
 from clickhouse_driver import Client
 
 from probablyfresh.config import Settings
+from probablyfresh.core.sql_templates import render_raw_ttl_days
+
+
+_CREATE_TABLE_RE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.]+)", re.IGNORECASE)
+_CREATE_VIEW_RE = re.compile(r"CREATE\s+MATERIALIZED\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.]+)", re.IGNORECASE)
+_KAFKA_ENGINE_RE = re.compile(r"ENGINE\s*=\s*Kafka\b", re.IGNORECASE)
+_FROM_RE = re.compile(r"\bFROM\s+([\w.]+)", re.IGNORECASE)
+_KAFKA_FORMAT_RE = re.compile(r"kafka_format\s*=\s*'(\w+)'")
+
+# kafka_format of the *_kafka tables -> payload format of the producers (01_init.sql vs optional/03).
+KAFKA_PAYLOAD_FORMATS = {"RawBLOB": "json", "ProtobufSingle": "protobuf"}
+
+RAW_TABLES = ("stores_raw", "products_raw", "customers_raw", "purchases_raw", "purchase_items_raw")
+_RAW_TTL_RE = re.compile(r"TTL ingested_at \+ INTERVAL \d+ /\* RAW_TTL_DAYS \*/ DAY")
+_RAW_TTL_SETTINGS_RE = re.compile(r"SETTINGS ttl_only_drop_parts = 1")
 
 
 
@@ -31,20 +48,173 @@ def _split_sql_statements(sql_text: str) -> list[str]:
 
 
 
-def run_init_sql(settings: Settings, sql_path: Path) -> int:
-    sql_text = sql_path.read_text(encoding="utf-8")
-    statements = _split_sql_statements(sql_text)
+def kafka_engine_settings(settings: Settings) -> dict[str, int]:
+    return {
+        "kafka_num_consumers": settings.clickhouse_kafka_num_consumers,
+        "kafka_max_block_size": settings.clickhouse_kafka_max_block_size,
+        "kafka_flush_interval_ms": settings.clickhouse_kafka_flush_interval_ms,
+        "kafka_thread_per_consumer": int(settings.clickhouse_kafka_thread_per_consumer),
+    }
+
+
+
+def render_kafka_settings(sql_text: str, overrides: dict[str, int]) -> str:
+    """Replaces `name = <int>` values of Kafka engine settings already present in the SQL."""
+    for name, value in overrides.items():
+        if value < 0:
+            raise ValueError(f"Kafka engine setting {name} must be non-negative, got {value}")
+        sql_text = re.sub(rf"(\b{name}\s*=\s*)\d+", rf"\g<1>{value}", sql_text)
+    return sql_text
+
+
+
+def kafka_engine_objects(statements: list[str]) -> tuple[list[str], list[str]]:
+    """Returns (materialized views reading from Kafka tables, Kafka engine tables) declared in the SQL."""
+    tables = []
+    for statement in statements:
+        match = _CREATE_TABLE_RE.search(statement)
+        if match and _KAFKA_ENGINE_RE.search(statement):
+            tables.append(match.group(1))
+
+    views = []
+    for statement in statements:
+        match = _CREATE_VIEW_RE.search(statement)
+        if match and any(source in tables for source in _FROM_RE.findall(statement)):
+            views.append(match.group(1))
+    return views, tables
+
+
+
+@dataclass(frozen=True)
+class RawRetention:
+    ttl_days: int
+    storage_policy: str = ""
+    cold_volume: str = "cold"
+    move_after_days: int = 0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> RawRetention:
+        return cls(
+            ttl_days=settings.clickhouse_raw_ttl_days,
+            storage_policy=settings.clickhouse_raw_storage_policy,
+            cold_volume=settings.clickhouse_raw_cold_volume,
+            move_after_days=settings.clickhouse_raw_move_after_days,
+        )
+
+    def validate(self) -> None:
+        if self.ttl_days < 1:
+            raise ValueError(f"CLICKHOUSE_RAW_TTL_DAYS must be a positive integer, got {self.ttl_days}")
+        if self.move_after_days < 0:
+            raise ValueError(f"CLICKHOUSE_RAW_MOVE_AFTER_DAYS must be non-negative, got {self.move_after_days}")
+        if self.move_after_days and not self.storage_policy:
+            raise ValueError("CLICKHOUSE_RAW_MOVE_AFTER_DAYS needs CLICKHOUSE_RAW_STORAGE_POLICY with a cold volume")
+        if self.move_after_days >= self.ttl_days:
+            raise ValueError("CLICKHOUSE_RAW_MOVE_AFTER_DAYS must be lower than CLICKHOUSE_RAW_TTL_DAYS")
+
+    def ttl_clause(self) -> str:
+        delete = f"ingested_at + INTERVAL {self.ttl_days} DAY"
+        if self.move_after_days:
+            return f"TTL ingested_at + INTERVAL {self.move_after_days} DAY TO VOLUME '{self.cold_volume}', {delete}"
+        return f"TTL {delete}"
+
 
-    client = Client(
+
+def render_raw_retention(sql_text: str, retention: RawRetention) -> str:
+    """Applies the raw TTL/storage policy to CREATE statements and the quality window to mart SQL."""
+    retention.validate()
+    sql_text = _RAW_TTL_RE.sub(retention.ttl_clause(), sql_text)
+    sql_text = render_raw_ttl_days(sql_text, retention.ttl_days)
+    if retention.storage_policy:
+        sql_text = _RAW_TTL_SETTINGS_RE.sub(
+            f"SETTINGS ttl_only_drop_parts = 1, storage_policy = '{retention.storage_policy}'", sql_text
+        )
+    return sql_text
+
+
+
+def _client(settings: Settings) -> Client:
+    return Client(
         host=settings.clickhouse_host,
         port=settings.clickhouse_port,
         user=settings.clickhouse_user,
         password=settings.clickhouse_password,
     )
 
+
+
+def run_init_sql(
+    settings: Settings,
+    sql_path: Path,
+    kafka_overrides: dict[str, int] | None = None,
+    recreate_kafka_tables: bool = False,
+    raw_retention: RawRetention | None = None,
+) -> int:
+    sql_text = sql_path.read_text(encoding="utf-8")
+    if kafka_overrides:
+        sql_text = render_kafka_settings(sql_text, kafka_overrides)
+    if raw_retention is not None:
+        sql_text = render_raw_retention(sql_text, raw_retention)
+    statements = _split_sql_statements(sql_text)
+
+    client = _client(settings)
+
+    if recreate_kafka_tables:
+        # Kafka engine settings are fixed at CREATE time. The consumer views are dropped
+        # first and recreated by the script; committed group offsets stay in Kafka.
+        views, tables = kafka_engine_objects(statements)
+        for name in views:
+            client.execute(f"DROP VIEW IF EXISTS {name}")
+        for name in tables:
+            client.execute(f"DROP TABLE IF EXISTS {name}")
+
     executed = 0
     for statement in statements:
         client.execute(statement)
         executed += 1
 
     return executed
+
+
+
+def installed_kafka_payload_format(settings: Settings) -> str | None:
+    """Returns "protobuf" if any raw Kafka table decodes Protobuf, "json" for RawBLOB ones, None without Kafka tables."""
+    rows = _client(settings).execute(
+        "SELECT engine_full FROM system.tables WHERE database = %(database)s AND engine = 'Kafka'",
+        {"database": settings.clickhouse_db},
+    )
+    formats = set()
+    for (engine_full,) in rows:
+        match = _KAFKA_FORMAT_RE.search(engine_full)
+        if match:
+            formats.add(KAFKA_PAYLOAD_FORMATS.get(match.group(1), match.group(1)))
+    if "protobuf" in formats:
+        return "protobuf"
+    return "json" if formats else None
+
+
+
+def drop_expired_partitions(settings: Settings, ttl_days: int, dry_run: bool = False) -> list[tuple[str, str]]:
+    """Drops monthly raw partitions that lie entirely before now() - ttl_days; returns (table, partition_id)."""
+    if ttl_days < 1:
+        raise ValueError(f"ttl_days must be a positive integer, got {ttl_days}")
+
+    client = _client(settings)
+    # Only toYYYYMM partitions qualify: tables created before partitioning have the single 'all' partition.
+    expired = client.execute(
+        """
+        SELECT DISTINCT table, partition_id
+        FROM system.parts
+        WHERE database = %(database)s
+          AND table IN %(tables)s
+          AND active
+          AND match(partition_id, '^[0-9]{6}$')
+          AND toUInt32(partition_id) < toYYYYMM(now() - toIntervalDay(%(ttl_days)s))
+        ORDER BY table, partition_id
+        """,
+        {"database": settings.clickhouse_db, "tables": list(RAW_TABLES), "ttl_days": ttl_days},
+    )
+
+    if not dry_run:
+        for table, partition_id in expired:
+            client.execute(f"ALTER TABLE {settings.clickhouse_db}.{table} DROP PARTITION ID '{partition_id}'")
+    return [(table, partition_id) for table, partition_id in expired]
@@ -1,15 +1,16 @@
 ﻿from __future__ import annotations
 
-import json
 from datetime import datetime, timezone
-from pathlib import Path
 from typing import Any
 
-from kafka import KafkaProducer
-
 from probablyfresh.config import Settings
 from probablyfresh.core.crypto_utils import PIIHasher
+from probablyfresh.core.datasets import iter_documents
 from probablyfresh.core.normalization import normalize_email, normalize_phone
+from probablyfresh.core.pii_plans import ENTITY_PII_PLANS, apply_pii_plan
+from probablyfresh.core.protobuf import encode_entity, validate_payload_format
+from probablyfresh.core.serialization import dumps, dumps_str
+from probablyfresh.integrations.kafka_profile import DeliveryTracker, create_producer
 
 
 ENTITY_TO_TOPIC = {
@@ -23,11 +24,6 @@ SENSITIVE_KEYS = {"phone", "email"}
 
 
 
-def _load_json(path: Path) -> dict[str, Any]:
-    return json.loads(path.read_text(encoding="utf-8"))
-
-
-
 def _object_id(entity_name: str, payload: dict[str, Any]) -> str:
     if entity_name == "stores":
         return str(payload.get("store_id", ""))
@@ -41,13 +37,18 @@ def _object_id(entity_name: str, payload: dict[str, Any]) -> str:
 
 
 
+def _hash_field(key: str, value: str, hasher: PIIHasher) -> str:
+    normalized = normalize_email(value) if key == "email" else normalize_phone(value)
+    return hasher.hash_value(normalized)
+
+
+
 def _hash_sensitive_fields(value: Any, hasher: PIIHasher) -> Any:
     if isinstance(value, dict):
         output: dict[str, Any] = {}
         for key, nested_value in value.items():
             if key in SENSITIVE_KEYS and isinstance(nested_value, str):
-                normalized = normalize_email(nested_value) if key == "email" else normalize_phone(nested_value)
-                output[key] = hasher.hash_value(normalized)
+                output[key] = _hash_field(key, nested_value, hasher)
             else:
                 output[key] = _hash_sensitive_fields(nested_value, hasher)
         return output
@@ -60,37 +61,47 @@ def _hash_sensitive_fields(value: Any, hasher: PIIHasher) -> Any:
 
 
 def publish_raw_events(settings: Settings) -> dict[str, int]:
+    payload_format = validate_payload_format(settings.kafka_payload_format)
     hasher = PIIHasher(settings.pii_hash_salt)
     counters: dict[str, int] = {name: 0 for name in ENTITY_TO_TOPIC}
 
-    producer = KafkaProducer(
-        bootstrap_servers=settings.kafka_bootstrap_servers,
+    producer = create_producer(
+        settings.kafka_bootstrap_servers,
         client_id=settings.kafka_client_id,
-        value_serializer=lambda data: json.dumps(data, ensure_ascii=False).encode("utf-8"),
-        linger_ms=50,
+        value_serializer=dumps if payload_format == "json" else None,
     )
+    tracker = DeliveryTracker("raw-events")
 
     try:
         for entity_name, topic_attr in ENTITY_TO_TOPIC.items():
             topic_name = getattr(settings, topic_attr)
             folder = settings.data_dir / entity_name
 
-            for file_path in sorted(folder.glob("*.json")):
-                payload = _load_json(file_path)
-                payload = _hash_sensitive_fields(payload, hasher)
+            for payload in iter_documents(folder):
+                hashed = apply_pii_plan(
+                    payload, ENTITY_PII_PLANS[entity_name], lambda key, value: _hash_field(key, value, hasher)
+                )
+                payload = hashed if hashed is not None else _hash_sensitive_fields(payload, hasher)
                 object_id = _object_id(entity_name, payload)
 
-                event = {
-                    "source": entity_name,
-                    "object_id": object_id,
-                    "payload": json.dumps(payload, ensure_ascii=False),
-                    "event_ts": datetime.now(tz=timezone.utc).isoformat().replace("+00:00", "Z"),
-                }
-
-                producer.send(topic_name, key=object_id.encode("utf-8"), value=event)
+                if payload_format == "protobuf":
+                    # The schema-bound message replaces the JSON envelope; the key still carries object_id.
+                    event = encode_entity(entity_name, payload)
+                else:
+                    event = {
+                        "source": entity_name,
+                        "object_id": object_id,
+                        "payload": dumps_str(payload),
+                        "event_ts": datetime.now(tz=timezone.utc).isoformat().replace("+00:00", "Z"),
+                    }
+
+                tracker.track(producer.send(topic_name, key=object_id.encode("utf-8"), value=event))
                 counters[entity_name] += 1
 
         producer.flush()
+        tracker.raise_if_failed()
+        print(tracker.summary(producer))
+        print("PII hash cache:", hasher.cache_info())
     finally:
         producer.close()
 
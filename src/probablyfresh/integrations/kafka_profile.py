@@ -0,0 +1,167 @@
+﻿from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from kafka import KafkaProducer
+from kafka import codec as kafka_codec
+
+
+COMPRESSION_CODECS = {
+    "none": None,
+    "gzip": kafka_codec.has_gzip,
+    "snappy": kafka_codec.has_snappy,
+    "lz4": kafka_codec.has_lz4,
+    "zstd": kafka_codec.has_zstd,
+}
+COMPRESSION_PACKAGES = {"snappy": "python-snappy", "lz4": "lz4", "zstd": "zstandard"}
+ACKS_VALUES = {"0": 0, "1": 1, "all": "all"}
+MAX_LOGGED_ERRORS = 5
+
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, str(default)).strip()
+    try:
+        return int(raw)
+    except ValueError as exc:
+        raise ValueError(f"Environment variable {name} must be int, got {raw!r}") from exc
+
+
+
+@dataclass(frozen=True)
+class ProducerProfile:
+    batch_size: int = 256 * 1024
+    linger_ms: int = 20
+    compression_type: str = "zstd"
+    acks: str = "1"
+    max_in_flight: int = 5
+    buffer_memory: int = 64 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "ProducerProfile":
+        defaults = cls()
+        profile = cls(
+            batch_size=_env_int("KAFKA_BATCH_SIZE", defaults.batch_size),
+            linger_ms=_env_int("KAFKA_LINGER_MS", defaults.linger_ms),
+            compression_type=os.getenv("KAFKA_COMPRESSION_TYPE", defaults.compression_type).strip().lower(),
+            acks=os.getenv("KAFKA_ACKS", defaults.acks).strip().lower(),
+            max_in_flight=_env_int("KAFKA_MAX_IN_FLIGHT", defaults.max_in_flight),
+            buffer_memory=_env_int("KAFKA_BUFFER_MEMORY", defaults.buffer_memory),
+        )
+        profile.validate()
+        return profile
+
+    def validate(self) -> None:
+        if self.compression_type not in COMPRESSION_CODECS:
+            raise ValueError(
+                f"KAFKA_COMPRESSION_TYPE must be one of {sorted(COMPRESSION_CODECS)}, got {self.compression_type!r}"
+            )
+        has_codec = COMPRESSION_CODECS[self.compression_type]
+        if has_codec is not None and not has_codec():
+            package = COMPRESSION_PACKAGES.get(self.compression_type, self.compression_type)
+            raise RuntimeError(
+                f"Kafka compression {self.compression_type!r} requires the '{package}' package: pip install {package}"
+            )
+        if self.acks not in ACKS_VALUES:
+            raise ValueError(f"KAFKA_ACKS must be one of {sorted(ACKS_VALUES)}, got {self.acks!r}")
+        for name in ("batch_size", "max_in_flight", "buffer_memory"):
+            if getattr(self, name) < 1:
+                raise ValueError(f"Kafka producer {name} must be a positive integer")
+        if self.linger_ms < 0:
+            raise ValueError("Kafka producer linger_ms must be >= 0")
+
+    def producer_kwargs(self) -> dict[str, Any]:
+        return {
+            "batch_size": self.batch_size,
+            "linger_ms": self.linger_ms,
+            "compression_type": None if self.compression_type == "none" else self.compression_type,
+            "acks": ACKS_VALUES[self.acks],
+            "max_in_flight_requests_per_connection": self.max_in_flight,
+            "buffer_memory": self.buffer_memory,
+        }
+
+
+
+def create_producer(bootstrap_servers: str, profile: ProducerProfile | None = None, **kwargs: Any) -> KafkaProducer:
+    profile = profile or ProducerProfile.from_env()
+    return KafkaProducer(bootstrap_servers=bootstrap_servers, **profile.producer_kwargs(), **kwargs)
+
+
+
+class DeliveryTracker:
+    """Counts asynchronous Kafka deliveries via send() future callbacks instead of blocking per record."""
+
+    def __init__(self, name: str = "producer") -> None:
+        self.name = name
+        self.sent = 0
+        self.delivered = 0
+        self.failed = 0
+        self.delivered_bytes = 0
+        self.errors: list[str] = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def track(self, future: Any) -> None:
+        self.sent += 1
+        future.add_callback(self._on_success)
+        future.add_errback(self._on_error)
+
+    def _on_success(self, metadata: Any) -> None:
+        # Callbacks run on the producer's I/O thread.
+        size = max(metadata.serialized_key_size, 0) + max(metadata.serialized_value_size, 0)
+        with self._lock:
+            self.delivered += 1
+            self.delivered_bytes += size
+
+    def _on_error(self, exc: BaseException) -> None:
+        with self._lock:
+            self.failed += 1
+            if len(self.errors) < MAX_LOGGED_ERRORS:
+                self.errors.append(repr(exc))
+
+    def summary(self, producer: KafkaProducer | None = None) -> str:
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        line = (
+            f"[{self.name}] sent={self.sent} delivered={self.delivered} failed={self.failed} "
+            f"msgs_per_sec={self.delivered / elapsed:.0f} payload_mb={self.delivered_bytes / 1_048_576:.1f}"
+        )
+        if producer is not None:
+            metrics = producer.metrics().get("producer-metrics", {})
+            compression_rate = metrics.get("compression-rate-avg")
+            outgoing_bytes = metrics.get("outgoing-byte-rate")
+            if compression_rate is not None:
+                line += f" compression_rate_avg={compression_rate:.3f}"
+            if outgoing_bytes is not None:
+                line += f" outgoing_byte_rate={outgoing_bytes:.0f}"
+        return line
+
+    def counters(self) -> dict[str, Any]:
+        """Returns picklable delivery counters, e.g. to report a worker process's results to its parent."""
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "delivered_bytes": self.delivered_bytes,
+                "errors": list(self.errors),
+            }
+
+    def merge(self, counters: dict[str, Any]) -> None:
+        """Adds counters() of another tracker, so the parent can print one summary for all workers."""
+        with self._lock:
+            self.sent += counters["sent"]
+            self.delivered += counters["delivered"]
+            self.failed += counters["failed"]
+            self.delivered_bytes += counters["delivered_bytes"]
+            self.errors.extend(counters["errors"][: max(MAX_LOGGED_ERRORS - len(self.errors), 0)])
+
+    def raise_if_failed(self) -> None:
+        """Call after producer.flush(): every tracked future has completed by then."""
+        if self.failed:
+            raise RuntimeError(
+                f"[{self.name}] {self.failed} of {self.sent} Kafka deliveries failed, first errors: {self.errors}"
+            )
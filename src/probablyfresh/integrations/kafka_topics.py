@@ -0,0 +1,46 @@
+﻿from __future__ import annotations
+
+from typing import Iterable
+
+from kafka.admin import KafkaAdminClient, NewPartitions, NewTopic
+
+
+
+def ensure_topic_partitions(
+    bootstrap_servers: str,
+    topics: Iterable[str],
+    partitions: int,
+    replication_factor: int = 1,
+) -> dict[str, int]:
+    """Creates missing topics and grows existing ones to `partitions`; never shrinks a topic.
+
+    Adding partitions remaps keys for new messages, so the order of one key's
+    messages across the resize is not guaranteed (RAW/MART do not depend on it).
+    Returns the resulting partition count per topic.
+    """
+    if partitions < 1:
+        raise ValueError(f"Topic partition count must be a positive integer, got {partitions}")
+
+    topics = sorted(set(topics))
+    admin = KafkaAdminClient(bootstrap_servers=bootstrap_servers, client_id="probablyfresh-admin")
+    try:
+        existing = set(admin.list_topics())
+        missing = [name for name in topics if name not in existing]
+        if missing:
+            admin.create_topics(
+                [NewTopic(name, num_partitions=partitions, replication_factor=replication_factor) for name in missing]
+            )
+
+        counts = {name: partitions for name in missing}
+        to_grow: dict[str, NewPartitions] = {}
+        for description in admin.describe_topics([name for name in topics if name in existing]):
+            current = len(description["partitions"])
+            counts[description["topic"]] = max(current, partitions)
+            if current < partitions:
+                to_grow[description["topic"]] = NewPartitions(total_count=partitions)
+        if to_grow:
+            admin.create_partitions(to_grow)
+    finally:
+        admin.close()
+
+    return counts
@@ -0,0 +1,42 @@
+﻿from __future__ import annotations
+
+import time
+from typing import Any
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+
+
+def _find_key_index(collection, key_field: str) -> dict[str, Any] | None:
+    for name, info in collection.index_information().items():
+        if info.get("key") == [(key_field, ASCENDING)]:
+            return {"name": name, **info}
+    return None
+
+
+
+def ensure_unique_indexes(db, collection_keys: dict[str, str]) -> float:
+    """Creates unique ascending indexes on business keys and verifies them; returns elapsed seconds."""
+    started = time.perf_counter()
+
+    for collection_name, key_field in collection_keys.items():
+        collection = db[collection_name]
+        existing = _find_key_index(collection, key_field)
+        if existing is None:
+            try:
+                collection.create_index([(key_field, ASCENDING)], unique=True, name=f"{key_field}_unique")
+            except OperationFailure as exc:
+                raise RuntimeError(
+                    f"Cannot create unique index on {collection_name}.{key_field}: {exc}. "
+                    "Remove duplicate documents or drop the collection and reload."
+                ) from exc
+            existing = _find_key_index(collection, key_field)
+
+        if existing is None or not existing.get("unique"):
+            raise RuntimeError(
+                f"Index on {collection_name}.{key_field} is missing or not unique "
+                f"(found: {existing}); drop it so the loader can recreate it as unique."
+            )
+
+    return time.perf_counter() - started
@@ -1,12 +1,15 @@
 ﻿from __future__ import annotations
 
-import json
+import time
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 from probablyfresh.config import Settings
+from probablyfresh.core.datasets import iter_batches, iter_documents
+from probablyfresh.core.load_manifest import IncrementalStats, LoadManifest, manifest_path
+from probablyfresh.integrations.mongo_indexes import ensure_unique_indexes
 
 
 ENTITY_TO_COLLECTION = {
@@ -16,30 +19,63 @@ ENTITY_TO_COLLECTION = {
     "purchases": "purchases",
 }
 
+ENTITY_KEYS = {
+    "stores": "store_id",
+    "products": "id",
+    "customers": "customer_id",
+    "purchases": "purchase_id",
+}
+
+
+
+def _read_json_files(folder: Path) -> Iterator[dict[str, Any]]:
+    return iter_documents(folder)
+
 
 
-def _read_json_files(folder: Path) -> list[dict[str, Any]]:
-    documents: list[dict[str, Any]] = []
-    for file_path in sorted(folder.glob("*.json")):
-        documents.append(json.loads(file_path.read_text(encoding="utf-8")))
-    return documents
+def _load_incremental(settings: Settings, collection, entity_name: str) -> int:
+    key_field = ENTITY_KEYS[entity_name]
+    manifest = LoadManifest.load(manifest_path(settings.data_dir, entity_name), collection)
+    docs = manifest.iter_changed_documents(settings.data_dir / entity_name, key_field, IncrementalStats())
 
+    upserted = 0
+    for batch in iter_batches(docs, settings.mongo_batch_size):
+        operations = [UpdateOne({key_field: doc[key_field]}, {"$set": doc}, upsert=True) for doc in batch]
+        collection.bulk_write(operations, ordered=False)
+        upserted += len(batch)
 
+    manifest.save()
+    return upserted
 
-def load_to_mongodb(settings: Settings) -> dict[str, int]:
+
+
+def load_to_mongodb(settings: Settings, timings: dict[str, float] | None = None) -> dict[str, int]:
     inserted_counts: dict[str, int] = {}
 
     with MongoClient(settings.mongo_uri) as client:
         db = client[settings.mongo_db]
+        index_seconds = ensure_unique_indexes(
+            db, {ENTITY_TO_COLLECTION[entity]: key for entity, key in ENTITY_KEYS.items()}
+        )
+        started = time.perf_counter()
 
         for entity_name, collection_name in ENTITY_TO_COLLECTION.items():
             folder = settings.data_dir / entity_name
-            docs = _read_json_files(folder)
             collection = db[collection_name]
 
+            if settings.mongo_load_incremental:
+                inserted_counts[entity_name] = _load_incremental(settings, collection, entity_name)
+                continue
+
             collection.delete_many({})
-            if docs:
-                collection.insert_many(docs)
-            inserted_counts[entity_name] = len(docs)
+            inserted = 0
+            for batch in iter_batches(_read_json_files(folder), settings.mongo_batch_size):
+                collection.insert_many(batch, ordered=False)
+                inserted += len(batch)
+            inserted_counts[entity_name] = inserted
+
+        if timings is not None:
+            timings["indexes_seconds"] = index_seconds
+            timings["load_seconds"] = time.perf_counter() - started
 
     return inserted_counts
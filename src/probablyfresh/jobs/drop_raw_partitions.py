@@ -0,0 +1,23 @@
+﻿import argparse
+
+from probablyfresh.config import get_settings
+from probablyfresh.integrations.clickhouse_client import drop_expired_partitions
+
+
+if __name__ == "__main__":
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Drop raw ClickHouse partitions older than the retention window.")
+    parser.add_argument(
+        "--ttl-days",
+        type=int,
+        default=settings.clickhouse_raw_ttl_days,
+        help="Retention window in days (default: CLICKHOUSE_RAW_TTL_DAYS).",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only list the partitions that would be dropped.")
+    args = parser.parse_args()
+
+    dropped = drop_expired_partitions(settings, args.ttl_days, dry_run=args.dry_run)
+    action = "Would drop" if args.dry_run else "Dropped"
+    for table, partition_id in dropped:
+        print(f"{action} {settings.clickhouse_db}.{table} partition {partition_id}")
+    print(f"{action} {len(dropped)} partitions")
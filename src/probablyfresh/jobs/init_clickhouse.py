@@ -1,9 +1,82 @@
-﻿from probablyfresh.config import get_settings
-from probablyfresh.integrations.clickhouse_client import run_init_sql
+﻿import argparse
+
+from probablyfresh.config import get_settings
+from probablyfresh.integrations.clickhouse_client import (
+    RawRetention,
+    installed_kafka_payload_format,
+    kafka_engine_settings,
+    run_init_sql,
+)
+from probablyfresh.integrations.kafka_topics import ensure_topic_partitions
+
+
+INIT_SQL_FILES = ("01_init.sql", "02_mart.sql")
+PROTOBUF_INGEST_SQL = "03_protobuf_ingest.sql"
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provision Kafka topics and apply ClickHouse init SQL.")
+    parser.add_argument(
+        "--recreate-kafka-tables",
+        action="store_true",
+        help="Drop and recreate Kafka engine tables and their views so new CLICKHOUSE_KAFKA_* values apply.",
+    )
+    parser.add_argument(
+        "--kafka-payload-format",
+        choices=("json", "protobuf"),
+        default=None,
+        help="RAW ingestion format. Defaults to the one currently installed in ClickHouse (json for a new install).",
+    )
+    parser.add_argument("--skip-topics", action="store_true", help="Do not create or grow Kafka topics.")
+    args = parser.parse_args()
+
     settings = get_settings()
-    sql_path = settings.project_root / "infra" / "clickhouse" / "init.sql"
-    executed = run_init_sql(settings, sql_path)
-    print(f"ClickHouse init completed, statements executed: {executed}")
+    kafka_overrides = kafka_engine_settings(settings)
+    raw_retention = RawRetention.from_settings(settings)
+    if settings.clickhouse_kafka_num_consumers > settings.kafka_topic_partitions:
+        print(
+            f"Warning: CLICKHOUSE_KAFKA_NUM_CONSUMERS={settings.clickhouse_kafka_num_consumers} exceeds "
+            f"KAFKA_TOPIC_PARTITIONS={settings.kafka_topic_partitions}; extra consumers will stay idle"
+        )
+
+    if not args.skip_topics:
+        partitions = ensure_topic_partitions(
+            settings.kafka_bootstrap_servers,
+            [
+                settings.kafka_topic_stores,
+                settings.kafka_topic_products,
+                settings.kafka_topic_customers,
+                settings.kafka_topic_purchases,
+            ],
+            settings.kafka_topic_partitions,
+        )
+        print("Kafka topic partitions:", partitions)
+
+    print("Kafka engine settings:", kafka_overrides)
+    print("Raw retention:", raw_retention.ttl_clause())
+    # 01_init.sql only knows the JSON (RawBLOB) Kafka tables. When Protobuf ingestion is installed
+    # or requested, they are (re)created from optional/03 instead, so producers and tables stay in sync.
+    installed_format = installed_kafka_payload_format(settings)
+    payload_format = args.kafka_payload_format or installed_format or "json"
+    print("Kafka payload format:", payload_format, f"(installed: {installed_format or 'none'})")
+
+    clickhouse_dir = settings.project_root / "docker" / "clickhouse"
+    for file_name in INIT_SQL_FILES:
+        executed = run_init_sql(
+            settings,
+            clickhouse_dir / "init" / file_name,
+            kafka_overrides=kafka_overrides,
+            recreate_kafka_tables=payload_format == "json"
+            and (args.recreate_kafka_tables or installed_format == "protobuf"),
+            raw_retention=raw_retention,
+        )
+        print(f"ClickHouse init {file_name} completed, statements executed: {executed}")
+
+    if payload_format == "protobuf" and (args.recreate_kafka_tables or installed_format != "protobuf"):
+        # 03 drops and recreates the Kafka tables and their views itself.
+        executed = run_init_sql(
+            settings,
+            clickhouse_dir / "optional" / PROTOBUF_INGEST_SQL,
+            kafka_overrides=kafka_overrides,
+        )
+        print(f"ClickHouse init {PROTOBUF_INGEST_SQL} completed, statements executed: {executed}")
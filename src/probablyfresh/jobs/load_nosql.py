@@ -4,5 +4,7 @@ from probablyfresh.integrations.mongo_loader import load_to_mongodb
 
 if __name__ == "__main__":
     settings = get_settings()
-    counters = load_to_mongodb(settings)
-    print("Loaded JSON into MongoDB:", counters)
+    timings: dict[str, float] = {}
+    counters = load_to_mongodb(settings, timings)
+    print(f"Ensured unique indexes in {timings['indexes_seconds']:.2f}s")
+    print("Loaded JSON into MongoDB:", counters, f"in {timings['load_seconds']:.2f}s")
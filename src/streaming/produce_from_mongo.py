@@ -1,21 +1,28 @@
 ﻿from __future__ import annotations
 
 import argparse
-import json
 import logging
 import os
-import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable
 
+from bson import json_util
 from kafka import KafkaProducer
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(REPO_ROOT / "src"))
 
 from probablyfresh.core.crypto_utils import PIIHasher
+from probablyfresh.core.normalization import normalize_email, normalize_phone_strict
+from probablyfresh.core.pii_plans import ENTITY_PII_PLANS, apply_pii_plan
+from probablyfresh.core.protobuf import PAYLOAD_FORMATS, encode_entity
+from probablyfresh.core.serialization import dumps
+from probablyfresh.integrations.kafka_profile import DeliveryTracker, create_producer
 
 
 ENTITY_TO_TOPIC_ENV = {
@@ -27,6 +34,26 @@ ENTITY_TO_TOPIC_ENV = {
 
 PII_ENTITIES = {"customers", "purchases"}
 
+ENTITY_KEYS = {
+    "stores": "store_id",
+    "products": "id",
+    "customers": "customer_id",
+    "purchases": "purchase_id",
+}
+
+DEFAULT_CURSOR_BATCH_SIZE = 1000
+# Boundaries are taken from a random sample, so ranges are only roughly equal in size.
+RANGE_SAMPLE_PER_PARTITION = 1000
+
+CHANGE_STREAM_OPERATIONS = ["insert", "update", "replace"]
+DEFAULT_RESUME_TOKEN_FILE = REPO_ROOT / "data" / ".change_stream_resume_token.json"
+DEFAULT_FLUSH_INTERVAL_MS = 1000
+DEFAULT_MAX_AWAIT_MS = 500
+# "$changeStream stage is only supported on replica sets"
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+
+_WORKER_CONTEXT: dict[str, Any] = {}
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Publish MongoDB documents to Kafka topics.")
@@ -35,10 +62,67 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Read all documents from Mongo collections once and exit.",
     )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Publish inserts/updates continuously from a MongoDB change stream (requires a replica set).",
+    )
+    parser.add_argument(
+        "--resume-token-file",
+        type=Path,
+        default=Path(os.getenv("PRODUCER_RESUME_TOKEN_FILE", str(DEFAULT_RESUME_TOKEN_FILE))),
+        help="Where --follow persists the change stream resume token.",
+    )
+    parser.add_argument(
+        "--flush-interval-ms",
+        type=int,
+        default=DEFAULT_FLUSH_INTERVAL_MS,
+        help="In --follow mode, flush Kafka and persist the resume token at least this often.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes, each with its own Mongo cursor(s) and Kafka producer (1 = single loop).",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=None,
+        help="Business-key ranges per collection in parallel mode (default: 4 x workers).",
+    )
+    parser.add_argument(
+        "--payload-format",
+        choices=PAYLOAD_FORMATS,
+        default=os.getenv("KAFKA_PAYLOAD_FORMAT", "json").strip().lower() or "json",
+        help="Kafka message encoding; protobuf needs the ClickHouse tables from 03_protobuf_ingest.sql.",
+    )
+    parser.add_argument(
+        "--cursor-batch-size",
+        type=int,
+        default=DEFAULT_CURSOR_BATCH_SIZE,
+        help="Documents fetched per Mongo cursor round-trip.",
+    )
     args = parser.parse_args()
 
-    if not args.once:
-        raise SystemExit("This producer currently supports only '--once' mode.")
+    if not args.once and not args.follow:
+        raise SystemExit("Specify '--once' to publish a snapshot or '--follow' to stream changes.")
+    if args.once and args.follow:
+        parser.error("--once and --follow are mutually exclusive")
+    if args.follow and args.workers != 1:
+        parser.error("--workers is only supported with --once")
+    if args.flush_interval_ms < 1:
+        parser.error("--flush-interval-ms must be a positive integer")
+    if not args.resume_token_file.is_absolute():
+        args.resume_token_file = REPO_ROOT / args.resume_token_file
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if args.cursor_batch_size < 1:
+        parser.error("--cursor-batch-size must be a positive integer")
+    if args.partitions is None:
+        args.partitions = args.workers * 4
+    if args.partitions < 1:
+        parser.error("--partitions must be a positive integer")
 
     return args
 
@@ -64,49 +148,31 @@ def get_pii_hash_salt() -> str:
     raise RuntimeError("Environment variable PII_HASH_SALT is required")
 
 
-def normalize_email(value: str) -> str:
-    return value.strip().lower()
-
-
-def normalize_phone(value: str) -> tuple[str, bool]:
-    original = value
-    cleaned = re.sub(r"[\s()\-]", "", value.strip())
-
-    if cleaned.startswith("+"):
-        return cleaned, True
-
-    if re.fullmatch(r"8\d{10}", cleaned):
-        return "+7" + cleaned[1:], True
-
-    if re.fullmatch(r"7\d{10}", cleaned):
-        return "+7" + cleaned[1:], True
+def hash_text(hasher: PIIHasher, value: str) -> str:
+    return hasher.hash_value(value)
 
-    return original, False
 
+def hash_pii_field(key: str, value: str, hasher: PIIHasher, entity_name: str, doc_id: str) -> str:
+    if key == "email":
+        return hash_text(hasher, normalize_email(value))
 
-def hash_text(hasher: PIIHasher, value: str) -> str:
-    return hasher.hash_value(value)
+    normalized, ok = normalize_phone_strict(value)
+    if not ok:
+        logging.warning(
+            "[%s][%s] Could not normalize phone %r; leaving as-is before hashing",
+            entity_name,
+            doc_id,
+            value,
+        )
+    return hash_text(hasher, normalized)
 
 
 def transform_pii(value: Any, hasher: PIIHasher, entity_name: str, doc_id: str) -> Any:
     if isinstance(value, dict):
         transformed: dict[str, Any] = {}
         for key, nested_value in value.items():
-            if key == "email" and isinstance(nested_value, str):
-                normalized = normalize_email(nested_value)
-                transformed[key] = hash_text(hasher, normalized)
-                continue
-
-            if key == "phone" and isinstance(nested_value, str):
-                normalized, ok = normalize_phone(nested_value)
-                if not ok:
-                    logging.warning(
-                        "[%s][%s] Could not normalize phone %r; leaving as-is before hashing",
-                        entity_name,
-                        doc_id,
-                        nested_value,
-                    )
-                transformed[key] = hash_text(hasher, normalized)
+            if key in ("email", "phone") and isinstance(nested_value, str):
+                transformed[key] = hash_pii_field(key, nested_value, hasher, entity_name, doc_id)
                 continue
 
             transformed[key] = transform_pii(nested_value, hasher, entity_name, doc_id)
@@ -125,20 +191,199 @@ def resolve_topics() -> dict[str, str]:
     return topics
 
 
-def main() -> None:
-    parse_args()
-
+def build_payload(
+    document: dict[str, Any], entity_name: str, hasher: PIIHasher, payload_format: str = "json"
+) -> bytes:
+    document.pop("_id", None)
+
+    if entity_name in PII_ENTITIES:
+        doc_id_key = "customer_id" if entity_name == "customers" else "purchase_id"
+        doc_id = str(document.get(doc_id_key, "unknown"))
+        payload_doc = apply_pii_plan(
+            document,
+            ENTITY_PII_PLANS[entity_name],
+            lambda key, value: hash_pii_field(key, value, hasher, entity_name, doc_id),
+        )
+        if payload_doc is None:
+            # Unexpected shape: PII could be anywhere, so walk the whole document.
+            payload_doc = transform_pii(document, hasher, entity_name, doc_id)
+    else:
+        payload_doc = document
+
+    if payload_format == "protobuf":
+        return encode_entity(entity_name, payload_doc)
+    return dumps(payload_doc)
+
+
+def send_document(
+    producer: KafkaProducer,
+    tracker: DeliveryTracker,
+    document: dict[str, Any],
+    entity_name: str,
+    topic_name: str,
+    hasher: PIIHasher,
+    payload_format: str = "json",
+) -> None:
+    # Keying by business id keeps every version of an entity in one partition, in order.
+    business_id = document.get(ENTITY_KEYS[entity_name])
+    key = str(business_id).encode("utf-8") if business_id is not None else None
+    value = build_payload(document, entity_name, hasher, payload_format)
+    tracker.track(producer.send(topic_name, key=key, value=value))
+
+
+def publish_documents(
+    producer: KafkaProducer,
+    tracker: DeliveryTracker,
+    documents: Iterable[dict[str, Any]],
+    entity_name: str,
+    topic_name: str,
+    hasher: PIIHasher,
+    payload_format: str = "json",
+) -> int:
+    published = 0
+    for document in documents:
+        send_document(producer, tracker, document, entity_name, topic_name, hasher, payload_format)
+        published += 1
+    return published
+
+
+def plan_key_ranges(collection, key_field: str, partitions: int) -> list[dict[str, Any]]:
+    """Splits a collection into contiguous business-key ranges and returns one Mongo filter per range.
+
+    The first and last ranges are open-ended, so documents outside the sampled
+    boundaries (or without the key at all) are still covered exactly once.
+    """
+    if partitions == 1:
+        return [{}]
+
+    sample_size = partitions * RANGE_SAMPLE_PER_PARTITION
+    buckets = collection.aggregate(
+        [
+            {"$sample": {"size": sample_size}},
+            {"$match": {key_field: {"$type": "string"}}},
+            {"$bucketAuto": {"groupBy": f"${key_field}", "buckets": partitions}},
+        ]
+    )
+    boundaries = sorted({bucket["_id"]["min"] for bucket in buckets})[1:]
+    if not boundaries:
+        return [{}]
+
+    filters: list[dict[str, Any]] = [{key_field: {"$not": {"$gte": boundaries[0]}}}]
+    for lower, upper in zip(boundaries, boundaries[1:]):
+        filters.append({key_field: {"$gte": lower, "$lt": upper}})
+    filters.append({key_field: {"$gte": boundaries[-1]}})
+    return filters
+
+
+def _init_worker(
+    mongo_uri: str,
+    mongo_db: str,
+    bootstrap_servers: str,
+    pii_hash_salt: str,
+    cursor_batch_size: int,
+    payload_format: str,
+) -> None:
+    # Only plain settings and the hash cache live for the whole worker: atexit handlers never
+    # run in ProcessPoolExecutor workers, so clients are opened and closed per range instead.
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    _WORKER_CONTEXT.update(
+        mongo_uri=mongo_uri,
+        mongo_db=mongo_db,
+        bootstrap_servers=bootstrap_servers,
+        hasher=PIIHasher(pii_hash_salt),
+        cursor_batch_size=cursor_batch_size,
+        payload_format=payload_format,
+    )
 
-    mongo_uri = get_required_env("MONGO_URI")
-    mongo_db = get_required_env("MONGO_DB")
-    bootstrap_servers = get_required_env("KAFKA_BOOTSTRAP_SERVERS")
-    pii_hash_salt = get_pii_hash_salt()
 
-    topics = resolve_topics()
-    hasher = PIIHasher(pii_hash_salt)
+def publish_range(
+    entity_name: str, topic_name: str, mongo_filter: dict[str, Any]
+) -> tuple[str, int, dict[str, Any], tuple[int, int]]:
+    """Publishes one key range and returns (entity, published, tracker counters, (cache hits, cache misses))."""
+    ctx = _WORKER_CONTEXT
+    hasher = ctx["hasher"]
+    cache_before = hasher.cache_info()
+    # Clients are created after the fork: neither MongoClient nor KafkaProducer is fork-safe.
+    producer = create_producer(ctx["bootstrap_servers"])
+    tracker = DeliveryTracker(f"mongo->kafka pid={os.getpid()}")
+    try:
+        with MongoClient(ctx["mongo_uri"]) as mongo_client:
+            cursor = mongo_client[ctx["mongo_db"]][entity_name].find(
+                mongo_filter,
+                projection={"_id": 0},
+                batch_size=ctx["cursor_batch_size"],
+            )
+            published = publish_documents(
+                producer, tracker, cursor, entity_name, topic_name, hasher, ctx["payload_format"]
+            )
+        # Flush per range so a finished task means its records were acknowledged.
+        producer.flush()
+        tracker.raise_if_failed()
+    finally:
+        producer.close()
+
+    cache_after = hasher.cache_info()
+    cache_delta = (cache_after.hits - cache_before.hits, cache_after.misses - cache_before.misses)
+    return entity_name, published, tracker.counters(), cache_delta
+
+
+def publish_parallel(
+    args: argparse.Namespace,
+    mongo_uri: str,
+    mongo_db: str,
+    bootstrap_servers: str,
+    pii_hash_salt: str,
+    topics: dict[str, str],
+) -> dict[str, int]:
+    # Plan with a short-lived client that is closed before worker processes fork.
+    with MongoClient(mongo_uri) as mongo_client:
+        db = mongo_client[mongo_db]
+        tasks = [
+            (entity_name, topic_name, mongo_filter)
+            for entity_name, topic_name in topics.items()
+            for mongo_filter in plan_key_ranges(db[entity_name], ENTITY_KEYS[entity_name], args.partitions)
+        ]
+    logging.info("Publishing %s key ranges with %s worker processes", len(tasks), args.workers)
 
-    producer = KafkaProducer(bootstrap_servers=bootstrap_servers)
+    published: dict[str, int] = {name: 0 for name in ENTITY_TO_TOPIC_ENV}
+    tracker = DeliveryTracker(f"mongo->kafka workers={args.workers}")
+    cache_hits = cache_misses = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(
+            mongo_uri,
+            mongo_db,
+            bootstrap_servers,
+            pii_hash_salt,
+            args.cursor_batch_size,
+            args.payload_format,
+        ),
+    ) as pool:
+        futures = [pool.submit(publish_range, *task) for task in tasks]
+        for future in futures:
+            entity_name, count, counters, (hits, misses) = future.result()
+            published[entity_name] += count
+            tracker.merge(counters)
+            cache_hits += hits
+            cache_misses += misses
+
+    logging.info(tracker.summary())
+    logging.info("PII hash cache: hits=%s misses=%s (summed over workers)", cache_hits, cache_misses)
+    return published
+
+
+def publish_sequential(
+    args: argparse.Namespace,
+    mongo_uri: str,
+    mongo_db: str,
+    bootstrap_servers: str,
+    pii_hash_salt: str,
+    topics: dict[str, str],
+) -> dict[str, int]:
+    hasher = PIIHasher(pii_hash_salt)
+    producer = create_producer(bootstrap_servers)
+    tracker = DeliveryTracker("mongo->kafka")
     published: dict[str, int] = {name: 0 for name in ENTITY_TO_TOPIC_ENV}
 
     try:
@@ -146,25 +391,150 @@ def main() -> None:
             db = mongo_client[mongo_db]
 
             for entity_name, topic_name in topics.items():
-                collection = db[entity_name]
-                for document in collection.find({}):
-                    document.pop("_id", None)
+                cursor = db[entity_name].find(
+                    {}, projection={"_id": 0}, batch_size=args.cursor_batch_size
+                )
+                published[entity_name] += publish_documents(
+                    producer, tracker, cursor, entity_name, topic_name, hasher, args.payload_format
+                )
+
+        producer.flush()
+        tracker.raise_if_failed()
+        logging.info(tracker.summary(producer))
+        logging.info("PII hash cache: %s", hasher.cache_info())
+    finally:
+        producer.close()
+
+    return published
 
-                    if entity_name in PII_ENTITIES:
-                        doc_id_key = "customer_id" if entity_name == "customers" else "purchase_id"
-                        doc_id = str(document.get(doc_id_key, "unknown"))
-                        payload_doc = transform_pii(document, hasher, entity_name, doc_id)
-                    else:
-                        payload_doc = document
 
-                    payload_json = json.dumps(payload_doc, ensure_ascii=False)
-                    producer.send(topic_name, value=payload_json.encode("utf-8"))
-                    published[entity_name] += 1
+def load_resume_token(path: Path) -> dict[str, Any] | None:
+    if not path.exists():
+        return None
+    return json_util.loads(path.read_text(encoding="utf-8"))
 
+
+def save_resume_token(path: Path, token: dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json_util.dumps(token), encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def follow_changes(
+    args: argparse.Namespace,
+    mongo_uri: str,
+    mongo_db: str,
+    bootstrap_servers: str,
+    pii_hash_salt: str,
+    topics: dict[str, str],
+) -> dict[str, int]:
+    hasher = PIIHasher(pii_hash_salt)
+    producer = create_producer(bootstrap_servers)
+    tracker = DeliveryTracker("mongo->kafka")
+    published: dict[str, int] = {name: 0 for name in ENTITY_TO_TOPIC_ENV}
+    resume_token = load_resume_token(args.resume_token_file)
+    flush_interval = args.flush_interval_ms / 1000
+    pipeline = [
+        {
+            "$match": {
+                "operationType": {"$in": CHANGE_STREAM_OPERATIONS},
+                "ns.coll": {"$in": list(topics)},
+            }
+        }
+    ]
+
+    if resume_token is None:
+        logging.info("No resume token at %s, following changes from now", args.resume_token_file)
+    else:
+        logging.info("Resuming change stream from %s", args.resume_token_file)
+
+    def checkpoint(token: dict[str, Any] | None) -> None:
+        # Persist the token only after Kafka acknowledged everything before it (at-least-once).
         producer.flush()
+        tracker.raise_if_failed()
+        if token is not None:
+            save_resume_token(args.resume_token_file, token)
+
+    stream = None
+    try:
+        with MongoClient(mongo_uri) as mongo_client:
+            db = mongo_client[mongo_db]
+            try:
+                stream = db.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    max_await_time_ms=min(DEFAULT_MAX_AWAIT_MS, args.flush_interval_ms),
+                )
+            except OperationFailure as exc:
+                if exc.code == CHANGE_STREAM_NOT_SUPPORTED:
+                    raise RuntimeError(
+                        "--follow needs MongoDB change streams, which require a replica set "
+                        "(see RUNBOOK_DOCKER.md, step 9)"
+                    ) from exc
+                raise
+
+            with stream:
+                last_flush = time.monotonic()
+                pending = 0
+                while stream.alive:
+                    change = stream.try_next()
+                    if change is not None:
+                        entity_name = change["ns"]["coll"]
+                        document = change.get("fullDocument")
+                        # updateLookup yields None when the document was deleted after the update.
+                        if document is not None:
+                            send_document(
+                                producer,
+                                tracker,
+                                document,
+                                entity_name,
+                                topics[entity_name],
+                                hasher,
+                                args.payload_format,
+                            )
+                            published[entity_name] += 1
+                            pending += 1
+
+                    # The token also advances while idle, so restarts skip already-scanned oplog.
+                    if time.monotonic() - last_flush >= flush_interval:
+                        checkpoint(stream.resume_token)
+                        if pending:
+                            logging.info("Published %s change events", pending)
+                        pending = 0
+                        last_flush = time.monotonic()
+    except KeyboardInterrupt:
+        logging.info("Stopping change stream follower")
+        checkpoint(stream.resume_token if stream is not None else None)
+        logging.info(tracker.summary(producer))
+        logging.info("PII hash cache: %s", hasher.cache_info())
     finally:
         producer.close()
 
+    return published
+
+
+def main() -> None:
+    args = parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    mongo_uri = get_required_env("MONGO_URI")
+    mongo_db = get_required_env("MONGO_DB")
+    bootstrap_servers = get_required_env("KAFKA_BOOTSTRAP_SERVERS")
+    pii_hash_salt = get_pii_hash_salt()
+
+    topics = resolve_topics()
+    logging.info("Kafka payload format: %s", args.payload_format)
+
+    if args.follow:
+        published = follow_changes(args, mongo_uri, mongo_db, bootstrap_servers, pii_hash_salt, topics)
+    elif args.workers > 1:
+        published = publish_parallel(args, mongo_uri, mongo_db, bootstrap_servers, pii_hash_salt, topics)
+    else:
+        published = publish_sequential(args, mongo_uri, mongo_db, bootstrap_servers, pii_hash_salt, topics)
+
     for entity_name, count in published.items():
         logging.info("Published %s records to topic %s", count, topics[entity_name])
 